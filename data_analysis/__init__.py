@@ -1 +1,10 @@
-from .sleep_scores import st_devs, social_jet_lag, sleep_regularity_index, interdaily_stability
\ No newline at end of file
+# functions resolved on first access, so importing one submodule doesn't import sleep_scores and its data loading
+
+from data_handling.lazy_exports import lazy_exports
+
+__getattr__, __dir__ = lazy_exports(__name__, {
+    "st_devs": "sleep_scores",
+    "social_jet_lag": "sleep_scores",
+    "sleep_regularity_index": "sleep_scores",
+    "interdaily_stability": "sleep_scores",
+})
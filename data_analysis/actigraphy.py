@@ -0,0 +1,272 @@
+"""
+Sleep/wake classification straight from the watch's minute level monitoring data (garmin_monitoring.db)
+- Cole-Kripke style weighted sum of activity over a 7 minute window (np.convolve over the whole range)
+- heart rate dip criterion: a minute only counts as sleep if HR is a few bpm below the period's usual HR
+- sleep bouts shorter than min_sleep_bout minutes are rescored as wake
+- minutes the watch has no data for (not worn, not synced yet) are unknown rather than sleep, and a night
+  with too few known minutes gives no sleep at all
+Works for naps, fragmented nights and nights with no sleep JSON.
+
+GarminDB stores monitoring timestamps as local wall clock time.
+"""
+
+import sqlite3
+from datetime import datetime, timedelta
+
+import numpy as np
+
+monitoring_db_path = "HealthData/DBs/garmin_monitoring.db"
+
+# Cole-Kripke weights for the activity at minutes t-4 .. t+2
+cole_kripke_weights = np.array([106, 54, 58, 76, 230, 74, 67])
+# Garmin intensity is 0-7 rather than raw counts, scale chosen so resting intensities (<= 2) score as sleep
+cole_kripke_scale = 0.0005
+
+intensity_hold = 60  # minutes an intensity reading is carried forward (the watch logs a row when it changes)
+hr_hold = 5          # minutes a heart rate reading is carried forward (HR is logged every 2 minutes)
+hr_dip = 5           # bpm below the reference HR of the loaded period needed to count as sleep
+hr_reference = 75    # percentile of the period's HR the dip is measured from, the median sits too low when
+                     # the watch was off for much of the day
+min_sleep_bout = 30  # minutes
+min_main_sleep = 180 # minutes, shorter sleeps are naps rather than the night's sleep
+max_wake_gap = 45    # wake spells shorter than this don't split the main sleep of a night
+min_coverage = 0.5   # share of the searched minutes, and of the main sleep, that must be known
+
+# window searched for the main sleep of a night, relative to 00:00 on the wake-up date
+night_search_start = timedelta(hours=-6)
+night_search_end = timedelta(hours=14)
+
+
+def load_minute_series(start, end, db_path=None):
+    """
+    Reads activity intensity and heart rate between two local times into per-minute arrays
+    (indexed time range reads on the timestamp primary keys)
+
+    Parameters:
+    - start (datetime): first minute, local time
+    - end (datetime): end of the range (exclusive), local time
+    - db_path (str): garmin_monitoring.db location
+
+    Returns:
+    - dict: {"start": datetime, "activity": float array, "heart_rate": float array}, NaN where missing
+    """
+    n_minutes = int((end - start).total_seconds() // 60)
+    start_str = start.strftime("%Y-%m-%d %H:%M:%S")
+    end_str = end.strftime("%Y-%m-%d %H:%M:%S")
+
+    with sqlite3.connect(db_path or monitoring_db_path) as conn:
+        activity_rows = conn.execute(
+            "SELECT timestamp, intensity FROM monitoring WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp",
+            (start_str, end_str)
+        ).fetchall()
+        hr_rows = conn.execute(
+            "SELECT timestamp, heart_rate FROM monitoring_hr WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp",
+            (start_str, end_str)
+        ).fetchall()
+
+    def minute_offsets(rows):
+        times = np.array([row[0][:16] for row in rows], dtype="datetime64[m]")
+        return (times - np.datetime64(start, "m")).astype(np.int64)
+
+    activity_times = minute_offsets(activity_rows)
+    activity = np.array([row[1] if row[1] is not None else np.nan for row in activity_rows], dtype=float)
+    hr_times = minute_offsets(hr_rows)
+    heart_rate = np.array([row[1] for row in hr_rows], dtype=float)
+
+    return {
+        "start": start,
+        "activity": hold_forward(activity_times, activity, n_minutes, intensity_hold),
+        "heart_rate": hold_forward(hr_times, heart_rate, n_minutes, hr_hold)
+    }
+
+
+def hold_forward(times, values, n_minutes, max_age):
+    """
+    Spreads sparse readings onto a per-minute grid, each reading holding for up to max_age minutes
+
+    Parameters:
+    - times (array): sorted minute offsets of the readings
+    - values (array): reading values
+    - n_minutes (int): length of the grid
+    - max_age (int): minutes a reading stays valid
+
+    Returns:
+    - np.ndarray: per-minute values, NaN where no reading is recent enough
+    """
+    grid = np.arange(n_minutes)
+    latest = np.searchsorted(times, grid, side="right") - 1
+    has_reading = latest >= 0
+    age = grid - times[np.maximum(latest, 0)] if len(times) else np.full(n_minutes, np.inf)
+
+    out = np.full(n_minutes, np.nan)
+    fresh = has_reading & (age <= max_age)
+    out[fresh] = values[latest[fresh]]
+
+    # when several readings land on the same minute keep the largest
+    if len(times):
+        on_grid = (times >= 0) & (times < n_minutes)
+        np.fmax.at(out, times[on_grid], values[on_grid])
+
+    return out
+
+
+def cole_kripke(activity, weights=cole_kripke_weights, scale=cole_kripke_scale):
+    """
+    Weighted sum of activity around every minute in one convolution. Unknown (NaN) neighbours are left out
+    and the known ones scaled up to the full weight, so missing data doesn't read as stillness.
+
+    Returns:
+    np.ndarray: D score per minute, sleep when D < 1, NaN where the minute itself is unknown
+    """
+    known = ~np.isnan(activity)
+    kernel = weights[::-1].astype(float)
+
+    total = np.convolve(np.pad(np.where(known, activity, 0), (4, 2)), kernel, mode="valid")
+    weight = np.convolve(np.pad(known.astype(float), (4, 2)), kernel, mode="valid")
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        score = scale * total * weights.sum() / weight
+
+    return np.where(known, score, np.nan)
+
+
+def run_bounds(mask):
+    """
+    Returns (starts, ends) of the runs of True in a boolean array, ends exclusive
+    """
+    edges = np.diff(np.r_[0, mask.astype(np.int8), 0])
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def remove_short_runs(mask, min_length):
+    """
+    Sets runs of True shorter than min_length to False
+    """
+    starts, ends = run_bounds(mask)
+    short = (ends - starts) < min_length
+
+    change = np.zeros(len(mask) + 1, dtype=int)
+    np.add.at(change, starts[short], 1)
+    np.add.at(change, ends[short], -1)
+
+    return mask & ~(np.cumsum(change)[:-1] > 0)
+
+
+def known_minutes(activity, heart_rate):
+    """
+    Minutes the watch has data for: activity and heart rate both known. A range without any heart rate
+    (a device that doesn't log it) is judged on activity alone.
+    """
+    known = ~np.isnan(activity)
+    if not np.isnan(heart_rate).all():
+        known &= ~np.isnan(heart_rate)
+
+    return known
+
+
+def classify_sleep_wake(activity, heart_rate, dip=hr_dip, min_bout=min_sleep_bout):
+    """
+    Per-minute sleep/wake classification
+
+    Parameters:
+    - activity (array): per-minute activity intensity, NaN where missing
+    - heart_rate (array): per-minute heart rate, NaN where missing
+    - dip (float): bpm below the reference HR required for sleep
+    - min_bout (int): shortest sleep bout kept, in minutes
+
+    Returns:
+    - np.ndarray: float array, 0 for sleep and 1 for awake (same convention as sleep_wake_matrix),
+                  NaN for unknown minutes
+    """
+    known = known_minutes(activity, heart_rate)
+
+    with np.errstate(invalid="ignore"):
+        low_activity = cole_kripke(activity) < 1
+        if np.isnan(heart_rate).all():
+            low_hr = np.ones(len(heart_rate), dtype=bool)
+        else:
+            low_hr = heart_rate <= np.nanpercentile(heart_rate, hr_reference) - dip
+
+    asleep = remove_short_runs(known & low_activity & low_hr, min_bout)
+
+    return np.where(known, (~asleep).astype(float), np.nan)
+
+
+def actigraphy_sleep_wake(start, end, db_path=None, coverage=min_coverage):
+    """
+    Classifies every minute between two local times
+
+    Returns:
+    np.ndarray: per-minute 0 (sleep) / 1 (awake) / NaN (unknown), None if fewer than coverage of the
+                minutes are known
+    """
+    series = load_minute_series(start, end, db_path)
+    minutes = classify_sleep_wake(series["activity"], series["heart_rate"])
+
+    if not len(minutes) or np.mean(~np.isnan(minutes)) < coverage:
+        return None
+
+    return minutes
+
+
+def actigraphy_main_sleep(date, db_path=None):
+    """
+    Finds the main sleep of the night ending on date: the longest sleep period once awakenings (or
+    unknown spells) shorter than max_wake_gap are joined up
+
+    Returns:
+    tuple: (onset, offset) as local datetimes, None if no sleep was found or the data doesn't cover the night
+    """
+    midnight = datetime.strptime(date, "%Y-%m-%d")
+    start = midnight + night_search_start
+
+    minutes = actigraphy_sleep_wake(start, midnight + night_search_end, db_path)
+    if minutes is None:
+        return None
+
+    # join sleep bouts separated by brief awakenings, then take the longest
+    awake = minutes != 0
+    first_sleep = np.argmax(~awake)
+    last_sleep = len(awake) - np.argmax(~awake[::-1])
+    brief = remove_short_runs(awake, max_wake_gap) != awake
+    brief[:first_sleep] = False
+    brief[last_sleep:] = False
+
+    starts, ends = run_bounds(~awake | brief)
+    if not len(starts):
+        return None
+
+    longest = np.argmax(ends - starts)
+    if ends[longest] - starts[longest] < min_main_sleep:
+        return None
+    if np.mean(~np.isnan(minutes[starts[longest]:ends[longest]])) < min_coverage:
+        return None
+
+    return start + timedelta(minutes=int(starts[longest])), start + timedelta(minutes=int(ends[longest]))
+
+
+def actigraphy_sleep_bounds(date, tz, db_path=None):
+    """
+    Main sleep bout as epoch seconds, like data_handling.sleep_index.sleep_bounds, so it can stand in for
+    a missing sleep_<date>.json
+
+    Parameters:
+    - date (str): YYYY-MM-DD, the wake-up date
+    - tz (str): IANA timezone of the monitoring timestamps
+
+    Returns:
+    - tuple: (start, end) in int64 epoch seconds UTC, None if no sleep was found
+    """
+    bout = actigraphy_main_sleep(date, db_path)
+    if bout is None:
+        return None
+
+    import pandas as pd
+
+    local = pd.DatetimeIndex(list(bout)).tz_localize(tz, ambiguous="NaT", nonexistent="shift_forward")
+    if local.isna().any():
+        return None
+
+    seconds = local.tz_convert("UTC").tz_localize(None).values.astype("datetime64[s]").astype(np.int64)
+
+    return int(seconds[0]), int(seconds[1])
@@ -0,0 +1,357 @@
+"""
+Long-horizon baselines for resting heart rate and weight
+- the daily RHR / weight downloads (HealthData/RHR, HealthData/Weight) are read once into day-indexed arrays
+  and persisted, later syncs only read the files of the days that are new (plus the last refresh_days, which
+  GarminDB may re-download with late data)
+- EWMA baselines (mean and variance) are kept as their running sums per day, so an update continues from the
+  stored state instead of going back over the history. Within an update the sums are one cumulative sum per
+  block of days, the blocks keep the growth factors inside float range for multi-year histories.
+- rolling z-scores compare each day with the trailing z_window days before it, all days at once from
+  cumulative sums, and days beyond flag_z are flagged
+- flags are joined with the bedroom environment of the night before (nightly means from the sensor rollups),
+  e.g. an elevated RHR after a night that was too warm
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+from data_handling.sensor_rollups import query_sensor_history
+from data_handling.data_recall import sensor_fields
+from data_analysis.environment_score import ideal_conditions
+
+rhr_path = "HealthData/RHR"
+weight_path = "HealthData/Weight"
+store_path = "data_handling/baselines.npz"
+
+# metric -> EWMA half life in days, z-score beyond which a day is flagged, and which direction is flagged
+baseline_metrics = {
+    "resting_hr": {"halflife": 14, "flag_z": 2.0, "direction": "up"},
+    "weight": {"halflife": 28, "flag_z": 2.0, "direction": "both"},
+}
+
+z_window = 28           # trailing days each z-score is computed against
+min_window_days = 7     # fewer days with data in the window gives no z-score
+refresh_days = 2        # most recent stored days that are read again on every update
+
+# deviation from the ideal conditions that makes a night's environment poor (the moderate levels of diff_to_ideal)
+poor_environment = {"temperature": 1.0, "humidity": 5.0}
+
+state_names = ("sum", "sumsq", "weight")
+
+
+#################################### READING ####################################
+def read_resting_hr(date):
+    """
+    Resting heart rate of a day from rhr_<date>.json
+
+    Returns:
+    float: beats per minute, NaN if missing
+    """
+    try:
+        with open(f"{rhr_path}/rhr_{date}.json", "r") as file:
+            data = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return np.nan
+
+    entries = ((data.get("allMetrics") or {}).get("metricsMap") or {}).get("WELLNESS_RESTING_HEART_RATE") or []
+    values = [entry.get("value") for entry in entries if entry.get("value") is not None]
+    return float(values[-1]) if values else np.nan
+
+
+def read_weight(date):
+    """
+    Weight of a day from weight_<date>.json, the last weigh-in of the day
+
+    Returns:
+    float: kg, NaN if there was no weigh-in
+    """
+    try:
+        with open(f"{weight_path}/weight_{date}.json", "r") as file:
+            data = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return np.nan
+
+    # Garmin reports grams
+    weights = [entry.get("weight") for entry in data.get("dateWeightList") or [] if entry.get("weight") is not None]
+    if not weights:
+        average = (data.get("totalAverage") or {}).get("weight")
+        weights = [average] if average is not None else []
+
+    return float(weights[-1]) / 1000 if weights else np.nan
+
+
+metric_readers = {"resting_hr": read_resting_hr, "weight": read_weight}
+
+
+def downloaded_days():
+    """
+    Days (since 1970-01-01) that have an RHR or weight file
+
+    Returns:
+    np.ndarray: sorted int64 days
+    """
+    days = set()
+    for folder, prefix in [(rhr_path, "rhr_"), (weight_path, "weight_")]:
+        try:
+            names = os.listdir(folder)
+        except FileNotFoundError:
+            continue
+        for name in names:
+            if name.startswith(prefix) and name.endswith(".json"):
+                try:
+                    days.add(int(np.datetime64(name[len(prefix):-len(".json")], "D").astype(np.int64)))
+                except ValueError:
+                    pass
+
+    return np.array(sorted(days), dtype=np.int64)
+
+
+def day_to_date(day):
+    return str(np.datetime64(int(day), "D"))
+
+
+#################################### EWMA ####################################
+def ewma_sums(values, halflife, state=(0.0, 0.0, 0.0)):
+    """
+    Running exponentially weighted sums of values, values squared and weights. Missing days (NaN) add nothing
+    but the older days keep decaying.
+
+    Parameters:
+    - values (array): one value per day
+    - halflife (float): days
+    - state (tuple): the sums on the day before values[0]
+
+    Returns:
+    - np.ndarray: (3 x days) sums in state_names order, the last column is the state for the next update
+    """
+    decay = 0.5 ** (1 / halflife)
+    present = ~np.isnan(values)
+    terms = np.stack([np.where(present, values, 0.0), np.where(present, values ** 2, 0.0), present.astype(float)])
+
+    # decay ** -block stays below e^600
+    block = max(1, int(600 / -np.log(decay)))
+    sums = np.empty_like(terms)
+    previous = np.asarray(state, dtype=float)
+
+    for start in range(0, len(values), block):
+        k = np.arange(min(block, len(values) - start))
+        part = terms[:, start:start + len(k)]
+        # sum_t = decay^(t+1) * previous + decay^t * sum_{s<=t} decay^-s * term_s
+        sums[:, start:start + len(k)] = (decay ** (k + 1)) * previous[:, None] + \
+            (decay ** k) * np.cumsum(part * decay ** -k, axis=1)
+        previous = sums[:, start + len(k) - 1]
+
+    return sums
+
+
+def ewma_baseline(sums):
+    """
+    Returns:
+    tuple: (mean, standard deviation) per day from ewma_sums, NaN before the first value
+    """
+    total, total_sq, weight = sums
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / weight
+        std = np.sqrt(np.maximum(total_sq / weight - mean ** 2, 0))
+
+    return mean, std
+
+
+def rolling_zscores(values, window=z_window, min_days=min_window_days):
+    """
+    z-score of each day against the window days before it (the day itself excluded)
+
+    Returns:
+    np.ndarray: NaN where the day is missing or the window has fewer than min_days values
+    """
+    present = ~np.isnan(values)
+    sums = [np.r_[0.0, np.cumsum(term)] for term in
+            (present.astype(float), np.where(present, values, 0.0), np.where(present, values ** 2, 0.0))]
+
+    end = np.arange(len(values))
+    start = np.maximum(end - window, 0)
+    count, total, total_sq = (s[end] - s[start] for s in sums)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+        std = np.sqrt(np.maximum((total_sq - count * mean ** 2) / (count - 1), 0))
+        z = (values - mean) / std
+
+    z[(count < min_days) | ~present | (std == 0)] = np.nan
+    return z
+
+
+#################################### STORE ####################################
+def empty_store():
+    store = {"day": np.zeros(0, dtype=np.int64)}
+    for metric, settings in baseline_metrics.items():
+        store[metric] = np.zeros(0)
+        store[metric + "_ewma"] = np.zeros((3, 0))
+        store[metric + "_halflife"] = np.array(settings["halflife"], dtype=float)
+    return store
+
+
+def load_store(path=store_path):
+    try:
+        with np.load(path) as data:
+            store = {key: data[key] for key in data.files}
+    except FileNotFoundError:
+        return empty_store()
+
+    # a changed half life (or metric list) invalidates the running sums, rebuild from the files
+    for metric, settings in baseline_metrics.items():
+        if metric not in store or float(store[metric + "_halflife"]) != settings["halflife"]:
+            return empty_store()
+
+    return store
+
+
+def save_store(store, path=store_path):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as file:
+        np.savez(file, **store)
+    os.replace(tmp_path, path)
+
+
+def update_baselines(path=store_path):
+    """
+    Adds the days downloaded since the last update (and re-reads the last refresh_days) to the store
+
+    Returns:
+    dict: the updated store
+    """
+    store = load_store(path)
+    available = downloaded_days()
+    if not len(available):
+        return store
+
+    stored_days = store["day"]
+    first_new = available[0] if not len(stored_days) else max(stored_days[-1] - refresh_days + 1, stored_days[0])
+    last_day = max(available[-1], stored_days[-1] if len(stored_days) else available[-1])
+    new_days = np.arange(first_new, last_day + 1, dtype=np.int64)
+    if not len(new_days):
+        return store
+
+    # keep the stored days before first_new, the running sums continue from the day before it
+    keep = stored_days < first_new
+    has_file = np.isin(new_days, available)
+    store["day"] = np.r_[stored_days[keep], new_days]
+
+    for metric, settings in baseline_metrics.items():
+        reader = metric_readers[metric]
+        values = np.array([reader(day_to_date(day)) if found else np.nan for day, found in zip(new_days, has_file)])
+
+        kept_sums = store[metric + "_ewma"][:, keep]
+        state = kept_sums[:, -1] if kept_sums.shape[1] else (0.0, 0.0, 0.0)
+
+        store[metric] = np.r_[store[metric][keep], values]
+        store[metric + "_ewma"] = np.hstack([kept_sums, ewma_sums(values, settings["halflife"], state)])
+
+    save_store(store, path)
+    return store
+
+
+#################################### REPORT ####################################
+def environment_deviations(days):
+    """
+    Nightly bedroom conditions relative to the ideal, from the sensor rollups' night tier
+
+    Returns:
+    dict: {"temperature_deviation", "humidity_deviation", "poor": bool} arrays aligned with days
+    """
+    deviations = {name + "_deviation": np.full(len(days), np.nan) for name in sensor_fields.values()}
+    if len(days):
+        history = query_sensor_history(int(days[0]) * 86400, (int(days[-1]) + 1) * 86400, 86400)
+        position = np.searchsorted(days, history["start"])
+        found = (position < len(days)) & (days[np.minimum(position, len(days) - 1)] == history["start"])
+        for ch, name in enumerate(sensor_fields.values()):
+            deviations[name + "_deviation"][position[found]] = history["mean"][found, ch] - ideal_conditions[name]
+
+    with np.errstate(invalid="ignore"):
+        deviations["poor"] = np.zeros(len(days), dtype=bool)
+        for name, limit in poor_environment.items():
+            deviations["poor"] |= np.abs(deviations[name + "_deviation"]) > limit
+
+    return deviations
+
+
+def baseline_table(store, start=None, end=None):
+    """
+    Values, baselines, z-scores and flags per day, joined with the environment of the night before
+
+    Parameters:
+    - store (dict): from update_baselines / load_store
+    - start, end (str): YYYY-MM-DD range, inclusive, the whole history by default
+
+    Returns:
+    - dict: {"dates": [], "<metric>", "<metric>_baseline", "<metric>_std", "<metric>_z", "<metric>_flag",
+             "temperature_deviation", "humidity_deviation", "poor_environment"} arrays
+    """
+    days = store["day"]
+    lo = 0 if start is None else np.searchsorted(days, np.datetime64(start, "D").astype(np.int64))
+    hi = len(days) if end is None else np.searchsorted(days, np.datetime64(end, "D").astype(np.int64), side="right")
+    # z-scores need the window before the range
+    context = max(lo - z_window, 0)
+
+    table = {"dates": [day_to_date(day) for day in days[lo:hi]]}
+    for metric, settings in baseline_metrics.items():
+        values = store[metric]
+        mean, std = ewma_baseline(store[metric + "_ewma"])
+        z = rolling_zscores(values[context:hi])[lo - context:]
+
+        with np.errstate(invalid="ignore"):
+            flag = z >= settings["flag_z"] if settings["direction"] == "up" else np.abs(z) >= settings["flag_z"]
+
+        table[metric] = values[lo:hi]
+        # the baseline a day is judged against is the one up to the day before
+        table[metric + "_baseline"] = np.r_[np.nan, mean[:-1]][lo:hi] if len(mean) else mean
+        table[metric + "_std"] = np.r_[np.nan, std[:-1]][lo:hi] if len(std) else std
+        table[metric + "_z"] = z
+        table[metric + "_flag"] = flag
+
+    # the RHR / weight files of a date belong to the night that ended that morning, same key as the rollups
+    environment = environment_deviations(days[lo:hi])
+    table.update({key: value for key, value in environment.items() if key != "poor"})
+    table["poor_environment"] = environment["poor"]
+
+    return table
+
+
+def environment_effect(table, metric="resting_hr"):
+    """
+    How a metric behaves after poor bedroom nights compared to the other nights
+
+    Returns:
+    dict: {"poor_nights", "mean_z_after_poor", "mean_z_after_good", "flagged_after_poor", "flagged_after_good"}
+    """
+    z, flag, poor = table[metric + "_z"], table[metric + "_flag"], table["poor_environment"]
+    known = ~np.isnan(table["temperature_deviation"]) | ~np.isnan(table["humidity_deviation"])
+    scored = ~np.isnan(z)
+
+    def mean_z(mask):
+        return float(np.mean(z[mask & scored])) if (mask & scored).any() else None
+
+    good = known & ~poor
+    return {
+        "poor_nights": int(poor.sum()),
+        "mean_z_after_poor": mean_z(poor),
+        "mean_z_after_good": mean_z(good),
+        "flagged_after_poor": int((flag & poor).sum()),
+        "flagged_after_good": int((flag & good).sum())
+    }
+
+
+if __name__ == "__main__":
+    table = baseline_table(update_baselines())
+    for i in range(max(len(table["dates"]) - 14, 0), len(table["dates"])):
+        line = [table["dates"][i]]
+        for metric in baseline_metrics:
+            line.append(f"{metric} {table[metric][i]:.1f} (baseline {table[metric + '_baseline'][i]:.1f}, "
+                        f"z {table[metric + '_z'][i]:.1f}){' FLAG' if table[metric + '_flag'][i] else ''}")
+        if table["poor_environment"][i]:
+            line.append("after a poor bedroom night")
+        print(" | ".join(line))
+    print(environment_effect(table))
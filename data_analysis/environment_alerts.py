@@ -0,0 +1,203 @@
+"""
+Online environment alerting
+- consumes sensor readings one at a time (or in batches across many rooms)
+- keeps an exponentially weighted mean and variance per room and channel, so memory doesn't grow with the night
+- raises an alert when a channel stays outside its band around ideal_conditions for sustain_seconds and
+  clears it only once it is back well inside the band (hysteresis), so a noisy reading can't make it flicker
+- an alert that crosses straight to the other side of the band (too hot to too cold) ends and a new one starts,
+  so its recommendation matches the new side
+"""
+
+import math
+
+import numpy as np
+
+from data_analysis.environment_score import ideal_conditions, recommend_action
+
+# deviation from ideal that starts an alert, and the smaller deviation it has to drop below to clear
+# (enter values match the "moderate deviation" levels in diff_to_ideal)
+alert_bands = {
+    'temperature': {'enter': 1, 'exit': 0.5, 'significant': 3},
+    'humidity': {'enter': 5, 'exit': 2.5, 'significant': 10}
+}
+
+ewma_halflife = 2 * 60     # seconds
+sustain_seconds = 10 * 60  # how long a deviation must last before alerting
+
+
+class EnvironmentAlerts:
+    """
+    Per room / per channel online detector. State is a handful of (rooms x channels) arrays.
+
+    push() handles a single reading, push_batch() handles readings for many rooms in one vectorised step.
+    Both return a list of events:
+    {"room", "channel", "type": "start" | "end", "time", "value", "difference", "level", "recommendation"}
+    """
+
+    def __init__(self, channels=('temperature', 'humidity'), halflife=ewma_halflife, sustain=sustain_seconds, bands=alert_bands):
+        self.channels = list(channels)
+        self.decay_rate = math.log(2) / halflife
+        self.sustain = sustain
+        self.ideal = np.array([ideal_conditions[ch] for ch in self.channels], dtype=float)
+        self.enter = np.array([bands[ch]['enter'] for ch in self.channels], dtype=float)
+        self.exit = np.array([bands[ch]['exit'] for ch in self.channels], dtype=float)
+        self.significant = np.array([bands[ch]['significant'] for ch in self.channels], dtype=float)
+
+        self.rooms = {}
+        self.room_names = []
+        self.mean = self.var = self.last_time = self.pending_since = self.active = self.side = None
+        self._allocate(16)
+
+    def _allocate(self, capacity):
+        n_channels = len(self.channels)
+
+        def grow(old, fill, dtype=float):
+            new = np.full((capacity, n_channels), fill, dtype=dtype)
+            if old is not None:
+                new[:len(old)] = old
+            return new
+
+        self.mean = grow(self.mean, np.nan)
+        self.var = grow(self.var, 0.0)
+        self.last_time = grow(self.last_time, np.nan)
+        self.pending_since = grow(self.pending_since, np.nan)
+        self.active = grow(self.active, False, dtype=bool)
+        self.side = grow(self.side, 0.0)  # sign of the deviation an active alert started on
+
+    def room_index(self, room):
+        if room not in self.rooms:
+            if len(self.rooms) == len(self.mean):
+                self._allocate(2 * len(self.mean))
+            self.rooms[room] = len(self.rooms)
+            self.room_names.append(room)
+        return self.rooms[room]
+
+    def push(self, room, timestamp, values):
+        """
+        Ingests one reading for a room
+
+        Parameters:
+        - room (hashable): room name / id
+        - timestamp (float): epoch seconds
+        - values (list): one value per channel, NaN for missing
+
+        Returns:
+        - list: events raised by this reading
+        """
+        idx = self.room_index(room)
+        return self._step(np.array([idx]), np.array([timestamp], dtype=float), np.asarray(values, dtype=float).reshape(1, -1))
+
+    def push_batch(self, rooms, timestamps, values):
+        """
+        Ingests many readings at once. Readings for different rooms are processed together; repeat
+        readings for the same room are applied in order, one vectorised wave per repeat.
+
+        Parameters:
+        - rooms (list): room for each reading
+        - timestamps (array): epoch seconds for each reading
+        - values (array): (readings x channels)
+
+        Returns:
+        - list: events raised, in wave order
+        """
+        idx = np.array([self.room_index(room) for room in rooms])
+        timestamps = np.asarray(timestamps, dtype=float)
+        values = np.asarray(values, dtype=float).reshape(len(idx), -1)
+
+        # rank of each reading within its room, e.g. rooms [a, b, a] -> [0, 0, 1]
+        order = np.lexsort((timestamps, idx))
+        sorted_idx = idx[order]
+        group_start = np.r_[0, np.flatnonzero(np.diff(sorted_idx)) + 1]
+        ranks = np.empty(len(idx), dtype=int)
+        ranks[order] = np.arange(len(idx)) - np.repeat(group_start, np.diff(np.r_[group_start, len(idx)]))
+
+        events = []
+        for wave in range(ranks.max() + 1 if len(ranks) else 0):
+            sel = ranks == wave
+            events += self._step(idx[sel], timestamps[sel], values[sel])
+
+        return events
+
+    def _step(self, idx, timestamps, values):
+        valid = ~np.isnan(values)
+        t = timestamps[:, None]
+
+        # time aware EWMA: weight of the new reading grows with the time since the last one
+        mean = self.mean[idx]
+        first = np.isnan(mean)
+        dt = np.where(np.isnan(self.last_time[idx]), 0.0, t - self.last_time[idx])
+        alpha = np.where(first, 1.0, 1 - np.exp(-self.decay_rate * np.maximum(dt, 0)))
+
+        previous = np.where(first, values, mean)
+        delta = np.where(valid, values - previous, 0)
+        new_mean = np.where(valid, previous + alpha * delta, mean)
+        new_var = np.where(valid, (1 - alpha) * (self.var[idx] + alpha * delta ** 2), self.var[idx])
+
+        self.mean[idx] = new_mean
+        self.var[idx] = new_var
+        self.last_time[idx] = np.where(valid, t, self.last_time[idx])
+
+        # hysteresis state machine on the smoothed deviation
+        deviation = new_mean - self.ideal
+        outside = valid & (np.abs(deviation) > self.enter)
+        inside = valid & (np.abs(deviation) < self.exit)
+        active = self.active[idx]
+        pending = self.pending_since[idx]
+
+        pending = np.where(outside & ~active & np.isnan(pending), t, pending)
+        pending = np.where(~outside, np.nan, pending)
+        starts = ~active & outside & (t - pending >= self.sustain)
+        ends = active & inside
+        # crossed the whole band between two readings without dropping below exit
+        flips = active & outside & (np.sign(deviation) != self.side[idx])
+
+        self.pending_since[idx] = np.where(starts | ends, np.nan, pending)
+        self.active[idx] = (active | starts) & ~ends
+        self.side[idx] = np.where(starts | flips, np.sign(deviation), np.where(ends, 0.0, self.side[idx]))
+
+        events = []
+        for row, ch in zip(*np.nonzero(starts | ends | flips)):
+            kinds = ['end', 'start'] if flips[row, ch] else ['start' if starts[row, ch] else 'end']
+            for kind in kinds:
+                events.append(self._event(idx[row], ch, kind, timestamps[row], new_mean[row, ch], deviation[row, ch]))
+
+        return events
+
+    def _event(self, room_idx, ch, kind, timestamp, value, difference):
+        channel = self.channels[ch]
+        level = 0
+        recommendation = None
+
+        if kind == 'start':
+            level = 2 if abs(difference) > self.significant[ch] else 1
+            actions = recommend_action(
+                difference if channel == 'temperature' else 0,
+                difference if channel == 'humidity' else 0
+            )
+            recommendation = actions['Temperature Recommendation' if channel == 'temperature' else 'Humidity Recommendation']
+
+        return {
+            "room": self.room_names[room_idx],
+            "channel": channel,
+            "type": kind,
+            "time": float(timestamp),
+            "value": float(value),
+            "difference": float(difference),
+            "level": level,
+            "recommendation": recommendation
+        }
+
+    def stats(self, room):
+        """
+        Returns:
+        dict: {channel: {"mean", "std", "active"}} for a room
+        """
+        idx = self.rooms[room]
+        return {
+            ch: {
+                "mean": float(self.mean[idx, i]),
+                "std": float(math.sqrt(self.var[idx, i])),
+                "active": bool(self.active[idx, i])
+            }
+            for i, ch in enumerate(self.channels)
+        }
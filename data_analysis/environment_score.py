@@ -100,3 +100,33 @@ def recommend_action(temp_diff, humidity_diff):
         "Temperature Recommendation": temp_action,
         "Humidity Recommendation": humidity_action
     }
+
+
+# overnight oxygen dips worth acting on: desaturations per hour (ODI) or minutes below 90% SpO2
+oxygen_alert = {"odi": 5, "below_90": 10}
+
+
+def oxygen_recommendation(spo2_summary, temp_diff=None, humidity_diff=None):
+    """
+    Bedroom advice from the night's blood oxygen (see data_analysis.spo2), read together with the room conditions.
+
+    Args:
+        spo2_summary (dict): nightly summary with "odi" and "below_90" (None when there were no readings).
+        temp_diff (float): Difference between the average and ideal temperature, None without bedroom data.
+        humidity_diff (float): Difference between the average and ideal humidity, None without bedroom data.
+
+    Returns:
+        str: Recommendation for the night.
+    """
+    if spo2_summary.get("odi") is None:
+        return "No blood oxygen readings for this night."
+
+    if spo2_summary["odi"] < oxygen_alert["odi"] and (spo2_summary.get("below_90") or 0) < oxygen_alert["below_90"]:
+        return "Your blood oxygen stayed steady overnight. Keep the room as it is!"
+
+    if humidity_diff is not None and humidity_diff < -5:
+        return "Your oxygen dipped a few times overnight and the air was dry. A humidifier or a bowl of water by the radiator can make breathing easier."
+    if (temp_diff is not None and temp_diff > 1) or (humidity_diff is not None and humidity_diff > 5):
+        return "Your oxygen dipped a few times in a warm, stuffy room. Opening the window a little for fresh air can help."
+
+    return "Your oxygen dipped a few times overnight. Airing the bedroom before bed helps, and mention it to your doctor if it keeps happening."
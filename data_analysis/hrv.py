@@ -0,0 +1,237 @@
+"""
+Nightly heart rate variability from beat-to-beat (RR) intervals
+- each night's intervals are read from garmin_monitoring.db (monitoring_rr) as one contiguous float array
+- ectopic / artefact beats are removed with a vectorised rolling median filter
+- rolling 5 minute RMSSD, SDNN and pNN50 come from cumulative sums, so every window costs O(1)
+- results are cached per night (the last max_cached_nights used) and dropped when the data version changes
+
+Garmin's export of monitoring_rr does not always hold beat intervals: on some devices it is the breathing
+rate (breaths/min). rr_to_ms spots that from the value range, and such nights fall back to the 5 minute
+HRV averages in the sleep JSON (hrvData).
+"""
+
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from data_handling.data_recall import night_bounds, local_timezone
+from data_handling.sleep_index import night_series
+from data_handling.data_version import current_data_version
+
+monitoring_db_path = "HealthData/DBs/garmin_monitoring.db"
+
+window_seconds = 5 * 60   # rolling window length
+window_step = 60          # seconds between window ends
+min_window_beats = 100    # windows with fewer clean beats are NaN
+
+# beats outside this range (ms) or more than ectopic_tolerance away from the local median are dropped
+rr_range = (300, 2000)
+ectopic_window = 11       # beats in the rolling median, odd
+ectopic_tolerance = 0.2
+
+nn50_threshold = 50       # ms
+
+# date -> {"version": data version, "hrv": night_hrv result}, least recently used first. A night's arrays are
+# large, the oldest are dropped beyond max_cached_nights so a worker's memory doesn't grow with every date picked.
+max_cached_nights = 16
+_night_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def rr_to_ms(values):
+    """
+    Works out the units of an RR series from its median and converts it to milliseconds
+
+    Returns:
+    np.ndarray or None: intervals in ms, None if the values can't be beat intervals (e.g. breaths per minute)
+    """
+    if not len(values):
+        return None
+
+    median = np.median(values)
+    if 0.25 <= median <= 2.5:
+        return values * 1000
+    if rr_range[0] <= median <= rr_range[1]:
+        return values
+
+    return None
+
+
+def load_rr_intervals(start, end, db_path=None):
+    """
+    Reads the RR intervals between two UTC epoch seconds (indexed time range read on the timestamp key)
+
+    Parameters:
+    - start (int): epoch seconds UTC
+    - end (int): epoch seconds UTC
+    - db_path (str): garmin_monitoring.db location
+
+    Returns:
+    - tuple: (times, rr) float64 arrays, epoch seconds and interval in ms. None if there are no beat intervals
+    """
+    import pandas as pd
+
+    # monitoring timestamps are local wall clock time
+    bounds = pd.DatetimeIndex(np.array([start, end], dtype="datetime64[s]")).tz_localize("UTC")
+    local_start, local_end = bounds.tz_convert(local_timezone).tz_localize(None).strftime("%Y-%m-%d %H:%M:%S")
+
+    with sqlite3.connect(db_path or monitoring_db_path) as conn:
+        rows = conn.execute(
+            "SELECT timestamp, rr FROM monitoring_rr WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp",
+            (local_start, local_end)
+        ).fetchall()
+
+    if not rows:
+        return None
+
+    rr = rr_to_ms(np.fromiter((row[1] for row in rows), dtype=float, count=len(rows)))
+    if rr is None:
+        return None
+
+    local = pd.DatetimeIndex(np.array([row[0] for row in rows], dtype="datetime64[ms]"))
+    utc = local.tz_localize(local_timezone, ambiguous="NaT", nonexistent="shift_forward").tz_convert("UTC")
+    times = utc.tz_localize(None).values.astype("datetime64[ms]").astype(np.int64) / 1000
+
+    keep = ~np.isnat(utc.values)
+    return np.ascontiguousarray(times[keep]), np.ascontiguousarray(rr[keep])
+
+
+def ectopic_mask(rr, window=ectopic_window, tolerance=ectopic_tolerance):
+    """
+    Flags clean beats: inside rr_range and within tolerance of the rolling median of the surrounding beats
+
+    Returns:
+    np.ndarray: bool, True for beats that are kept
+    """
+    in_range = (rr >= rr_range[0]) & (rr <= rr_range[1])
+    if len(rr) < window:
+        return in_range
+
+    half = window // 2
+    padded = np.pad(rr, half, mode="edge")
+    local_median = np.median(np.lib.stride_tricks.sliding_window_view(padded, window), axis=1)
+
+    return in_range & (np.abs(rr - local_median) <= tolerance * local_median)
+
+
+def rolling_hrv(times, rr, window=window_seconds, step=window_step, min_beats=min_window_beats):
+    """
+    Rolling RMSSD / SDNN / pNN50 over time windows, using prefix sums of the clean beats
+    and of the successive differences between neighbouring clean beats
+
+    Parameters:
+    - times (array): beat times, epoch seconds, sorted
+    - rr (array): intervals in ms
+    - window (int): window length in seconds
+    - step (int): seconds between window ends
+
+    Returns:
+    - dict: {"times": window end times, "rmssd": [], "sdnn": [], "pnn50": []} float arrays, NaN for
+            windows with fewer than min_beats clean beats
+    """
+    clean = ectopic_mask(rr)
+    rr_clean = np.where(clean, rr, 0.0)
+
+    # successive differences, stored against the later beat, only where both beats are clean
+    diff_ok = np.r_[False, clean[1:] & clean[:-1]]
+    diff = np.where(diff_ok, np.r_[0.0, np.diff(rr)], 0.0)
+
+    def prefix(values):
+        return np.r_[0.0, np.cumsum(values)]
+
+    n_beats, sum_rr, sum_rr_sq = prefix(clean), prefix(rr_clean), prefix(rr_clean ** 2)
+    n_diffs, sum_diff_sq, n_nn50 = prefix(diff_ok), prefix(diff ** 2), prefix(diff_ok & (np.abs(diff) > nn50_threshold))
+
+    ends = np.arange(times[0] + window, times[-1] + step, step) if len(times) else np.array([])
+    lo = np.searchsorted(times, ends - window, side="left")
+    hi = np.searchsorted(times, ends, side="right")
+    # a difference belongs to the window only if its earlier beat is in it too
+    lo_diff = np.minimum(lo + 1, hi)
+
+    beats = n_beats[hi] - n_beats[lo]
+    diffs = n_diffs[hi] - n_diffs[lo_diff]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (sum_rr[hi] - sum_rr[lo]) / beats
+        var = (sum_rr_sq[hi] - sum_rr_sq[lo]) / beats - mean ** 2
+        sdnn = np.sqrt(np.maximum(var * beats / (beats - 1), 0))
+        rmssd = np.sqrt((sum_diff_sq[hi] - sum_diff_sq[lo_diff]) / diffs)
+        pnn50 = 100 * (n_nn50[hi] - n_nn50[lo_diff]) / diffs
+
+    enough = beats >= min_beats
+    return {
+        "times": ends,
+        "rmssd": np.where(enough, rmssd, np.nan),
+        "sdnn": np.where(enough, sdnn, np.nan),
+        "pnn50": np.where(enough, pnn50, np.nan)
+    }
+
+
+def summarise(windows):
+    """
+    Nightly summary of the rolling windows (median of each metric), None where there are no windows
+    """
+    summary = {}
+    for key in ("rmssd", "sdnn", "pnn50"):
+        values = windows[key]
+        summary[key] = float(np.nanmedian(values)) if np.isfinite(values).any() else None
+
+    return summary
+
+
+def compute_night_hrv(date, db_path=None):
+    """
+    Computes the HRV windows for the night ending on date, without the cache
+
+    Returns:
+    dict: rolling_hrv windows plus {"source": "monitoring_rr" | "sleep_json" | None, "summary": {}}
+    """
+    empty = {"times": np.array([]), "rmssd": np.array([]), "sdnn": np.array([]), "pnn50": np.array([])}
+
+    bounds = night_bounds(date)
+    if bounds is None:
+        return {**empty, "source": None, "summary": summarise(empty)}
+
+    beats = load_rr_intervals(bounds[0], bounds[1], db_path)
+    if beats is not None and len(beats[0]):
+        windows = rolling_hrv(*beats)
+        return {**windows, "source": "monitoring_rr", "summary": summarise(windows)}
+
+    # no beat intervals, use Garmin's own 5 minute HRV values (already RMSSD based) from the sleep JSON
+    try:
+        times, values = night_series(date, "hrv")
+    except FileNotFoundError:
+        return {**empty, "source": None, "summary": summarise(empty)}
+
+    windows = {**empty, "times": times.astype(float), "rmssd": values}
+    windows["sdnn"] = np.full(len(values), np.nan)
+    windows["pnn50"] = np.full(len(values), np.nan)
+
+    return {**windows, "source": "sleep_json" if len(values) else None, "summary": summarise(windows)}
+
+
+def night_hrv(date):
+    """
+    Cached HRV for a night. The cache entry is rebuilt when a sync publishes a new data version.
+
+    Returns:
+    dict: see compute_night_hrv
+    """
+    version = current_data_version()
+    with _cache_lock:
+        cached = _night_cache.get(date)
+        if cached is not None and cached["version"] == version:
+            _night_cache.move_to_end(date)
+            return cached["hrv"]
+
+    # computed outside the lock, two requests for the same new night at worst compute it twice
+    cached = {"version": version, "hrv": compute_night_hrv(date)}
+    with _cache_lock:
+        _night_cache[date] = cached
+        _night_cache.move_to_end(date)
+        while len(_night_cache) > max_cached_nights:
+            _night_cache.popitem(last=False)
+
+    return cached["hrv"]
@@ -0,0 +1,436 @@
+"""
+Links bedroom conditions to sleep across nights
+- every night becomes one row of a nights x features matrix (environment aggregates, HR / HRV, durations,
+  sleep stages, regularity metrics)
+- environment features are also entered with a lag of 1 and 2 nights, to catch delayed effects
+- the matrix is reduced to pairwise co-moment accumulators (counts, sums, sums of squares and cross
+  products over the nights where both features exist), persisted to disk and updated by the scheduler after
+  every sync (python -m data_collection.scheduler)
+- every stored night keeps a signature of its inputs (the sleep JSON and sensor file versions and its row
+  of sleep_metrics.csv), a night whose inputs changed since it was stored (e.g. its sensor file arrived a
+  sync later) is recomputed: its old row and the lagged rows of the nights after it are taken out of the
+  accumulators and the new ones added
+- correlation, partial correlation and lagged correlation all come from the accumulators in a few matrix
+  operations, so the dashboard only reads the store and never goes back over the history
+"""
+
+import json
+import os
+import threading
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from data_handling.data_recall import load_night_sensor, night_sensor_file, date_list, local_timezone
+from data_handling.resample import time_weighted_mean
+from data_handling.sleep_index import json_path, night_series
+from data_handling.snapshots import resolve
+from data_analysis.hrv import night_hrv
+
+store_path = "data_handling/sleep_correlations.npz"
+metrics_csv_path = "data_handling/sleep_metrics.csv"
+
+history_days = 365   # nights up to the sync date that are checked on every update
+refresh_days = 2     # most recent nights that are always recomputed (late HR / HRV data in the monitoring db)
+
+environment_features = ["temperature_mean", "temperature_std", "temperature_max", "humidity_mean", "humidity_std"]
+physiology_features = ["heart_rate_mean", "hrv_rmssd", "respiration_mean", "sleep_stress"]
+sleep_features = ["sleep_score", "duration_hours", "deep_fraction", "rem_fraction", "awake_count"]
+regularity_features = ["IS", "SJL", "StDev_onset"]
+
+night_feature_names = environment_features + physiology_features + sleep_features + regularity_features
+
+# environment features are repeated for the previous nights
+feature_lags = (1, 2)
+feature_names = night_feature_names + [f"{name}_lag{lag}" for lag in feature_lags for name in environment_features]
+
+# what the dashboard explains, and what may explain it
+outcome_features = ["sleep_score", "duration_hours", "deep_fraction", "hrv_rmssd"]
+driver_features = [name for name in feature_names if name not in outcome_features]
+
+min_pair_nights = 5  # correlations over fewer nights are NaN
+
+
+def sleep_summary(date):
+    """
+    Nightly totals from the sleep JSON's dailySleepDTO
+
+    Returns:
+    dict: feature name -> value, empty if there is no sleep JSON for the date
+    """
+    try:
+        with open(json_path(date), 'r') as file:
+            dto = json.load(file).get('dailySleepDTO') or {}
+    except FileNotFoundError:
+        return {}
+
+    sleep_seconds = dto.get('sleepTimeSeconds') or 0
+    score = ((dto.get('sleepScores') or {}).get('overall') or {}).get('value')
+
+    summary = {
+        "sleep_score": score,
+        "duration_hours": sleep_seconds / 3600 if sleep_seconds else None,
+        "respiration_mean": dto.get('averageRespirationValue'),
+        "sleep_stress": dto.get('avgSleepStress'),
+        "awake_count": dto.get('awakeCount')
+    }
+    if sleep_seconds:
+        summary["deep_fraction"] = (dto.get('deepSleepSeconds') or 0) / sleep_seconds
+        summary["rem_fraction"] = (dto.get('remSleepSeconds') or 0) / sleep_seconds
+
+    return summary
+
+
+def regularity_metrics(dates):
+    """
+    Regularity metrics stored by the morning sync in sleep_metrics.csv
+
+    Returns:
+    pd.DataFrame: indexed by date, one column per regularity feature
+    """
+    import pandas as pd
+
+    try:
+        metrics = pd.read_csv(resolve(metrics_csv_path), skipinitialspace=True)
+    except FileNotFoundError:
+        return pd.DataFrame(columns=regularity_features)
+
+    metrics = metrics.drop_duplicates("Date", keep="last").set_index("Date")
+    columns = metrics.reindex(columns=regularity_features)
+
+    return columns.apply(pd.to_numeric, errors="coerce").reindex(dates)
+
+
+def night_signature(date, regularity):
+    """
+    Versions of the inputs of a night's features: size and modification time of the sleep JSON and of the
+    sensor file (resolved through the snapshot, so a staged rewrite gives a new path), and its regularity row
+
+    Parameters:
+    - date (str): YYYY-MM-DD
+    - regularity (array): the night's row of regularity_metrics
+
+    Returns:
+    - str
+    """
+    parts = []
+    for path in (json_path(date), resolve(night_sensor_file(date))):
+        try:
+            stat = os.stat(path)
+            parts.append(f"{path}:{stat.st_size}:{stat.st_mtime_ns}")
+        except FileNotFoundError:
+            parts.append("-")
+    parts.append(",".join(repr(float(value)) for value in regularity))
+
+    return "|".join(parts)
+
+
+def night_features(dates):
+    """
+    Builds the nights x night_feature_names matrix
+
+    Returns:
+    np.ndarray: float array, NaN where a feature is missing for a night
+    """
+    features = np.full((len(dates), len(night_feature_names)), np.nan)
+    column = {name: i for i, name in enumerate(night_feature_names)}
+    regularity = regularity_metrics(dates).to_numpy(dtype=float)
+
+    for row, date in enumerate(dates):
+        values = dict(sleep_summary(date))
+
+        try:
+            times, readings = load_night_sensor(date)
+            if len(times):
+                means = time_weighted_mean(times, readings)
+                values.update({
+                    "temperature_mean": means[0], "humidity_mean": means[1],
+                    "temperature_std": np.nanstd(readings[:, 0]), "humidity_std": np.nanstd(readings[:, 1]),
+                    "temperature_max": np.nanmax(readings[:, 0])
+                })
+        except FileNotFoundError:
+            pass
+
+        try:
+            _, heart_rate = night_series(date, "heart_rate")
+            if len(heart_rate):
+                values["heart_rate_mean"] = np.nanmean(heart_rate)
+        except FileNotFoundError:
+            pass
+
+        values["hrv_rmssd"] = night_hrv(date)["summary"]["rmssd"]
+
+        for name, value in values.items():
+            if name in column and value is not None:
+                features[row, column[name]] = value
+
+        features[row, [column[name] for name in regularity_features]] = regularity[row]
+
+    return features
+
+
+def lagged_rows(dates, features, known_dates, known_features):
+    """
+    Extends night feature rows with the environment features of the nights 1 and 2 days before
+
+    Parameters:
+    - dates (list): nights of the rows
+    - features (array): their night_features rows
+    - known_dates (list), known_features (array): every night the lags can be taken from
+
+    Returns:
+    - np.ndarray: rows over feature_names
+    """
+    lookup = {date: i for i, date in enumerate(known_dates)}
+    env_columns = [night_feature_names.index(name) for name in environment_features]
+    day = np.array(dates, dtype="datetime64[D]")
+
+    lagged = []
+    for lag in feature_lags:
+        previous = [lookup.get(str(d)) for d in day - np.timedelta64(lag, "D")]
+        block = np.full((len(dates), len(env_columns)), np.nan)
+        found = np.array([p is not None for p in previous], dtype=bool)
+        if found.any():
+            block[found] = known_features[[p for p in previous if p is not None]][:, env_columns]
+        lagged.append(block)
+
+    return np.hstack([features] + lagged)
+
+
+def empty_store():
+    n = len(feature_names)
+    return {
+        "dates": np.array([], dtype="U10"),
+        "features": np.zeros((0, len(night_feature_names))),
+        "signatures": np.array([], dtype="U"),
+        "n": np.zeros((n, n)),       # nights where both features exist
+        "sum": np.zeros((n, n)),     # sum of feature i over those nights
+        "sumsq": np.zeros((n, n)),   # sum of feature i squared over those nights
+        "cross": np.zeros((n, n))    # sum of feature i * feature j
+    }
+
+
+def load_store(path=store_path):
+    try:
+        with np.load(path) as data:
+            store = {key: data[key] for key in data.files}
+    except FileNotFoundError:
+        return empty_store()
+
+    # feature list changed since the store was written (or it predates the signatures), start again
+    if store["n"].shape[0] != len(feature_names) or store["features"].shape[1] != len(night_feature_names) \
+            or "signatures" not in store:
+        return empty_store()
+
+    return store
+
+
+def save_store(store, path=store_path):
+    # temp file + rename, the dashboard workers read the store while the scheduler writes it
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as file:
+        np.savez(file, **store)
+    os.replace(tmp_path, path)
+
+
+def accumulate(store, rows, sign=1):
+    """
+    Adds rows (nights x feature_names) to the pairwise co-moment accumulators, one matrix product per moment.
+    sign=-1 takes rows that were added before out again.
+    """
+    present = ~np.isnan(rows)
+    values = np.where(present, rows, 0.0)
+    mask = present.astype(float)
+
+    store["n"] = store["n"] + sign * (mask.T @ mask)
+    store["sum"] = store["sum"] + sign * (values.T @ mask)
+    store["sumsq"] = store["sumsq"] + sign * ((values ** 2).T @ mask)
+    store["cross"] = store["cross"] + sign * (values.T @ values)
+
+    return store
+
+
+def update_correlation_store(dates=None, path=store_path):
+    """
+    Brings the store up to date for the nights in dates: nights that aren't stored yet are added, stored
+    nights whose inputs changed (see night_signature) and the last refresh_days nights are recomputed.
+    Run by the scheduler after a sync, the dashboard only reads the store (load_store).
+
+    Parameters:
+    - dates (list): nights to check, the history_days up to today by default
+    - path (str): store location
+
+    Returns:
+    - dict: the updated store
+    """
+    today = datetime.now(ZoneInfo(local_timezone)).strftime("%Y-%m-%d")
+    dates = sorted(set(dates or date_list(today, history_days)))
+    store = load_store(path)
+
+    stored = {date: i for i, date in enumerate(store["dates"].tolist())}
+    regularity = regularity_metrics(dates).to_numpy(dtype=float)
+    signatures = {date: night_signature(date, row) for date, row in zip(dates, regularity)}
+
+    recent = set(dates[-refresh_days:])
+    due = [date for date in dates
+           if date not in stored or date in recent or store["signatures"][stored[date]] != signatures[date]]
+    if not due:
+        return store
+
+    new_features = night_features(due)
+
+    # nights whose features or lagged features change: the due nights and the stored nights 1-2 days after them
+    day = np.array(due, dtype="datetime64[D]")
+    after = {str(d) for lag in feature_lags for d in day + np.timedelta64(lag, "D")}
+    affected = sorted(date for date in set(due) | after if date in stored)
+
+    # take the old rows out while the old features are still there to build their lags from
+    old_dates = store["dates"].tolist()
+    if affected:
+        old_rows = store["features"][[stored[date] for date in affected]]
+        store = accumulate(store, lagged_rows(affected, old_rows, old_dates, store["features"]), sign=-1)
+
+    # replace the due nights' features. Nights with no data at all are stored too, as an all-NaN row that adds
+    # nothing to the accumulators, so their signature stops them from being recomputed on every update
+    nights = {date: (store["features"][i], str(store["signatures"][i])) for date, i in stored.items()}
+    for date, row in zip(due, new_features):
+        nights[date] = (row, signatures[date])
+
+    all_dates = sorted(nights)
+    all_features = np.array([nights[date][0] for date in all_dates]).reshape(-1, len(night_feature_names))
+
+    # add the rows of every night that changed or whose lags changed
+    lookup = {date: i for i, date in enumerate(all_dates)}
+    changed = sorted(date for date in set(due) | set(affected) if date in lookup)
+    if changed:
+        rows = all_features[[lookup[date] for date in changed]]
+        store = accumulate(store, lagged_rows(changed, rows, all_dates, all_features))
+
+    store["dates"] = np.array(all_dates, dtype="U10")
+    store["features"] = all_features
+    store["signatures"] = np.array([nights[date][1] for date in all_dates], dtype="U")
+    save_store(store, path)
+
+    return store
+
+
+def correlation_matrix(store, min_nights=min_pair_nights):
+    """
+    Pairwise-complete Pearson correlation of every feature pair from the accumulators
+
+    Returns:
+    np.ndarray: (features x features), NaN where fewer than min_nights nights have both features
+    """
+    n, s, sq, cross = store["n"], store["sum"], store["sumsq"], store["cross"]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = n * cross - s * s.T
+        var_i = n * sq - s ** 2
+        var_j = var_i.T
+        corr = cov / np.sqrt(var_i * var_j)
+
+    corr[(n < min_nights) | ~np.isfinite(corr)] = np.nan
+    return np.clip(corr, -1, 1)
+
+
+def partial_correlations(corr, columns, n=None):
+    """
+    Partial correlation of every pair in columns given all the others in columns
+
+    Parameters:
+    - corr (array): correlation_matrix result
+    - columns (array): feature indices
+    - n (array): the store's "n", pairs with too few nights for the number of controls are NaN
+
+    Returns:
+    - np.ndarray: (len(columns) x len(columns))
+    """
+    columns = np.asarray(columns)
+    # features with no correlations at all can't be controlled for, treat them as independent
+    partial = partial_matrices(np.where(np.isnan(corr), 0.0, corr)[np.ix_(columns, columns)])
+    if n is not None:
+        partial[n[np.ix_(columns, columns)] <= min_partial_nights(len(columns) - 2)] = np.nan
+
+    return partial
+
+
+def min_partial_nights(n_controls):
+    """
+    A partial correlation given n_controls features needs more nights than this. With fewer it has no
+    degrees of freedom left (n - n_controls - 3 <= 0) and comes out as +-1 whatever the data.
+    """
+    return n_controls + 3
+
+
+def partial_matrices(sub):
+    """
+    Partial correlations from one correlation matrix or a stack of them (... x m x m), via the
+    pseudo-inverse (precision matrix) in a single batched call
+    """
+    sub = sub.copy()
+    eye = np.broadcast_to(np.eye(sub.shape[-1], dtype=bool), sub.shape)
+    sub[eye] = 1.0
+
+    precision = np.linalg.pinv(sub)
+    scale = np.sqrt(np.abs(np.diagonal(precision, axis1=-2, axis2=-1)))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        partial = -precision / (scale[..., :, None] * scale[..., None, :])
+    partial[eye] = 1.0
+
+    return np.clip(partial, -1, 1)
+
+
+def what_affects_sleep(store, outcome="sleep_score", top=5, controls=environment_features):
+    """
+    Ranks the driver features by the strength of their correlation with an outcome
+
+    Parameters:
+    - store (dict): correlation store from load_store
+    - outcome (str): one of outcome_features
+    - top (int): number of drivers returned
+    - controls (list): features the partial correlation controls for
+
+    Returns:
+    - list: [{"feature", "correlation", "partial", "nights", "lag"}] strongest first, partial is None when
+            there are too few nights for the number of controls
+    """
+    corr = correlation_matrix(store)
+    index = {name: i for i, name in enumerate(feature_names)}
+    target = index[outcome]
+
+    drivers = np.array([index[name] for name in driver_features])
+    r = corr[drivers, target]
+    keep = ~np.isnan(r)
+    drivers, r = drivers[keep], r[keep]
+
+    # partial correlation of each driver with the outcome given the control features, all drivers in one
+    # batched inverse. A control that is the driver itself is blanked out (zero correlation = no effect).
+    control_columns = np.array([index[name] for name in controls if name != outcome], dtype=int)
+    columns = np.column_stack([drivers, np.full(len(drivers), target),
+                               np.broadcast_to(control_columns, (len(drivers), len(control_columns)))])
+    corr_blank = np.where(np.isnan(corr), 0.0, corr)
+    stacked = corr_blank[columns[:, :, None], columns[:, None, :]]
+    same = columns[:, 2:] == drivers[:, None]
+    stacked[:, 2:, :][same] = 0.0
+    stacked.transpose(0, 2, 1)[:, 2:, :][same] = 0.0
+    partial = partial_matrices(stacked)[:, 0, 1]
+    nights = store["n"][drivers, target]
+    partial[nights <= min_partial_nights((~same).sum(axis=1))] = np.nan
+
+    order = np.argsort(-np.abs(r))[:top]
+    return [
+        {
+            "feature": feature_names[drivers[k]],
+            "correlation": float(r[k]),
+            "partial": None if np.isnan(partial[k]) else float(partial[k]),
+            "nights": int(nights[k]),
+            "lag": next((lag for lag in feature_lags if feature_names[drivers[k]].endswith(f"_lag{lag}")), 0)
+        }
+        for k in order
+    ]
+
+
+if __name__ == "__main__":
+    store = update_correlation_store()
+    print(f"Correlation store holds {len(store['dates'])} night(s)")
@@ -0,0 +1,225 @@
+"""
+Plans tonight's bedtime and wake time by scoring every candidate schedule
+- candidate bed and wake times every 5 minutes across a plausible range form a (bedtimes x wake times) grid
+- each candidate is scored against a cost model in one broadcasted NumPy expression:
+    regularity  - distance from the target window: target_duration centred on the chronotype midpoint (the
+                  sleep corrected free day midpoint), kept within target_midpoint_range. Anchoring on the
+                  recent mean would lock in a drifting late schedule, this way a late schedule is planned
+                  earlier and an early one later.
+    duration    - distance from the target sleep duration
+    social jet lag - distance of the sleep midpoint from the free day midpoint
+    sleep debt  - shortfall against the target plus a share of the recent debt to recover
+- the cheapest candidate is the plan, reached through a glide path that moves at most
+  max_shift_per_night per night
+- plans are cached per date and data version
+
+Times are minutes relative to 00:00 on the wake-up date (bedtimes before midnight are negative).
+"""
+
+import numpy as np
+
+from data_handling.data_recall import sleep_windows, date_list
+from data_handling.data_version import current_data_version
+from data_analysis.sleep_scores import wrap_minutes, format_time
+
+# candidate range and resolution
+grid_step = 5
+bedtime_range = (-4 * 60, 2 * 60)     # 20:00 to 02:00
+wake_range = (5 * 60, 11 * 60)        # 05:00 to 11:00
+
+target_duration = 8 * 60
+min_duration = 6 * 60
+
+# midpoints the target window may have: 22:00-06:00 to 00:00-08:00 for the target duration
+target_midpoint_range = (2 * 60, 4 * 60)
+
+history_days = 14
+recency_halflife = 3       # nights, recent nights count more towards "your usual times"
+debt_days = 7
+debt_recovery_nights = 3   # recent debt is paid back over this many nights
+max_recovery = 60          # never plan more than this much extra sleep per night
+
+max_shift_per_night = 15   # minutes the schedule moves per night along the glide path
+
+# weights of the cost terms, each term is in squared hours
+cost_weights = {"regularity": 1.0, "duration": 2.0, "social_jet_lag": 0.5, "sleep_debt": 1.5}
+
+# used when there is no recent sleep data at all
+default_plan = (-60, 7 * 60)
+
+# (date, days) -> {"version": data version, "plan": plan_sleep result}
+_plan_cache = {}
+
+
+def sleep_history(date, days=history_days):
+    """
+    Recent onsets / offsets with recency weights
+
+    Returns:
+    dict: {"onset": [], "offset": [], "weight": [], "free": []} arrays over the valid nights, newest first
+    """
+    windows = sleep_windows(date_list(date, days))
+    valid = windows["valid"]
+
+    days_back = np.arange(days)[valid]
+    weekday = (np.array(windows["dates"], dtype="datetime64[D]").astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday
+
+    return {
+        "onset": wrap_minutes(windows["onset_minute"][valid]).astype(float),
+        "offset": wrap_minutes(windows["offset_minute"][valid]).astype(float),
+        "weight": 0.5 ** (days_back / recency_halflife),
+        "free": weekday[valid] >= 5
+    }
+
+
+def usual_schedule(history):
+    """
+    Recency weighted mean bedtime and wake time, default_plan without any history
+
+    Returns:
+    tuple: (bedtime, wake time)
+    """
+    if not len(history["weight"]):
+        return default_plan
+
+    weight = history["weight"] / history["weight"].sum()
+    return float((weight * history["onset"]).sum()), float((weight * history["offset"]).sum())
+
+
+def chronotype_midpoint(history):
+    """
+    Midpoint of the target window: the free day midpoint corrected for oversleep on free days (half the
+    difference between free day and average sleep duration, as in the Munich ChronoType Questionnaire's
+    MSFsc), clipped to target_midpoint_range. Without free days the usual midpoint stands in for it.
+
+    Returns:
+    float: minutes relative to 00:00
+    """
+    if not len(history["weight"]):
+        return float(np.mean(default_plan))
+
+    duration = history["offset"] - history["onset"]
+    midpoint = (history["onset"] + history["offset"]) / 2
+    free = history["free"]
+
+    if free.any():
+        chronotype = midpoint[free].mean() - max(duration[free].mean() - duration.mean(), 0) / 2
+    else:
+        chronotype = float(np.mean(usual_schedule(history)))
+
+    return float(np.clip(chronotype, *target_midpoint_range))
+
+
+def target_window(history):
+    """
+    Bedtime and wake time the regularity term pulls towards
+
+    Returns:
+    tuple: (bedtime, wake time)
+    """
+    midpoint = chronotype_midpoint(history)
+    return midpoint - target_duration / 2, midpoint + target_duration / 2
+
+
+def candidate_grid():
+    """
+    Returns:
+    tuple: (bedtimes column, wake times row) broadcastable to the full grid
+    """
+    bedtimes = np.arange(bedtime_range[0], bedtime_range[1] + 1, grid_step, dtype=float)[:, None]
+    wake_times = np.arange(wake_range[0], wake_range[1] + 1, grid_step, dtype=float)[None, :]
+
+    return bedtimes, wake_times
+
+
+def schedule_costs(history, bedtimes, wake_times, weights=cost_weights):
+    """
+    Scores every (bedtime, wake time) candidate at once
+
+    Returns:
+    dict: total and per term costs, each (bedtimes x wake times)
+    """
+    hours = 60.0
+    duration = wake_times - bedtimes
+    midpoint = (bedtimes + wake_times) / 2
+
+    target_onset, target_offset = target_window(history)
+    terms = {"regularity": ((bedtimes - target_onset) / hours) ** 2 + ((wake_times - target_offset) / hours) ** 2}
+
+    terms["duration"] = ((duration - target_duration) / hours) ** 2 + np.where(duration < min_duration, 100.0, 0.0)
+
+    free = history["free"]
+    if free.any():
+        free_midpoint = ((history["onset"][free] + history["offset"][free]) / 2).mean()
+        terms["social_jet_lag"] = ((midpoint - free_midpoint) / hours) ** 2
+    else:
+        terms["social_jet_lag"] = np.zeros_like(duration)
+
+    recent = slice(0, debt_days)
+    nightly = history["offset"][recent] - history["onset"][recent]
+    debt = np.maximum(target_duration - nightly, 0).sum()
+    recovery = min(debt / debt_recovery_nights, max_recovery)
+    terms["sleep_debt"] = (np.maximum(target_duration + recovery - duration, 0) / hours) ** 2
+
+    terms["total"] = sum(weights[name] * terms[name] for name in weights)
+    terms["recovery"] = recovery
+
+    return terms
+
+
+def glide_path(start, end, max_shift=max_shift_per_night):
+    """
+    Nightly (bedtime, wake time) steps from the current schedule to the plan
+
+    Returns:
+    list: [(bedtime, wake time)] one per night, ending on the plan
+    """
+    start, end = np.asarray(start, dtype=float), np.asarray(end, dtype=float)
+    nights = max(1, int(np.ceil(np.abs(end - start).max() / max_shift)))
+
+    steps = start + (end - start) * (np.arange(1, nights + 1)[:, None] / nights)
+    steps = np.round(steps / grid_step) * grid_step
+
+    return [(float(bed), float(wake)) for bed, wake in steps]
+
+
+def plan_sleep(date, days=history_days):
+    """
+    Finds the best schedule for the nights after date
+
+    Returns:
+    dict: {"bedtime": minutes, "wake_time": minutes, "cost": {term: value}, "recovery": extra minutes,
+           "current": (usual bedtime, usual wake time), "target": target_window,
+           "glide_path": [(bedtime, wake time)]}
+    """
+    history = sleep_history(date, days)
+    bedtimes, wake_times = candidate_grid()
+    costs = schedule_costs(history, bedtimes, wake_times)
+
+    best = np.unravel_index(np.argmin(costs["total"]), costs["total"].shape)
+    plan = (float(bedtimes[best[0], 0]), float(wake_times[0, best[1]]))
+
+    current = usual_schedule(history)
+
+    return {
+        "bedtime": plan[0],
+        "wake_time": plan[1],
+        "cost": {name: float(costs[name][best]) for name in cost_weights},
+        "recovery": float(costs["recovery"]),
+        "current": current,
+        "target": target_window(history),
+        "glide_path": glide_path(current, plan)
+    }
+
+
+def cached_plan(date, days=history_days):
+    """
+    plan_sleep, computed once per date and data version
+    """
+    version = current_data_version()
+    cached = _plan_cache.get((date, days))
+    if cached is None or cached["version"] != version:
+        cached = {"version": version, "plan": plan_sleep(date, days)}
+        _plan_cache[(date, days)] = cached
+
+    return cached["plan"]
@@ -1,11 +1,21 @@
 """
 Takes sleep data for a night and calculates scores
 - default callback period of 7 days for webapp
+- st_devs, interdaily_stability and social_jet_lag can add bootstrap confidence intervals (bootstrap=number of
+  resamples). They always return the same value as without, the (low, high) intervals go into the dict passed
+  as intervals, keyed by metric name. The nights are resampled through one (resamples x nights) index matrix
+  and each metric is computed for all resamples at once by the same array function that gives the point
+  estimate. Social jet lag resamples free days and workdays separately.
 """
 
 import numpy as np
 from datetime import datetime, timedelta
-from data_handling.data_recall import sleep_times, date_list
+from data_handling.data_recall import sleep_windows, date_list
+
+# a good number of resamples to ask for (bootstrap=bootstrap_resamples), and the fixed seed that keeps the
+# intervals stable between calls
+bootstrap_resamples = 2000
+bootstrap_seed = 0
 
 
 
@@ -17,131 +27,174 @@ def format_time(minutes):
 
 
 
-def st_devs(date, callback_period = 7):
+def wrap_minutes(minutes):
+    """
+    Maps minutes of the day (0-1439) onto -720..720 so times either side of midnight are close together
+    """
+    minutes = np.asarray(minutes)
+    return np.where(minutes > 12 * 60, minutes - 24 * 60, minutes)
+
+
+def bootstrap_indices(n_nights, resamples=bootstrap_resamples, seed=bootstrap_seed):
+    """
+    Night indices of every bootstrap resample, drawn with replacement
+
+    Returns:
+    np.ndarray: (resamples x n_nights) int array
+    """
+    return np.random.default_rng(seed).integers(0, n_nights, size=(resamples, n_nights))
+
+
+def stratified_indices(groups, resamples=bootstrap_resamples, seed=bootstrap_seed):
+    """
+    Bootstrap night indices that resample every group on its own, so each resample keeps the group sizes of
+    the sample (e.g. as many free days as the week had)
+
+    Parameters:
+    - groups (array): group label per night
+
+    Returns:
+    np.ndarray: (resamples x n_nights) int array, the nights of each group in the columns that group had
+    """
+    groups = np.asarray(groups)
+    index = np.empty((resamples, len(groups)), dtype=np.int64)
+    rng = np.random.default_rng(seed)
+
+    for group in np.unique(groups):
+        members = np.flatnonzero(groups == group)
+        index[:, members] = members[rng.integers(0, len(members), size=(resamples, len(members)))]
+
+    return index
+
+
+def percentile_interval(estimates, confidence=0.95):
+    """
+    Percentile confidence interval of bootstrap estimates, resamples where the metric is undefined are left out
+
+    Returns:
+    tuple: (low, high) floats, (None, None) if no resample gave an estimate
+    """
+    estimates = np.asarray(estimates, dtype=float)
+    estimates = estimates[np.isfinite(estimates)]
+    if not len(estimates):
+        return (None, None)
+
+    low, high = np.percentile(estimates, [50 * (1 - confidence), 50 * (1 + confidence)])
+    return (float(low), float(high))
+
+
+def sample_std(values):
+    """
+    Standard deviation (ddof=1) along the last axis, for one sample or a (resamples x nights) batch
+    """
+    return np.std(values, axis=-1, ddof=1)
+
+
+def st_devs(date, callback_period = 7, bootstrap = 0, confidence = 0.95, intervals = None):
     """
     Calculates one of the 5 metrics outlined in the return_5_metrics function. Also returns nighly duration, sleep and wake times
     Parameters:
     str: day to calculate for
     int: number of prev days to include in calculation
+    int: bootstrap resamples for confidence intervals, 0 for none
+    float: confidence level of the intervals
+    dict: intervals, filled with {"StDev_onset": (low, high), "StDev_offset": (low, high), "StDev_duration": (low, high)}
 
     Returns:
     dict: StDevs - {"StDev_onset": float, "StDev_offset": float, "StDev_duration": float, "values": {"duration": [], "sleep_times": [], "wake_times": []}}
     """
 
     # obtain sleep and wake times for last X nights - default 7. date format YYYY-MM-DD
-    dates = date_list(date, callback_period)
-    sleep_time_dict = {}
-
-    for date in dates:
-        sleep_time_dict[str(date)] = sleep_times(date)
-
-    # calculate st dev for sleep and wake times
-    sleep_times_array = []
-    wake_times_array = []
-
-    for day, time in sleep_time_dict.items():
-
-        # extract sleep times, taking time in minutes before 00:00 as positive
-        sleep_time_str = time['onset_time']
-        sleep_time_obj = datetime.strptime(sleep_time_str, "%H:%M") # turn intp datetime
-        minutes = sleep_time_obj.hour * 60 + sleep_time_obj.minute  # calculate the minutes from midnight
-        
-        if minutes > 12 * 60:
-            minutes -= 24 * 60
-        sleep_times_array.append(minutes*-1)
-    
-        # extract wake times, taking time past 00:00 as positive
-        wake_time_str = time['offset_time']
-        wake_time_obj = datetime.strptime(wake_time_str, "%H:%M") # turn intp datetime
-        minutes = wake_time_obj.hour * 60 + wake_time_obj.minute  # calculate the minutes from midnight
-        
-        if minutes > 12 * 60:
-            minutes -= 24 * 60
-        wake_times_array.append(minutes)
-
-    # print(sleep_times_array)
-    # print(wake_times_array)
+    windows = sleep_windows(date_list(date, callback_period))
+    valid = windows["valid"]
+
+    # sleep times in minutes before 00:00 as positive, wake times in minutes past 00:00 as positive
+    sleep_times_array = -wrap_minutes(windows["onset_minute"][valid])
+    wake_times_array = wrap_minutes(windows["offset_minute"][valid])
 
     # calculate duration
-    duration_array = []
+    duration_array = sleep_times_array + wake_times_array
 
-    for i in range(len(sleep_times_array)):
-        dur = sleep_times_array[i] + wake_times_array[i]
-        duration_array.append(dur)
-    
-    st_dev_duration = np.std(duration_array, ddof=1)
-    # print(f"Duration array: {duration_array}")
-    # print(st_dev_duration)
+    st_dev_duration = sample_std(duration_array)
 
     # calc standard dev of sleep time
-    st_dev_sleep = np.std(sleep_times_array, ddof=1)
-    # print(f"sleep array: {sleep_times_array}")
-    # print(st_dev_sleep)
+    st_dev_sleep = sample_std(sleep_times_array)
 
     # calc standard dev of wake time 
-    st_dev_wake = np.std(wake_times_array, ddof=1)
-    # print(f"wake array: {wake_times_array}")
-    # print(float(st_dev_wake))
+    st_dev_wake = sample_std(wake_times_array)
 
-    return {"StDev_onset": float(st_dev_sleep), "StDev_offset": float(st_dev_wake), "StDev_duration": float(st_dev_duration), "values": {"duration": duration_array, "sleep_times": sleep_times_array, "wake_times": wake_times_array}}
+    result = {"StDev_onset": float(st_dev_sleep), "StDev_offset": float(st_dev_wake), "StDev_duration": float(st_dev_duration), "values": {"duration": duration_array.tolist(), "sleep_times": sleep_times_array.tolist(), "wake_times": wake_times_array.tolist()}}
 
+    names = ["StDev_onset", "StDev_offset", "StDev_duration"]
+    if bootstrap and intervals is not None and len(duration_array) > 1:
+        # (3 x nights) series resampled together, so each resample keeps a night's onset, offset and duration paired
+        series = np.stack([sleep_times_array, wake_times_array, duration_array])
+        resampled = sample_std(series[:, bootstrap_indices(len(duration_array), bootstrap)])
+        intervals.update({key: percentile_interval(estimates, confidence) for key, estimates in zip(names, resampled)})
+    elif bootstrap and intervals is not None:
+        intervals.update({key: (None, None) for key in names})
 
-def generate_binary_sleep_wake(sleep_time, wake_time, epochs_per_day=24):
+    return result
+
+
+def sleep_wake_matrix(sleep_minutes, wake_minutes, epochs_per_day=24):
     """
-    Generate binary sleep (0) vs awake (1) data for a single day based on sleep and wake times.
+    Generate binary sleep (0) vs awake (1) data for many nights at once.
 
     Parameters:
-    - sleep_time (str): Sleep time in "HH:MM" format.
-    - wake_time (str): Wake time in "HH:MM" format.
+    - sleep_minutes (array): sleep time per night, local minute of the day.
+    - wake_minutes (array): wake time per night, local minute of the day.
     - epochs_per_day (int): Number of epochs per day (default: 24 for hourly resolution).
 
     Returns:
-    - list: Binary sleep/awake data for the day (0 for sleep, 1 for awake).
+    - np.ndarray: (nights x epochs_per_day) int array, 0 for sleep, 1 for awake.
     """
-    sleep_dt = datetime.strptime(sleep_time, "%H:%M")
-    wake_dt = datetime.strptime(wake_time, "%H:%M")
+    sleep = np.asarray(sleep_minutes).reshape(-1, 1)
+    wake = np.asarray(wake_minutes).reshape(-1, 1)
+
+    # start minute of each epoch
+    epoch_duration = 1440 // epochs_per_day
+    epoch_starts = np.arange(0, 1440, epoch_duration)[None, :]
 
-    # Handle cases where bedtime is after midnight
-    if wake_dt <= sleep_dt:
-        wake_dt += timedelta(days=1)
+    # same day window, or a window that crosses midnight
+    asleep = np.where(
+        sleep < wake,
+        (epoch_starts >= sleep) & (epoch_starts < wake),
+        (sleep > wake) & ((epoch_starts >= sleep) | (epoch_starts < wake))
+    )
 
-    # Create epoch intervals
-    epoch_duration = 1440 // epochs_per_day  # Duration of each epoch in minutes
-    binary_data = []
+    return (~asleep).astype(int)
 
-    for minute in range(0, 1440, epoch_duration):
-        # Generate the timestamp for the current epoch
-        current_time = (datetime.min + timedelta(minutes=minute)).time()
 
-        # Determine sleep or awake status
-        if sleep_dt.time() <= current_time < wake_dt.time() or (
-            sleep_dt.time() > wake_dt.time() and (current_time >= sleep_dt.time() or current_time < wake_dt.time())
-        ):
-            binary_data.append(0)  # Sleep
-        else:
-            binary_data.append(1)  # Awake
+def generate_binary_sleep_wake(sleep_time, wake_time, epochs_per_day=24):
+    """
+    Generate binary sleep (0) vs awake (1) data for a single day based on sleep and wake times.
 
-    # print(f"Binrary data: {binary_data}")
+    Parameters:
+    - sleep_time (int): Sleep time, local minute of the day.
+    - wake_time (int): Wake time, local minute of the day.
+    - epochs_per_day (int): Number of epochs per day (default: 24 for hourly resolution).
 
-    return binary_data
+    Returns:
+    - list: Binary sleep/awake data for the day (0 for sleep, 1 for awake).
+    """
+    return sleep_wake_matrix([sleep_time], [wake_time], epochs_per_day)[0].tolist()
 
 
-def binary_sleep_wake_list(date, epochs, callback_period = 7):
+def binary_sleep_wake_array(date, epochs, callback_period = 7):
+    """
+    Returns the (nights x epochs) sleep/wake matrix for the callback period, most recent night first
+    """
+    windows = sleep_windows(date_list(date, callback_period))
+    valid = windows["valid"]
 
+    return sleep_wake_matrix(windows["onset_minute"][valid], windows["offset_minute"][valid], epochs)
 
 
-    # generate date list for the callback period
-    reference_date = datetime.strptime(date, "%Y-%m-%d")
-    date_list = [(reference_date - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(callback_period)]
+def binary_sleep_wake_list(date, epochs, callback_period = 7):
 
     # Generate binary data for all days
-    binary_sleep_wake_list = []
-
-    for date in date_list:
-        sleep_time = sleep_times(date)['onset_time']
-        wake_time = sleep_times(date)['offset_time']
-        binary_data = generate_binary_sleep_wake(sleep_time, wake_time, epochs)
-        binary_sleep_wake_list.append(binary_data)
+    binary_sleep_wake_list = binary_sleep_wake_array(date, epochs, callback_period).tolist()
 
     # If only one night of data is provided, IS = 1
     if len(binary_sleep_wake_list) == 1:
@@ -151,7 +204,32 @@ def binary_sleep_wake_list(date, epochs, callback_period = 7):
 
 
 
-def interdaily_stability(date, callback_period = 7):
+def interdaily_stability_matrix(binary_sw):
+    """
+    IS of a (nights x epochs) sleep/wake matrix, or of a (resamples x nights x epochs) batch of them
+
+    Returns:
+    - float or np.ndarray: IS per matrix, 0 where the denominator is zero
+    """
+    binary_sw = np.asarray(binary_sw, dtype=float)
+    N, p = binary_sw.shape[-2:]  # Number of days, epochs per day
+
+    # overall mean (X̄) and hourly means across all days (X̄_h)
+    overall_mean = binary_sw.mean(axis=(-2, -1), keepdims=True)
+    hourly_means = binary_sw.mean(axis=-2, keepdims=True)
+
+    # Numerator: Variance of hourly means across days, scaled by N
+    numerator = N * np.sum((hourly_means - overall_mean) ** 2, axis=(-2, -1))
+
+    # Denominator: Total variance of all data, scaled by p
+    denominator = p * np.sum((binary_sw - overall_mean) ** 2, axis=(-2, -1))
+
+    # Handle edge case if denominator is zero
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(denominator > 0, numerator / denominator, 0.0)
+
+
+def interdaily_stability(date, callback_period = 7, bootstrap = 0, confidence = 0.95, intervals = None):
     """
     Calculate interdaily stability (IS) metric. IS evaluates the degree to which an individual's sleep or activity pattern aligns with a consistent daily rhythm.
     It assesses the regularity of these patterns across multiple days.
@@ -159,36 +237,29 @@ def interdaily_stability(date, callback_period = 7):
     Parameters:
     - date (Str): day to calculate from - from 00:00 to 23:59
     - callback_period (int): days preceeding date for which to calculate IS
+    - bootstrap (int): resamples for a confidence interval, 0 for none
+    - confidence (float): confidence level of the interval
+    - intervals (dict): filled with {"IS": (low, high)} when bootstrapping
 
     Returns:
-    - float: The calculated IS value. Closer to 1 indicates more regular 
+    - float: The calculated IS value. Closer to 1 indicates more regular
     """
     epochs_per_day = 24
 
-    binary_sw_list = binary_sleep_wake_list(date, epochs_per_day, callback_period)
-
-    # Flatten the data to compute the overall mean (X̄)
-    all_data = np.concatenate(binary_sw_list)
-    overall_mean = np.mean(all_data)  # X̄
-
-    # print("Binary Sleep/Wake List:", binary_sleep_wake_list)
+    binary_sw = binary_sleep_wake_array(date, epochs_per_day, callback_period)
 
-    # Compute hourly means across all days (X̄_h)
-    hourly_means = []
+    # If only one night of data is provided, IS = 1
+    if len(binary_sw) == 1:
+        if bootstrap and intervals is not None:
+            intervals["IS"] = (None, None)
+        return 1.0
 
-    for epoch in range(epochs_per_day):
-        hourly_values = [day[epoch] for day in binary_sw_list if len(day) > epoch]
-        hourly_means.append(np.mean(hourly_values))
+    IS = float(interdaily_stability_matrix(binary_sw))
+    if bootstrap and intervals is not None:
+        # (resamples x nights x epochs) in one go, 2000 x 7 x 24 is well under a millisecond per metric
+        resampled = interdaily_stability_matrix(binary_sw[bootstrap_indices(len(binary_sw), bootstrap)])
+        intervals["IS"] = percentile_interval(resampled, confidence)
 
-    # Numerator: Variance of hourly means across days, scaled by N
-    N = len(binary_sw_list)  # Number of days
-    numerator = N * np.sum((np.array(hourly_means) - overall_mean) ** 2)
-
-    #  print(f"overall:{overall_mean}")
-    # Denominator: Total variance of all data, scaled by p
-    p = epochs_per_day
-    denominator = p * np.sum((all_data - overall_mean) ** 2)
-    IS = numerator / denominator if denominator > 0 else 0  # Handle edge case if denominator is zero
     return IS
 
 
@@ -197,25 +268,39 @@ def calculate_sleep_midpoint(sleep_time, wake_time):
     Calculate the sleep midpoint given sleep and wake times.
 
     Parameters:
-    - sleep_time (str): Sleep time in "HH:MM" format.
-    - wake_time (str): Wake time in "HH:MM" format.
+    - sleep_time (int or array): Sleep time, local minute of the day.
+    - wake_time (int or array): Wake time, local minute of the day.
 
     Returns:
-    - datetime.time: The sleep midpoint as a time object.
+    - np.ndarray: The sleep midpoint as a minute of the day (0-1439, fractional).
     """
-    sleep_dt = datetime.strptime(sleep_time, "%H:%M")
-    wake_dt = datetime.strptime(wake_time, "%H:%M")
+    sleep_time = np.asarray(sleep_time)
+    wake_time = np.asarray(wake_time)
 
     # Handle next-day wake time
-    if wake_dt <= sleep_dt:
-        wake_dt += timedelta(days=1)
+    duration = (wake_time - sleep_time) % 1440
+    duration = np.where(duration == 0, 1440, duration)
 
-    duration = wake_dt - sleep_dt
-    midpoint = sleep_dt + duration / 2
-    return midpoint.time()
+    return (sleep_time + duration / 2) % 1440
 
 
-def social_jet_lag(date, callback_period = 7):
+def midpoint_difference(midpoints, free):
+    """
+    Mean free day midpoint minus mean workday midpoint in hours, along the last axis, so it works for one
+    set of nights or a (resamples x nights) batch. A group without nights counts as 0, like a missing week part.
+    """
+    free = np.asarray(free, dtype=bool)
+    n_free = free.sum(axis=-1)
+    n_work = free.shape[-1] - n_free
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        free_midpoint_avg = np.where(n_free > 0, np.sum(midpoints * free, axis=-1) / n_free, 0) / 60
+        work_midpoint_avg = np.where(n_work > 0, np.sum(midpoints * ~free, axis=-1) / n_work, 0) / 60
+
+    return free_midpoint_avg - work_midpoint_avg
+
+
+def social_jet_lag(date, callback_period = 7, bootstrap = 0, confidence = 0.95, intervals = None):
     """
     Social jet lag is the mismatch in average midsleep timing between workdays and free days
     Free days are classified as saturday and sunday 
@@ -223,46 +308,40 @@ def social_jet_lag(date, callback_period = 7):
     Parameters:
     - date (str): day to calculate from - from 00:00 to 23:59
     - callback_period (int): days over which to calculate
+    - bootstrap (int): resamples for a confidence interval, 0 for none
+    - confidence (float): confidence level of the interval
+    - intervals (dict): filled with {"SJL": (low, high)} when bootstrapping
 
     Returns:
     - float: Social Jet Lag (SJL) in hours (can be positive or negative).
     """
 
-    # obtain list of sleep and wake time pairs
-    time_dict = {}
-
-    # generate date list
-    dates = date_list(date, callback_period)
-
-    # iterate date list to generate list of sleep and wake pairs
-    for date in dates:
-        new_times = sleep_times(date)
-        time_dict[date] = ((new_times['onset_time'], new_times['offset_time']))
+    # obtain sleep and wake times for every night in the period
+    windows = sleep_windows(date_list(date, callback_period))
+    valid = windows["valid"]
 
-    #  print(time_dict)
+    # midpoint for each night in whole minutes, handling sleep time past midnight
+    midpoints = np.floor(calculate_sleep_midpoint(windows["onset_minute"], windows["offset_minute"]))[valid]
 
-    workday_midpoints = []
-    freeday_midpoints = []
+    # Determine if the date is a workday or free day - Saturday (5) and Sunday (6)
+    days = np.array(windows["dates"], dtype="datetime64[D]")[valid]
+    weekday = (days.astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday
+    free = weekday >= 5
 
-    # calculate midpoint for each night, handling sleep time past midnight
-    for date, times in time_dict.items():
-        sleep_time = times[0]
-        wake_time = times[1]
-        midpoint = calculate_sleep_midpoint(sleep_time, wake_time)
+    # Calculate SJL from the workday and free day averages, in hours
+    sjl = float(midpoint_difference(midpoints, free))
+    if not bootstrap or intervals is None:
+        return sjl
 
-        # Determine if the date is a workday or free day
-        date_dt = datetime.strptime(date, "%Y-%m-%d")
-        if date_dt.weekday() in [5, 6]:  # Saturday (5) and Sunday (6)
-            freeday_midpoints.append(midpoint)
-        else:
-            workday_midpoints.append(midpoint)
+    if free.all() or not free.any():
+        # without free days or without workdays there is no difference to resample
+        intervals["SJL"] = (None, None)
+    else:
+        # free days and workdays are resampled separately, a plain resample of a week can draw no free day at
+        # all and would count that group as 0
+        index = stratified_indices(free, bootstrap)
+        intervals["SJL"] = percentile_interval(midpoint_difference(midpoints[index], free[index]), confidence)
 
-    # Convert midpoints to hours for averaging
-    work_midpoint_avg = sum(mp.hour + mp.minute / 60 for mp in workday_midpoints) / len(workday_midpoints) if workday_midpoints else 0
-    free_midpoint_avg = sum(mp.hour + mp.minute / 60 for mp in freeday_midpoints) / len(freeday_midpoints) if freeday_midpoints else 0
-
-    # Calculate SJL
-    sjl = free_midpoint_avg - work_midpoint_avg
     return sjl
 
 #  print(social_jet_lag('2024-12-01', 1))
@@ -295,70 +374,25 @@ def sleep_score():
 
 def optimal_bedtime(date, callback_period = 7):
     """
-    Takes st dev in sleep, wake time and midpoint for last 7 days
-    Takes target sleep duration
-    Returns optimal bedtime and waketime
-
-    """
-
-   # Parse the input date and calculate the target date 3 days later
-    target_date = datetime.strptime(date, '%Y-%m-%d') + timedelta(days=3)
-    today = datetime.strptime(date, '%Y-%m-%d')
-    days_to_target = (target_date - today).days
-
-    if days_to_target < 0 or days_to_target > 3:
-        raise ValueError("The input date should be within 3 days of the target date.")
-    
-    stdev_7_days = st_devs(date, 7)
-
-    # calc avg wake time
-    wake_times = stdev_7_days['values']['wake_times']
-    avg_wake_time = sum(wake_times) / len(wake_times)
-
-    # calc avg sleep time
-    sleep_times = stdev_7_days['values']['sleep_times']
-    avg_sleep_time = sum(sleep_times) / len(sleep_times)
-
-    # call each of the sleep score metrics for the last 7 day average value
+    Recommended bedtime and wake time for tonight - the first step of the glide path from the recent
+    schedule towards the best scoring schedule (see sleep_planner)
 
-    stdev_wake_time = stdev_7_days['StDev_offset']
-    stdev_sleep_time = stdev_7_days['StDev_onset']
-
-    # SJL in minutes
-    sjl_minutes = social_jet_lag(date, callback_period) * 60
-
-  # Target sleep duration (adjust slightly for SJL)
-    target_sleep_duration = 480  # 8 hours in minutes
-    if abs(sjl_minutes) > 30:  # Adjust duration if SJL is significant
-        target_sleep_duration += -10 if sjl_minutes > 0 else 10  # Small adjustment
-
-    # Calculate the ideal midpoint
-    avg_midpoint = (avg_sleep_time + avg_wake_time) / 2
-    ideal_midpoint = avg_midpoint - sjl_minutes / 2  # Adjust midpoint based on SJL
-
-    # Calculate bedtime and wake time
-    ideal_bedtime = ideal_midpoint - target_sleep_duration / 2
-    ideal_wake_time = ideal_midpoint + target_sleep_duration / 2
-
-    # Gradual adjustment factor based on days to target
-    adjustment_factor = 1 / days_to_target
-
-    # Adjust bedtime and wake time gradually toward ideal values
-    optimized_bedtime = avg_sleep_time + adjustment_factor * (ideal_bedtime - avg_sleep_time)
-    optimized_wake_time = avg_wake_time + adjustment_factor * (ideal_wake_time - avg_wake_time)
+    Parameters:
+    - date (str): day to plan from, YYYY-MM-DD
+    - callback_period (int): nights of history the plan is based on
 
-    # Reduce variability by nudging toward averages
-    optimized_bedtime -= stdev_sleep_time * adjustment_factor
-    optimized_wake_time -= stdev_wake_time * adjustment_factor
+    Returns:
+    - dict: {"sleep_duration": minutes, "bedtime": "HH:MM", "wake_time": "HH:MM", "plan": plan_sleep result}
+    """
+    # imported here, the planner uses helpers from this module
+    from data_analysis.sleep_planner import cached_plan
 
-    # Ensure sleep duration aligns with adjusted times
-    optimized_sleep_duration = (optimized_wake_time - optimized_bedtime) % (24 * 60)  # Handle midnight rollover
+    plan = cached_plan(date, callback_period)
+    bedtime, wake_time = plan["glide_path"][0]
 
     return {
-        "sleep_duration": optimized_sleep_duration,
-        "bedtime": format_time(optimized_bedtime),
-        "wake_time": format_time(optimized_wake_time)
+        "sleep_duration": wake_time - bedtime,
+        "bedtime": format_time(bedtime),
+        "wake_time": format_time(wake_time),
+        "plan": plan
     }
-
-
-
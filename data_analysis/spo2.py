@@ -0,0 +1,203 @@
+"""
+Nightly blood oxygen (SpO2) from the watch's pulse oximeter readings
+- each night's readings are read from garmin_monitoring.db (monitoring_pulse_ox) with one indexed time range read
+- desaturations are runs of readings at least desaturation_drop points below the baseline (median of the
+  previous baseline_seconds), found with run-length detection on the boolean series, so no per-reading loop
+- the oxygen desaturation index (ODI, desaturations per hour of readings), time below each threshold and the
+  nadir come out of the same arrays
+- results are cached for the most recently used nights and dropped when the data version changes
+
+Overnight dips are often a stuffy room (little ventilation, too warm or humid) or dry air, oxygen_recommendation
+turns them into bedroom advice next to the temperature and humidity advice.
+"""
+
+import sqlite3
+import threading
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+
+from data_handling.data_recall import night_bounds, local_timezone
+from data_handling.data_version import current_data_version
+
+monitoring_db_path = "HealthData/DBs/garmin_monitoring.db"
+
+desaturation_drop = 3        # points below baseline that count as a desaturation (the usual 3% ODI)
+baseline_seconds = 5 * 60    # readings before a reading that make up its baseline
+min_baseline_readings = 3
+max_gap = 5 * 60             # seconds between readings that break a run (and don't count as recorded time)
+thresholds = (94, 90, 88)    # time below each of these is reported
+
+# date -> {"version": data version, "spo2": night_spo2 result}, least recently used first, at most max_cached_nights
+max_cached_nights = 16
+_night_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def load_pulse_ox(start, end, db_path=None):
+    """
+    Reads the SpO2 readings between two UTC epoch seconds (indexed time range read on the timestamp key)
+
+    Parameters:
+    - start (int): epoch seconds UTC
+    - end (int): epoch seconds UTC
+    - db_path (str): garmin_monitoring.db location
+
+    Returns:
+    - tuple: (times, spo2) float64 arrays, epoch seconds and percent. None if there are no readings
+    """
+    import pandas as pd
+
+    # monitoring timestamps are local wall clock time
+    bounds = pd.DatetimeIndex(np.array([start, end], dtype="datetime64[s]")).tz_localize("UTC")
+    local_start, local_end = bounds.tz_convert(local_timezone).tz_localize(None).strftime("%Y-%m-%d %H:%M:%S")
+
+    with sqlite3.connect(db_path or monitoring_db_path) as conn:
+        rows = conn.execute(
+            "SELECT timestamp, pulse_ox FROM monitoring_pulse_ox WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp",
+            (local_start, local_end)
+        ).fetchall()
+
+    if not rows:
+        return None
+
+    spo2 = np.fromiter((row[1] for row in rows), dtype=float, count=len(rows))
+    local = pd.DatetimeIndex(np.array([row[0] for row in rows], dtype="datetime64[ms]"))
+    utc = local.tz_localize(local_timezone, ambiguous="NaT", nonexistent="shift_forward").tz_convert("UTC")
+    times = utc.tz_localize(None).values.astype("datetime64[ms]").astype(np.int64) / 1000
+
+    # readings of 0 are the sensor losing contact
+    keep = ~np.isnat(utc.values) & (spo2 > 0)
+    return np.ascontiguousarray(times[keep]), np.ascontiguousarray(spo2[keep])
+
+
+def rolling_baseline(times, spo2, window=baseline_seconds, min_readings=min_baseline_readings):
+    """
+    Median of the readings in the window seconds before each reading (the reading itself excluded)
+
+    Returns:
+    np.ndarray: NaN where fewer than min_readings readings fall in the window
+    """
+    lo = np.searchsorted(times, times - window, side="left")
+    counts = np.arange(len(times)) - lo
+    width = max(int(counts.max()), 1) if len(times) else 1
+
+    # the previous width readings of every reading, readings outside its window masked out
+    padded = np.r_[np.full(width, np.nan), spo2]
+    previous = np.lib.stride_tricks.sliding_window_view(padded, width)[:len(spo2)]
+    previous = np.where(np.arange(width) >= width - counts[:, None], previous, np.nan)
+
+    # rows without any reading give an all-NaN slice warning, they are NaN either way
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        baseline = np.nanmedian(previous, axis=1)
+
+    return np.where(counts >= min_readings, baseline, np.nan)
+
+
+def reading_durations(times, gap=max_gap):
+    """
+    Seconds each reading stands for: the time to the next reading, the typical interval where that is a gap
+    """
+    if len(times) < 2:
+        return np.full(len(times), 60.0)
+
+    step = np.diff(times)
+    interval = float(np.median(step))
+    step = np.where(step > gap, interval, step)
+    return np.r_[step, interval]
+
+
+def desaturation_runs(times, spo2, baseline, drop=desaturation_drop, gap=max_gap):
+    """
+    Runs of consecutive readings at least drop points below their baseline, a gap in the readings ends a run
+
+    Returns:
+    dict: {"start": index of the first reading, "end": index after the last, "nadir": lowest SpO2} arrays per run
+    """
+    with np.errstate(invalid="ignore"):
+        below = spo2 <= baseline - drop
+
+    # joined: the reading continues a run from the reading before it (both below, no gap between them)
+    joined = np.r_[False, (np.diff(times) <= gap) & below[1:] & below[:-1]]
+    starts = np.flatnonzero(below & ~joined)
+    ends = np.flatnonzero(below & ~np.r_[joined[1:], False]) + 1
+
+    nadir = np.minimum.reduceat(spo2, starts) if len(starts) else np.array([])
+    return {"start": starts, "end": ends, "nadir": nadir}
+
+
+def summarise(times, spo2, events):
+    """
+    Nightly summary, None where there are no readings
+
+    Returns:
+    dict: {"odi", "events", "hours", "nadir", "mean", "below_<threshold>" (minutes) ...}
+    """
+    summary = {"odi": None, "events": 0, "hours": 0.0, "nadir": None, "mean": None}
+    summary.update({f"below_{threshold}": None for threshold in thresholds})
+    if not len(spo2):
+        return summary
+
+    durations = reading_durations(times)
+    hours = float(durations.sum()) / 3600
+    summary.update({
+        "odi": len(events["start"]) / hours if hours else None,
+        "events": int(len(events["start"])),
+        "hours": hours,
+        "nadir": float(spo2.min()),
+        "mean": float(np.average(spo2, weights=durations))
+    })
+    # minutes below each threshold, (thresholds x readings) in one go
+    below = spo2[None, :] < np.array(thresholds, dtype=float)[:, None]
+    for threshold, seconds in zip(thresholds, below @ durations):
+        summary[f"below_{threshold}"] = float(seconds) / 60
+
+    return summary
+
+
+def compute_night_spo2(date, db_path=None):
+    """
+    Computes the SpO2 analysis for the night ending on date, without the cache
+
+    Returns:
+    dict: {"times", "spo2", "baseline"} arrays, desaturation_runs as "events" and the "summary"
+    """
+    empty = np.array([])
+    readings = None
+    bounds = night_bounds(date)
+    if bounds is not None:
+        readings = load_pulse_ox(bounds[0], bounds[1], db_path)
+
+    times, spo2 = readings if readings is not None else (empty, empty)
+    baseline = rolling_baseline(times, spo2) if len(times) else empty
+    events = desaturation_runs(times, spo2, baseline) if len(times) else \
+        {"start": empty.astype(int), "end": empty.astype(int), "nadir": empty}
+
+    return {"times": times, "spo2": spo2, "baseline": baseline, "events": events,
+            "summary": summarise(times, spo2, events)}
+
+
+def night_spo2(date):
+    """
+    Cached SpO2 analysis for a night. The cache entry is rebuilt when a sync publishes a new data version.
+
+    Returns:
+    dict: see compute_night_spo2
+    """
+    version = current_data_version()
+    with _cache_lock:
+        cached = _night_cache.get(date)
+        if cached is not None and cached["version"] == version:
+            _night_cache.move_to_end(date)
+            return cached["spo2"]
+
+    cached = {"version": version, "spo2": compute_night_spo2(date)}
+    with _cache_lock:
+        _night_cache[date] = cached
+        _night_cache.move_to_end(date)
+        while len(_night_cache) > max_cached_nights:
+            _night_cache.popitem(last=False)
+
+    return cached["spo2"]
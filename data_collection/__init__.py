@@ -1,3 +1,10 @@
-# in the init file we include functions from within the folder that we want to be accessed elsewhere
+# in the init file we include functions from within the folder that we want to be accessed elsewhere
+# they are resolved on first access, so importing one submodule doesn't pull in the whole sync job
 
-from .data_aggregator import fetch_night_data, fetch_garmin_data, update_data
\ No newline at end of file
+from data_handling.lazy_exports import lazy_exports
+
+__getattr__, __dir__ = lazy_exports(__name__, {
+    "fetch_night_data": "data_aggregator",
+    "fetch_garmin_data": "data_aggregator",
+    "update_data": "data_aggregator",
+})
@@ -5,67 +5,74 @@ Combine data from bedroom and garmin sources into one datasheet
 
 
 # data_handling/data_collection.py
-import pandas as pd
+import csv
+import io
+import numpy as np
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 import os
 import subprocess
-import requests
-from data_handling.data_recall import sleep_times 
+from data_handling.data_recall import sleep_windows, night_sensor_file
+from data_handling.snapshots import SnapshotWriter
+from data_collection.garmin_manifest import read_manifest, write_manifest, scan_health_data, import_flags
 from data_analysis.sleep_scores import sleep_regularity_index, social_jet_lag, st_devs, optimal_bedtime, composite_phase_dev, interdaily_stability
 
 # Get current date and time in London timezone
 london_timezone = ZoneInfo("Europe/London")
 
 
-# thingspeak
-channel_id = "2769273"  
-api_key = "Y9BRF2CSL00WMO2X"  
+# thingspeak
+from data_collection.thingspeak import channel_id, api_key
 
 save_path="data_handling/night_sensor_data"
 
 
-def encoded_timestamp(date, time):
+def encoded_timestamp(epoch_minute):
     """
-    Combines a date and time into a URL-encoded ISO 8601 timestamp format.
+    Formats a UTC epoch minute as a URL-encoded ThingSpeak timestamp. The epoch carries the calendar day, so
+    a bedtime before midnight lands on the day before the wake-up date.
 
     Parameters:
-    - date_str (str): Date in "YYYY-MM-DD" format.
-    - time_str (str): Time in "HH:MM" or "HH:MM:SS" format.
+    - epoch_minute (int): Minutes since 1970-01-01 UTC, e.g. sleep_windows' onset_epoch.
 
     Returns:
-    - str: URL-encoded timestamp (e.g., "2024-12-06%20%07:00:00").
+    - str: URL-encoded UTC timestamp (e.g., "2024-12-06%2007:00:00").
     """
-    # Ensure time includes seconds
-    if len(time.split(":")) == 2:
-        time += ":00"  # Add seconds if not present
+    timestamp = np.datetime64(int(epoch_minute), "m")
 
-    # Combine date and time
-    full_datetime = f"{date}T{time}"
+    # Format with URL encoding for the space
+    return str(timestamp.astype("datetime64[s]")).replace("T", "%20")
 
-    # Convert to datetime object to validate
-    dt = datetime.fromisoformat(full_datetime)
 
-    # Format with URL encoding for the space
-    return dt.strftime("%Y-%m-%d%%20%H:%M:%S")
+def night_window(date):
+    """
+    ThingSpeak start and end of the night ending on date, None if the night has no sleep window
+
+    Returns:
+    - tuple: (start, end) URL-encoded UTC timestamps
+    """
+    windows = sleep_windows([date])
+    if not windows["valid"][0]:
+        return None
 
+    return encoded_timestamp(windows["onset_epoch"][0]), encoded_timestamp(windows["offset_epoch"][0])
 
 
-# Example function to fetch data from GarminDB
-def fetch_garmin_data():
+
+def run_garmindb(arguments):
     """
-    Runs the garmindb_cli.py command to download, import, and analyze the latest data.
-    
+    Runs garmindb_cli.py with the given arguments
+
     Returns:
-    - str: The output of the command execution.
+    - str: The output of the command execution, None if it failed.
     """
     try:
         # Define the command to be executed
-        command = ["garmindb_cli.py", "--all", "--download", "--import", "--analyze", "--latest"]
-        
+        command = ["garmindb_cli.py"] + arguments
+
         # Run the command using subprocess
         result = subprocess.run(command, capture_output=True, text=True, check=True)
-        
+
         # Return the command's output
         return result.stdout
     except subprocess.CalledProcessError as e:
@@ -74,6 +81,37 @@ def fetch_garmin_data():
     except Exception as e:
         print(f"Unexpected error: {e}")
         return None
+
+
+# Example function to fetch data from GarminDB
+def fetch_garmin_data():
+    """
+    Downloads the latest Garmin data, then imports and analyzes only the data categories (sleep, RHR, weight,
+    monitoring, activities) whose files changed since the last sync. The analyze pass is skipped entirely when
+    nothing new was downloaded.
+
+    Returns:
+    - str: The output of the garmindb_cli.py runs, None if one of them failed.
+    """
+    output = run_garmindb(["--all", "--download", "--latest"])
+    if output is None:
+        return None
+
+    manifest, changed = scan_health_data(read_manifest())
+    if not changed:
+        print("No new Garmin files, skipping import and analyze")
+        # picks up files that were only touched, so they aren't hashed again tomorrow
+        write_manifest(manifest)
+        return output
+
+    print(f"New Garmin data for: {', '.join(changed)}")
+    import_output = run_garmindb(import_flags(changed) + ["--import", "--analyze", "--latest"])
+    if import_output is None:
+        # manifest left as it was, the same files are imported on the next sync
+        return None
+
+    write_manifest(manifest)
+    return output + import_output
     
 
 # Example function to fetch data from ThingSpeak
@@ -93,39 +131,30 @@ def fetch_night_data(date):
     # obtain sleep and wake time for given date
     # print(date)
     
-    sleep_data = sleep_times(date)  # Replace with your date
-    sleep_time = encoded_timestamp(date, sleep_data["onset_time"]) 
-    wake_time = encoded_timestamp(date, sleep_data["offset_time"])
-    
-    print(sleep_time)
-    print(wake_time)
-
-
+    # requests is only needed by the morning sync, it is imported on first use
+    import requests
 
+    window = night_window(date)
+    if window is None:
+        print(f"No sleep window for {date}, nothing to fetch")
+        return None
+    sleep_time, wake_time = window
 
-    
     try:
         
         # Parse ISO 8601 inputs into datetime objects
         print(f"sleeptime: {sleep_time}")
         print(f"waketime: {wake_time}")
 
-        # Construct the ThingSpeak API URL
-        url = f"https://api.thingspeak.com/channels/{channel_id}/feeds.csv?api_key={api_key}&start={sleep_time}&end={wake_time}"
+        # Construct the ThingSpeak API URL, the times are UTC (ThingSpeak's default, sent explicitly)
+        url = f"https://api.thingspeak.com/channels/{channel_id}/feeds.csv?api_key={api_key}&start={sleep_time}&end={wake_time}&timezone=Etc%2FUTC"
         print(url)
         response = requests.get(url)
 
-        # Ensure the save directory exists
-        os.makedirs(save_path, exist_ok=True)
-
-        # Define the file name 
-        file_name = f"nightdata_{date}.csv"
-        print(file_name)
-
-        # Save the data to a CSV file
-        with open(save_path + "/" + file_name, "wb") as file:
-            file.write(response.content)
-        print(f"CSV successfully saved to: {save_path}")
+        # Save the data to a CSV file, staged in the sync's snapshot generation (dashboard workers keep reading
+        # the previous generation until the scheduler publishes it)
+        object_path = SnapshotWriter().write_bytes(night_sensor_file(date), response.content)
+        print(f"CSV successfully saved to: {object_path}")
         return save_path
 
     except requests.exceptions.RequestException as e:
@@ -139,37 +168,51 @@ def fetch_night_data(date):
 
 # Function to update CSV with new data
 def update_data():
+    """
+    Morning sync - pulls Garmin and ThingSpeak data for today and appends the metrics to sleep_metrics.csv
+
+    Returns:
+    - bool: True if both downloads succeeded, False otherwise so the scheduler can retry
+    """
 
     # todays date
     current_time_in_london = datetime.now(london_timezone)
-    date = current_time_in_london.date()
+    date = current_time_in_london.strftime("%Y-%m-%d")
 
     five_metrics_csv_path="data_handling/sleep_metrics.csv"
-    
+
     # Fetch data from GarminDB
-    fetch_garmin_data()
+    garmin_output = fetch_garmin_data()
 
     # Fetch data from ThingSpeak
-    fetch_night_data(date)
+    night_path = fetch_night_data(date)
 
+    if garmin_output is None or night_path is None:
+        print(f"Sync for {date} incomplete, skipping metrics update")
+        return False
 
-    # write all sleep variables to sleep_metrics.csv 
+
+    # write all sleep variables to sleep_metrics.csv, as a new version of the file in the sync's snapshot
+    # generation (never appended in place, dashboard workers may be reading it)
+    writer = SnapshotWriter()
+    content = writer.read_bytes(five_metrics_csv_path)
 
     # Check if the file exists
-    if not os.path.exists(five_metrics_csv_path):
+    if content is None:
         # If the file doesn't exist, create it with headers
         columns = [
             "Date", "StDevs", "StDev_onset", "StDev_offset", "StDev_duration",
             "IS", "SJL", "CPD", "SRI", "optimal_bedtime", "optimal_sleeptime"
         ]
-        df = pd.DataFrame(columns=columns)
-        df.to_csv(five_metrics_csv_path, index=False)
-    else:
-        # Read the existing CSV
-        df = pd.read_csv(five_metrics_csv_path)
+        header = io.StringIO()
+        csv.writer(header).writerow(columns)
+        content = header.getvalue().encode()
+
+    # Read the dates already in the CSV (the csv module is enough here, pandas would dominate the sync's start-up)
+    known_dates = {row[0].strip() for row in csv.reader(io.StringIO(content.decode())) if row}
 
     # Check if the date exists in the file
-    if date not in df["Date"].values:
+    if date not in known_dates:
         print(f"Date {date} not found in the file. Computing and adding data...")
         
         # Call the functions to compute data for the date
@@ -202,17 +245,22 @@ def update_data():
             "optimal_waketime": optimal_wake
         }
         
-        # Convert the dictionary to a DataFrame with a single row
-        new_row_df = pd.DataFrame([new_row])
-
-        # Append to the CSV file
-        new_row_df.to_csv(five_metrics_csv_path, mode='a', header=False, index=False)
+        # Append to the CSV file, NaN / None become empty fields as they did with pandas
+        values = ["" if value is None or (isinstance(value, float) and np.isnan(value)) else value
+                  for value in new_row.values()]
+        row = io.StringIO()
+        csv.writer(row).writerow(values)
+        if content and not content.endswith(b"\n"):
+            content += b"\n"
+        writer.write_bytes(five_metrics_csv_path, content + row.getvalue().encode())
         print(f"Data for {date} successfully added.")
 
         print(f"Data for {date} successfully added.")
     else:
         print(f"Date {date} already exists in the file.")
 
+    return True
+
 
 
 def compare_enviro_data(date):
@@ -0,0 +1,104 @@
+"""
+Manifest of the files GarminDB downloads into HealthData/, so the morning sync only imports what changed
+- every file is recorded with its size, mtime and a content hash, grouped by GarminDB data category
+- a file whose size and mtime are unchanged is taken as unchanged without reading it, otherwise it is hashed,
+  so files re-downloaded with identical content don't trigger an import
+- the manifest is only written after a successful import, a failed import is retried on the next sync
+"""
+
+import hashlib
+import json
+import os
+
+manifest_path = "data_handling/garmin_manifest.json"
+
+# GarminDB data category -> (download folder, garmindb_cli.py flag)
+garmin_categories = {
+    "sleep": ("HealthData/Sleep", "--sleep"),
+    "rhr": ("HealthData/RHR", "--rhr"),
+    "weight": ("HealthData/Weight", "--weight"),
+    "monitoring": ("HealthData/FitFiles/Monitoring", "--monitoring"),
+    "activities": ("HealthData/FitFiles/Activities", "--activities"),
+}
+
+hash_chunk_size = 1 << 20
+
+
+def read_manifest(path=manifest_path):
+    try:
+        with open(path, "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_manifest(manifest, path=manifest_path):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def file_hash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(hash_chunk_size), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def category_files(folder):
+    """
+    Every file under folder, skipping hidden files and folders (such as the sleep index)
+
+    Returns:
+    list: sorted file paths, empty if the folder doesn't exist
+    """
+    files = []
+    for root, dirs, names in os.walk(folder):
+        dirs[:] = [name for name in dirs if not name.startswith(".")]
+        files.extend(os.path.join(root, name) for name in names if not name.startswith("."))
+
+    return sorted(files)
+
+
+def scan_health_data(manifest, categories=garmin_categories):
+    """
+    Compares the files on disk with the manifest
+
+    Parameters:
+    - manifest (dict): previous manifest, {category: {path: [size, mtime_ns, hash]}}
+    - categories (dict): category -> (folder, flag)
+
+    Returns:
+    - tuple: (new manifest, sorted list of categories with new or changed files)
+    """
+    scanned = {}
+    changed = set()
+
+    for category, (folder, _) in categories.items():
+        known = manifest.get(category, {})
+        entries = {}
+        for path in category_files(folder):
+            stat = os.stat(path)
+            previous = known.get(path)
+            if previous is not None and previous[:2] == [stat.st_size, stat.st_mtime_ns]:
+                entries[path] = previous
+                continue
+
+            digest = file_hash(path)
+            entries[path] = [stat.st_size, stat.st_mtime_ns, digest]
+            if previous is None or previous[2] != digest:
+                changed.add(category)
+
+        scanned[category] = entries
+
+    return scanned, sorted(changed)
+
+
+def import_flags(changed, categories=garmin_categories):
+    """
+    garmindb_cli.py flags selecting the changed categories
+    """
+    return [categories[category][1] for category in changed]
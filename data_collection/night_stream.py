@@ -0,0 +1,329 @@
+"""
+Live streaming of bedroom sensor data during the night
+- polls ThingSpeak incrementally (feeds/last.json on the first poll, then feeds.json from a since-cursor)
+- keeps readings in an append-only ring buffer with rolling aggregates that cost O(1) to read
+- writes a small snapshot file that the dashboard's live panel reads
+
+Run with: python -m data_collection.night_stream  (add --mock <nightdata csv> to replay a recorded night)
+"""
+
+import json
+import os
+import sys
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from data_collection.thingspeak import channel_id, api_key
+from data_analysis.environment_alerts import EnvironmentAlerts
+
+# ThingSpeak fields streamed and their names on the dashboard
+stream_fields = {"field1": "temperature", "field2": "humidity"}
+
+snapshot_path = "data_handling/live_snapshot.json"
+
+poll_interval = 15          # seconds, ThingSpeak sensor posts every ~15s
+rolling_window = 15 * 60    # seconds covered by the rolling aggregates
+buffer_capacity = 4 * 60 * 12  # one night of 15 second samples
+
+
+def parse_created_at(created_at):
+    """
+    Parses ThingSpeak created_at strings from the JSON ("2024-12-03T00:15:00Z") or CSV ("2024-12-03 00:15:00 UTC") feeds
+
+    Returns:
+    float: epoch seconds
+    """
+    iso = created_at.replace(" UTC", "+00:00").replace("Z", "+00:00")
+    return datetime.fromisoformat(iso).timestamp()
+
+
+class SensorRingBuffer:
+    """
+    Fixed size, append-only buffer of (time, channel values). Oldest readings are overwritten once full.
+    """
+
+    def __init__(self, capacity=buffer_capacity, n_channels=len(stream_fields)):
+        self.capacity = capacity
+        self.times = np.zeros(capacity)
+        self.values = np.full((capacity, n_channels), np.nan)
+        self.count = 0  # total readings ever appended
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp, values):
+        slot = self.count % self.capacity
+        self.times[slot] = timestamp
+        self.values[slot] = values
+        self.count += 1
+
+    def latest(self, n=None):
+        """
+        Returns the latest n readings (all held readings by default) in time order as (times, values)
+        """
+        n = len(self) if n is None else min(n, len(self))
+        idx = (np.arange(self.count - n, self.count)) % self.capacity
+        return self.times[idx], self.values[idx]
+
+
+class RollingAggregates:
+    """
+    Mean / std / min / max per channel over the last window_seconds.
+    Each update is amortised O(1): sums are adjusted as readings enter and leave the window and
+    min / max come from monotonic deques. Reading the aggregates is O(1).
+    """
+
+    def __init__(self, window_seconds=rolling_window, n_channels=len(stream_fields)):
+        self.window_seconds = window_seconds
+        self.n_channels = n_channels
+        self.window = deque()  # (time, values) currently inside the window
+        self.total = np.zeros(n_channels)
+        self.total_sq = np.zeros(n_channels)
+        self.counts = np.zeros(n_channels, dtype=int)
+        self.min_deques = [deque() for _ in range(n_channels)]
+        self.max_deques = [deque() for _ in range(n_channels)]
+
+    def update(self, timestamp, values):
+        values = np.asarray(values, dtype=float)
+        valid = ~np.isnan(values)
+
+        self.window.append((timestamp, values))
+        self.total[valid] += values[valid]
+        self.total_sq[valid] += values[valid] ** 2
+        self.counts += valid
+
+        for ch in np.flatnonzero(valid):
+            value = values[ch]
+            min_dq, max_dq = self.min_deques[ch], self.max_deques[ch]
+            while min_dq and min_dq[-1][1] >= value:
+                min_dq.pop()
+            min_dq.append((timestamp, value))
+            while max_dq and max_dq[-1][1] <= value:
+                max_dq.pop()
+            max_dq.append((timestamp, value))
+
+        self._evict(timestamp - self.window_seconds)
+
+    def _evict(self, cutoff):
+        while self.window and self.window[0][0] <= cutoff:
+            _, old = self.window.popleft()
+            valid = ~np.isnan(old)
+            self.total[valid] -= old[valid]
+            self.total_sq[valid] -= old[valid] ** 2
+            self.counts -= valid
+
+        for dq in self.min_deques + self.max_deques:
+            while dq and dq[0][0] <= cutoff:
+                dq.popleft()
+
+    def snapshot(self):
+        """
+        Returns:
+        dict: {"count": [], "mean": [], "std": [], "min": [], "max": []} one entry per channel, None where empty
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.total / self.counts
+            var = np.maximum(self.total_sq / self.counts - mean ** 2, 0)
+
+        def as_list(arr):
+            return [float(v) if c > 0 else None for v, c in zip(arr, self.counts)]
+
+        return {
+            "count": self.counts.tolist(),
+            "mean": as_list(mean),
+            "std": as_list(np.sqrt(var)),
+            "min": [float(dq[0][1]) if dq else None for dq in self.min_deques],
+            "max": [float(dq[0][1]) if dq else None for dq in self.max_deques],
+        }
+
+
+def feed_readings(feeds, fields=stream_fields):
+    """
+    Converts ThingSpeak feed entries into (entry_id, epoch seconds, values) tuples
+    """
+    readings = []
+    for entry in feeds:
+        values = []
+        for field in fields:
+            try:
+                values.append(float(entry.get(field)))
+            except (TypeError, ValueError):
+                values.append(np.nan)
+        readings.append((int(entry["entry_id"]), parse_created_at(entry["created_at"]), values))
+
+    return readings
+
+
+class ThingSpeakPoller:
+    """
+    Incremental ThingSpeak reader. The first poll reads feeds/last.json, later polls ask for everything
+    since the last seen reading and drop entries that were already returned.
+    """
+
+    def __init__(self, channel=channel_id, key=api_key, timeout=10):
+        self.base_url = f"https://api.thingspeak.com/channels/{channel}"
+        self.key = key
+        self.timeout = timeout
+        self.last_entry_id = None
+        self.last_time = None
+
+    def poll(self):
+        import requests
+
+        try:
+            if self.last_time is None:
+                response = requests.get(f"{self.base_url}/feeds/last.json", params={"api_key": self.key}, timeout=self.timeout)
+                response.raise_for_status()
+                feeds = [response.json()]  # "-1" when the channel is empty
+            else:
+                start = datetime.fromtimestamp(self.last_time, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+                response = requests.get(f"{self.base_url}/feeds.json", params={"api_key": self.key, "start": start}, timeout=self.timeout)
+                response.raise_for_status()
+                feeds = response.json().get("feeds", [])
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Poll error: {e}")
+            return []
+
+        feeds = [entry for entry in feeds if isinstance(entry, dict)]
+        readings = [r for r in feed_readings(feeds) if self.last_entry_id is None or r[0] > self.last_entry_id]
+        if readings:
+            self.last_entry_id = readings[-1][0]
+            self.last_time = readings[-1][1]
+
+        return readings
+
+
+class MockThingSpeakFeed:
+    """
+    Replays a recorded nightdata_<date>.csv with the same poll() interface as ThingSpeakPoller
+    - every poll returns the readings that fall in the next poll_seconds of the recording
+    """
+
+    def __init__(self, csv_path, poll_seconds=poll_interval):
+        import csv
+
+        with open(csv_path, newline="") as file:
+            self.readings = feed_readings(csv.DictReader(file))
+        self.poll_seconds = poll_seconds
+        self.position = 0
+        self.clock = self.readings[0][1] if self.readings else 0
+
+    def poll(self):
+        self.clock += self.poll_seconds
+        start = self.position
+        while self.position < len(self.readings) and self.readings[self.position][1] <= self.clock:
+            self.position += 1
+
+        return self.readings[start:self.position]
+
+    def finished(self):
+        return self.position >= len(self.readings)
+
+
+class NightStream:
+    """
+    Ties a feed, the ring buffer and the rolling aggregates together
+    """
+
+    def __init__(self, source, window_seconds=rolling_window, capacity=buffer_capacity, alerts=None, room="bedroom"):
+        self.source = source
+        self.buffer = SensorRingBuffer(capacity)
+        self.aggregates = RollingAggregates(window_seconds)
+        self.listeners = []  # extra callables taking (timestamp, values)
+        self.alerts = alerts  # optional EnvironmentAlerts, evaluated on every reading
+        self.room = room
+        self.active_alerts = {}  # channel -> latest "start" event
+
+    def step(self):
+        """
+        Polls once and ingests the new readings
+
+        Returns:
+        int: number of new readings
+        """
+        readings = self.source.poll()
+        for _, timestamp, values in readings:
+            self.buffer.append(timestamp, values)
+            self.aggregates.update(timestamp, values)
+            if self.alerts is not None:
+                for event in self.alerts.push(self.room, timestamp, values):
+                    if event["type"] == "start":
+                        self.active_alerts[event["channel"]] = event
+                    else:
+                        self.active_alerts.pop(event["channel"], None)
+            for listener in self.listeners:
+                listener(timestamp, values)
+
+        return len(readings)
+
+    def snapshot(self):
+        times, values = self.buffer.latest(1)
+        aggregates = self.aggregates.snapshot()
+        snapshot = {
+            "updated": time.time(),
+            "last_reading": float(times[0]) if len(times) else None,
+            "alerts": list(self.active_alerts.values())
+        }
+
+        for ch, name in enumerate(stream_fields.values()):
+            snapshot[name] = {
+                "latest": float(values[0, ch]) if len(times) and not np.isnan(values[0, ch]) else None,
+                **{key: aggregates[key][ch] for key in aggregates}
+            }
+
+        return snapshot
+
+
+def write_snapshot(snapshot, path=snapshot_path):
+    """
+    Writes the live snapshot atomically so the dashboard never reads half a file
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(snapshot, file)
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path=snapshot_path, max_age=timedelta(minutes=10)):
+    """
+    Reads the live snapshot for the dashboard
+
+    Returns:
+    dict or None: the snapshot, None if there is no stream running (missing or stale file)
+    """
+    try:
+        with open(path, "r") as file:
+            snapshot = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if time.time() - snapshot.get("updated", 0) > max_age.total_seconds():
+        return None
+
+    return snapshot
+
+
+def run_stream(stream, interval=poll_interval):
+    """
+    Polls forever (or until a mock feed runs out), writing a snapshot after every poll with new data
+    """
+    while True:
+        if stream.step():
+            write_snapshot(stream.snapshot())
+
+        if isinstance(stream.source, MockThingSpeakFeed) and stream.source.finished():
+            return
+
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    if "--mock" in sys.argv:
+        source = MockThingSpeakFeed(sys.argv[sys.argv.index("--mock") + 1])
+        run_stream(NightStream(source, alerts=EnvironmentAlerts()), interval=0.1)
+    else:
+        run_stream(NightStream(ThingSpeakPoller(), alerts=EnvironmentAlerts()))
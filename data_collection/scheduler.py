@@ -0,0 +1,169 @@
+"""
+Standalone scheduler for the morning sync
+- runs as its own process, so gunicorn workers never download or compute anything themselves
+- a file lock makes sure only one sync runs at a time, even if several schedulers are started
+- failed syncs are retried with jittered exponential backoff
+- the sync writes its files into a new snapshot generation (data_handling.snapshots), a successful sync compacts
+  the new sensor night into the rollup tiers, adds the day to the RHR / weight baselines and the sleep
+  correlation store and bumps the data version that the web workers watch, which publishes the generation
+
+Run with: python -m data_collection.scheduler  (add --once to sync immediately and exit)
+"""
+
+import asyncio
+import fcntl
+import os
+import random
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from data_collection.data_aggregator import update_data
+from data_handling.data_version import publish_data_version
+from data_handling.snapshots import staged_generation, in_generation, collect_garbage
+from data_handling.sensor_rollups import compact_sensor_history
+from data_analysis.baselines import update_baselines
+from data_analysis.sleep_correlations import update_correlation_store
+
+london_timezone = ZoneInfo("Europe/London")
+
+# daily sync time (London)
+sync_hour = 9
+sync_minute = 0
+
+lock_path = "data_handling/.sync.lock"
+
+# retry settings
+max_attempts = 5
+base_delay = 60        # seconds before the first retry
+max_delay = 30 * 60    # never wait longer than this between attempts
+
+
+@contextmanager
+def sync_lock():
+    """
+    Non-blocking exclusive lock on lock_path. Yields True if the lock was taken, False if another sync holds it
+    """
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    lock_file = open(lock_path, "w")
+    try:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    finally:
+        lock_file.close()
+
+
+def retry_delay(attempt):
+    """
+    Exponential backoff with full jitter, so retries from several hosts don't line up
+
+    Parameters:
+    int: attempt number starting at 0
+
+    Returns:
+    float: seconds to wait before the next attempt
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def seconds_until_next_sync(now=None):
+    """
+    Returns the number of seconds until the next sync_hour:sync_minute in London
+    """
+    now = now or datetime.now(london_timezone)
+    next_run = now.replace(hour=sync_hour, minute=sync_minute, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+
+    return (next_run - now).total_seconds()
+
+
+async def run_sync():
+    """
+    Runs update_data once under the sync lock, retrying on failure
+
+    Returns:
+    bool: True if the sync succeeded and a new data version was published
+    """
+    loop = asyncio.get_running_loop()
+
+    with sync_lock() as acquired:
+        if not acquired:
+            print("Another sync is already running, skipping")
+            return False
+
+        for attempt in range(max_attempts):
+            try:
+                # update_data blocks (subprocess + http), so keep it off the event loop
+                succeeded = await loop.run_in_executor(None, update_data)
+            except Exception as e:
+                print(f"Sync attempt {attempt + 1} failed with error: {e}")
+                succeeded = False
+
+            if succeeded:
+                # the steps after the download read the files it staged, before they are published
+                generation = staged_generation()
+                try:
+                    compacted = await loop.run_in_executor(None, in_generation, generation, compact_sensor_history)
+                    print(f"Compacted sensor rollups for {len(compacted)} night(s)")
+                except Exception as e:
+                    # the rollups catch up on the next sync, don't fail the sync for them
+                    print(f"Sensor rollup compaction failed with error: {e}")
+
+                try:
+                    await loop.run_in_executor(None, in_generation, generation, update_baselines)
+                except Exception as e:
+                    # same as the rollups, the next update re-reads from the last stored day
+                    print(f"Baseline update failed with error: {e}")
+
+                try:
+                    store = await loop.run_in_executor(None, in_generation, generation, update_correlation_store)
+                    print(f"Correlation store holds {len(store['dates'])} night(s)")
+                except Exception as e:
+                    # nights that failed are still due on the next update
+                    print(f"Correlation store update failed with error: {e}")
+
+                version = publish_data_version()
+                print(f"Sync complete, published data version {version}")
+
+                try:
+                    collect_garbage()
+                except Exception as e:
+                    # old generations only cost disk space, the next sync collects them
+                    print(f"Snapshot garbage collection failed with error: {e}")
+                return True
+
+            if attempt < max_attempts - 1:
+                delay = retry_delay(attempt)
+                print(f"Sync attempt {attempt + 1} failed, retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+
+    print(f"Sync failed after {max_attempts} attempts")
+    return False
+
+
+async def scheduler_loop():
+    """
+    Sleeps until the next sync time, syncs, repeats
+    """
+    while True:
+        wait = seconds_until_next_sync()
+        print(f"Next sync in {wait / 3600:.1f} hours")
+        await asyncio.sleep(wait)
+        await run_sync()
+
+
+if __name__ == "__main__":
+    if "--once" in sys.argv:
+        asyncio.run(run_sync())
+    else:
+        asyncio.run(scheduler_loop())
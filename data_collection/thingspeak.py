@@ -0,0 +1,7 @@
+"""
+ThingSpeak channel of the bedroom sensor, shared by the morning sync (data_aggregator) and the live stream
+(night_stream) without either importing the other
+"""
+
+channel_id = "2769273"
+api_key = "Y9BRF2CSL00WMO2X"
@@ -2,14 +2,24 @@
 Contains helper functions to return required data for different functions
 """
 
-import json
+import os
 import datetime
 from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 
-file_path = "HealthData/Sleep"
+import numpy as np
 
+from data_handling.sleep_index import file_path, sleep_bounds
+from data_handling.snapshots import resolve
 
+# timezone the sleep times are reported in, override with the SOMNA_TIMEZONE environment variable
+local_timezone = os.environ.get("SOMNA_TIMEZONE", "Europe/London")
+
+minutes_per_day = 24 * 60
+
+# bedroom sensor nights saved by fetch_night_data, and the ThingSpeak fields they hold
+night_sensor_path = "data_handling/night_sensor_data"
+sensor_fields = {"field1": "temperature", "field2": "humidity"}
 
 
 def date_list(start_date, period):
@@ -20,7 +30,7 @@ def date_list(start_date, period):
 
     start_date_obj = datetime.strptime(start_date, "%Y-%m-%d")
     dates = [(start_date_obj - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(period)]
-    
+
     return dates
 
 
@@ -30,52 +40,149 @@ def extract_HHMM(timestamp):
     return timestamp.strftime("%H:%M")
 
 
+def format_minute_of_day(minutes):
+    """
+    Formats a minute of the day (0-1439) as HH:MM
+    """
+    minutes = int(minutes) % minutes_per_day
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
 def convert_to_local(UTC_time):
     """
-    Converts a UTC timestamp to the specified local time zone.
+    Converts a UTC timestamp to the local time zone
     """
-    # print(UTC_time)
     utc_time = datetime.fromisoformat(UTC_time).replace(tzinfo=timezone.utc)
-    local_time = utc_time.astimezone(ZoneInfo("Europe/London"))
-    updated_time = local_time + timedelta(hours=1)
 
-    return updated_time
+    return utc_time.astimezone(ZoneInfo(local_timezone))
 
 
+def gmt_to_epoch_minutes(gmt_times):
+    """
+    Converts an array of Garmin GMT strings ("2024-12-02T23:15:00.0") to int64 minutes since 1970-01-01 UTC
+    in one numpy operation (seconds are truncated, as the HH:MM formatting did before)
+    """
+    return np.asarray(gmt_times, dtype="datetime64[m]").astype(np.int64)
 
 
-def sleep_times(date):
+def local_minute_of_day(epoch_minutes, tz=None):
     """
-    Return the onset and offset times for nights sleep
+    Converts int64 UTC epoch minutes to local minute of the day (0-1439), DST aware
+
+    Parameters:
+    - epoch_minutes (array): minutes since 1970-01-01 UTC
+    - tz (str): IANA timezone, local_timezone by default
+
+    Returns:
+    - np.ndarray: int64 minute of the day in local time
+    """
+    # pandas is only needed for the DST aware conversion, it is imported on first use to keep start-up light
+    import pandas as pd
+
+    utc = pd.DatetimeIndex(np.asarray(epoch_minutes, dtype=np.int64).astype("datetime64[m]")).tz_localize("UTC")
+    local = utc.tz_convert(tz or local_timezone).tz_localize(None)
+    local_minutes = np.asarray(local.values.astype("datetime64[m]").astype(np.int64))
+
+    return local_minutes % minutes_per_day
+
+
+def night_bounds(date, tz=None):
+    """
+    Sleep window of a night in epoch seconds (see data_handling.sleep_index.sleep_bounds). Nights without
+    a sleep JSON fall back to the actigraphy classifier on garmin_monitoring.db.
+
+    Returns:
+    tuple: (start, end) epoch seconds, None if neither source has the night
+    """
+    try:
+        return sleep_bounds(date)
+    except FileNotFoundError:
+        # imported here, data_analysis imports this module
+        from data_analysis.actigraphy import actigraphy_sleep_bounds
+        return actigraphy_sleep_bounds(date, tz or local_timezone)
+
+
+def sleep_windows(dates, tz=None):
     """
+    Loads the sleep window for several nights at once
 
-    # garmin stores time in UTC, but at time of project are UTC+1
+    Parameters:
+    - dates (list): dates, YYYY-MM-DD
+    - tz (str): IANA timezone, local_timezone by default
 
-    file = "sleep_" + str(date) + ".json"
+    Returns:
+    - dict: {"dates": [], "valid": bool array, "onset_epoch": int64 array, "offset_epoch": int64 array,
+             "onset_minute": int64 array, "offset_minute": int64 array}
+             epochs are UTC minutes, minutes are local minute of the day.
+             Nights without sleep data (or monitoring data to fall back on) are marked invalid.
+    """
+    # the bounds come from the sidecar index, so the full JSON is only parsed once per night
+    bounds = [night_bounds(date, tz) for date in dates]
+    valid = np.array([b is not None for b in bounds], dtype=bool)
+    seconds = np.array([b if b is not None else (0, 0) for b in bounds], dtype=np.int64).reshape(-1, 2)
 
-    with open(file_path + "/" + file, 'r') as file:
-            data = json.load(file)
+    onset_epoch = np.where(valid, seconds[:, 0] // 60, 0)
+    offset_epoch = np.where(valid, seconds[:, 1] // 60, 0)
 
-    # extract the sleepMovement array
-    sleep_movement = data.get('sleepMovement', [])
-    
-    if not sleep_movement:
-        return None, None  # return None if the array is empty
+    return {
+        "dates": list(dates),
+        "valid": valid,
+        "onset_epoch": onset_epoch,
+        "offset_epoch": offset_epoch,
+        "onset_minute": local_minute_of_day(onset_epoch, tz),
+        "offset_minute": local_minute_of_day(offset_epoch, tz)
+    }
 
-    # get the first and last timestamps directly in ISO fromat 
-    first_timestamp = sleep_movement[0].get('startGMT')
-    last_timestamp = sleep_movement[-1].get('endGMT')
 
-    # convert time
-    # print(f"last tstamp: {last_timestamp}")
-    new_first = convert_to_local(first_timestamp[:-2])
-    new_last = convert_to_local(last_timestamp[:-2])
+def sleep_times(date):
+    """
+    Return the onset and offset times for nights sleep
+    """
+
+    windows = sleep_windows([date])
+
+    if not windows["valid"][0]:
+        return None, None  # return None if the night has no sleep window
 
     # extract the HH:MM
-    onset = extract_HHMM(new_first)
-    offset = extract_HHMM(new_last)
-    # print(f"onset_time: {onset}, offset_time: {offset}")
+    onset = format_minute_of_day(windows["onset_minute"][0])
+    offset = format_minute_of_day(windows["offset_minute"][0])
 
     return {"onset_time": onset, "offset_time": offset}
 
 
+def night_sensor_file(date):
+    """
+    Logical path of a night's sensor CSV, read it through data_handling.snapshots.resolve
+    """
+    return night_sensor_path + "/nightdata_" + str(date) + ".csv"
+
+
+def load_night_sensor(date, fields=sensor_fields):
+    """
+    Reads a night of bedroom sensor data into numpy arrays
+
+    Parameters:
+    - date (str): YYYY-MM-DD
+    - fields (dict): ThingSpeak fields to read, in channel order
+
+    Returns:
+    - tuple: (times, values) float64 epoch seconds (sorted) and an (n x channels) array, NaN where a field is blank.
+             Raises FileNotFoundError if the night was never fetched.
+    """
+    import csv
+    import pandas as pd
+
+    with open(resolve(night_sensor_file(date)), newline="") as file:
+        rows = [row for row in csv.DictReader(file) if row.get("created_at")]
+
+    times = np.array([row["created_at"].replace(" UTC", "").replace("Z", "") for row in rows], dtype="datetime64[s]")
+    times = times.astype(np.int64).astype(float)
+
+    values = np.full((len(rows), len(fields)), np.nan)
+    for ch, field in enumerate(fields):
+        column = np.array([row.get(field) or "nan" for row in rows])
+        values[:, ch] = pd.to_numeric(column, errors="coerce")
+
+    order = np.argsort(times, kind="stable")
+    return times[order], values[order]
@@ -0,0 +1,69 @@
+"""
+Keeps track of a "new data" version number on disk
+- the scheduler bumps it after every successful morning sync
+- web workers watch it so their caches refresh without a restart
+- it is also the snapshot generation readers pin (data_handling.snapshots), publishing a version publishes the
+  files the sync staged for it
+"""
+
+import os
+import time
+
+version_path = "data_handling/data_version"
+
+# how often (seconds) a worker re-reads the version file
+check_interval = 5
+
+_last_check = {"time": 0.0, "version": None}
+
+
+def read_data_version(path=version_path):
+    """
+    Reads the current data version from disk
+
+    Parameters:
+    - path (str): version file, relative to the working directory by default
+
+    Returns:
+    int: data version, 0 if nothing has been published yet
+    """
+    try:
+        with open(path, "r") as file:
+            return int(file.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def publish_data_version():
+    """
+    Bumps the data version. The new value is written to a temp file and renamed over the old one
+    so readers never see a half written file.
+
+    Returns:
+    int: the newly published version
+    """
+    new_version = read_data_version() + 1
+    tmp_path = version_path + ".tmp"
+
+    with open(tmp_path, "w") as file:
+        file.write(str(new_version))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, version_path)
+
+    return new_version
+
+
+def current_data_version():
+    """
+    Cheap version lookup for request handlers - only touches the disk every check_interval seconds
+
+    Returns:
+    int: data version
+    """
+    now = time.monotonic()
+    if _last_check["version"] is None or now - _last_check["time"] >= check_interval:
+        _last_check["version"] = read_data_version()
+        _last_check["time"] = now
+
+    return _last_check["version"]
@@ -0,0 +1,139 @@
+"""
+Import-time budget for the entry points that start cold: gunicorn workers (web_app.app) and the sync job
+(data_collection.scheduler)
+- each entry point is imported in a fresh interpreter with python -X importtime, the per-module
+  cumulative times on stderr are parsed and the best of a few runs is compared against its budget
+- modules that should only be imported on first use (pandas / requests for the sync job, sleep_scores when only
+  the package is imported) are checked by name, which catches a stray top-level import even on a fast machine
+- the heaviest imports are listed so a regression points at its cause
+
+Run from the repository root: python -m data_handling.import_budget
+"""
+
+import re
+import subprocess
+import sys
+
+# entry point -> seconds, cumulative import time of the module itself
+import_budgets = {
+    "web_app.app": 2.5,
+    "data_collection.scheduler": 0.5,
+    "data_collection": 0.05,
+    "data_analysis": 0.05,
+}
+
+# entry point -> modules it must not import at start-up
+deferred_imports = {
+    # requests isn't listed for the workers, dash imports it itself
+    "web_app.app": ["data_collection.data_aggregator", "data_collection.garmin_manifest"],
+    "data_collection.scheduler": ["pandas", "requests"],
+    "data_collection": ["data_collection.data_aggregator"],
+    "data_analysis": ["data_analysis.sleep_scores"],
+}
+
+runs = 3
+report_heaviest = 8
+
+# "import time:       self [us] |  cumulative | imported package", nesting is shown by indentation
+importtime_line = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def parse_importtime(stderr):
+    """
+    Parses -X importtime output
+
+    Returns:
+    list: [(module, self seconds, cumulative seconds, depth)] in the order modules finished importing
+    """
+    modules = []
+    for line in stderr.splitlines():
+        match = importtime_line.match(line)
+        if match:
+            own, cumulative, indent, name = match.groups()
+            modules.append((name, int(own) / 1e6, int(cumulative) / 1e6, (len(indent) - 1) // 2))
+
+    return modules
+
+
+def measure_import(module):
+    """
+    Imports module in a fresh interpreter with -X importtime
+
+    Returns:
+    list: parse_importtime result, None if the import failed
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"Importing {module} failed:\n{result.stderr.splitlines()[-1] if result.stderr else ''}")
+        return None
+
+    return parse_importtime(result.stderr)
+
+
+def check_entry_point(module, budget, deferred=(), repeat=runs):
+    """
+    Best of repeat imports of module against its budget
+
+    Returns:
+    dict: {"module", "seconds", "budget", "ok", "deferred_loaded": [], "heaviest": [(module, seconds)]}
+          None if the import failed
+    """
+    best = None
+    for _ in range(repeat):
+        modules = measure_import(module)
+        if modules is None:
+            return None
+        total = next((cumulative for name, _, cumulative, depth in modules if name == module and depth == 0), 0.0)
+        if best is None or total < best[0]:
+            best = (total, modules)
+
+    seconds, modules = best
+    loaded = {name for name, _, _, _ in modules}
+    deferred_loaded = [name for name in deferred if name in loaded]
+
+    # direct imports of the entry point: the depth 1 lines since the previous top level import (interpreter
+    # start-up modules such as site and encodings come before that)
+    end = max(i for i, (name, _, _, depth) in enumerate(modules) if name == module and depth == 0)
+    start = max([i for i, (_, _, _, depth) in enumerate(modules[:end]) if depth == 0], default=-1) + 1
+    top = sorted(((name, cumulative) for name, _, cumulative, depth in modules[start:end] if depth == 1),
+                 key=lambda item: -item[1])
+
+    return {
+        "module": module,
+        "seconds": seconds,
+        "budget": budget,
+        "ok": seconds <= budget and not deferred_loaded,
+        "deferred_loaded": deferred_loaded,
+        "heaviest": top[:report_heaviest]
+    }
+
+
+def check_import_budgets(budgets=import_budgets, deferred=deferred_imports):
+    """
+    Checks every entry point and prints a report
+
+    Returns:
+    bool: True if every entry point is within budget and imports nothing it should defer
+    """
+    all_ok = True
+    for module, budget in budgets.items():
+        result = check_entry_point(module, budget, deferred.get(module, ()))
+        if result is None:
+            all_ok = False
+            continue
+
+        status = "ok" if result["ok"] else "OVER BUDGET"
+        print(f"{module}: {result['seconds']:.3f}s (budget {budget:.3f}s) {status}")
+        for name in result["deferred_loaded"]:
+            print(f"    imports {name} at start-up, it should be imported on first use")
+        for name, seconds in result["heaviest"]:
+            print(f"    {seconds:8.3f}s  {name}")
+
+        all_ok = all_ok and result["ok"]
+
+    return all_ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if check_import_budgets() else 1)
@@ -0,0 +1,34 @@
+"""
+Package attributes resolved on first access (PEP 562), so importing one submodule of a package doesn't import
+the modules behind every name its __init__ offers
+"""
+
+import sys
+from importlib import import_module
+
+
+def lazy_exports(package, exports):
+    """
+    Module __getattr__ and __dir__ for a package __init__, e.g.
+    __getattr__, __dir__ = lazy_exports(__name__, {"update_data": "data_aggregator"})
+
+    Parameters:
+    - package (str): __name__ of the package
+    - exports (dict): {attribute name: submodule it is imported from, relative to the package}
+
+    Returns:
+    - tuple: (__getattr__, __dir__)
+    """
+    def __getattr__(name):
+        if name not in exports:
+            raise AttributeError(f"module {package!r} has no attribute {name!r}")
+
+        value = getattr(import_module(f".{exports[name]}", package), name)
+        # later lookups find the attribute without going through __getattr__
+        setattr(sys.modules[package], name, value)
+        return value
+
+    def __dir__():
+        return sorted(set(vars(sys.modules[package])) | set(exports))
+
+    return __getattr__, __dir__
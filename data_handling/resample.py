@@ -0,0 +1,205 @@
+"""
+Resamples the irregular (~15 second, with dropouts) bedroom sensor readings onto a fixed epoch grid
+- epoch values are time-weighted means: the signal is taken as linear between readings and integrated with a
+  cumulative trapezoid sum, so the integral over any epoch is a difference of two searchsorted lookups
+- stretches between readings longer than max_sample_gap count as missing instead of being bridged
+- epochs with too little coverage are flagged in a gap mask, short runs of them are linearly interpolated
+  (at most max_interp_epochs in a row), longer ones stay NaN
+- grids are aligned with the sleep window, so nights stack into one (nights x epochs x channels) array
+"""
+
+import numpy as np
+
+from data_handling.data_recall import sleep_windows, load_night_sensor, sensor_fields
+
+epoch_seconds = 5 * 60
+night_epochs = 12 * 12        # 12 hours of 5 minute epochs per stacked night
+max_sample_gap = 60           # seconds, longer gaps between readings are not bridged
+min_coverage = 0.5            # fraction of an epoch that must be covered by readings
+max_interp_epochs = 3         # longest run of gap epochs filled by interpolation
+
+
+def cumulative_integral(times, values, max_gap=max_sample_gap):
+    """
+    Trapezoid integral of values (and of covered time) at every reading, skipping gaps longer than max_gap
+
+    Returns:
+    tuple: (integral, covered) float arrays, same length as times
+    """
+    dt = np.diff(times)
+    bridged = dt <= max_gap
+    area = np.where(bridged, dt * (values[1:] + values[:-1]) / 2, 0.0)
+
+    return np.r_[0.0, np.cumsum(area)], np.r_[0.0, np.cumsum(np.where(bridged, dt, 0.0))]
+
+
+def integral_at(edges, times, values, integral, covered, max_gap=max_sample_gap):
+    """
+    Evaluates the cumulative integrals at arbitrary times (the epoch edges) by extending from the previous reading
+    """
+    idx = np.clip(np.searchsorted(times, edges, side="right") - 1, 0, len(times) - 1)
+    nxt = np.minimum(idx + 1, len(times) - 1)
+
+    step = edges - times[idx]
+    span = times[nxt] - times[idx]
+    inside = (step > 0) & (nxt > idx) & (span <= max_gap)
+    step = np.where(inside, step, 0.0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        edge_value = values[idx] + (values[nxt] - values[idx]) * np.where(span > 0, step / span, 0.0)
+
+    return integral[idx] + step * (values[idx] + edge_value) / 2, covered[idx] + step
+
+
+def fill_short_gaps(values, gap, max_run=max_interp_epochs):
+    """
+    Linearly interpolates runs of gap epochs no longer than max_run that have data on both sides
+
+    Returns:
+    tuple: (values, interpolated mask)
+    """
+    good = ~gap
+    if good.sum() < 2:
+        return values, np.zeros(len(values), dtype=bool)
+
+    # length of the gap run each epoch belongs to
+    edges = np.diff(np.r_[0, gap.astype(np.int8), 0])
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    lengths = ends - starts
+    bounded = (starts > 0) & (ends < len(values))
+    run_length = np.zeros(len(values), dtype=int)
+    run_length[gap] = np.repeat(np.where(bounded, lengths, 0), lengths)
+
+    fill = gap & (run_length > 0) & (run_length <= max_run)
+    positions = np.arange(len(values))
+    filled = values.copy()
+    filled[fill] = np.interp(positions[fill], positions[good], values[good])
+
+    return filled, fill
+
+
+def resample_channel(times, values, grid_start, n_epochs, width=epoch_seconds):
+    """
+    Resamples one channel onto the grid grid_start + k * width
+
+    Returns:
+    dict: {"values": epoch means (NaN where missing), "coverage": fraction of each epoch with readings,
+           "gap": True where the epoch had too little data, "interpolated": True where a gap was filled}
+    """
+    keep = ~np.isnan(values)
+    times, values = times[keep], values[keep]
+    edges = grid_start + width * np.arange(n_epochs + 1, dtype=float)
+
+    if len(times) < 2:
+        gap = np.ones(n_epochs, dtype=bool)
+        return {"values": np.full(n_epochs, np.nan), "coverage": np.zeros(n_epochs), "gap": gap,
+                "interpolated": np.zeros(n_epochs, dtype=bool)}
+
+    integral, covered = cumulative_integral(times, values)
+    edge_integral, edge_covered = integral_at(edges, times, values, integral, covered)
+
+    seconds = np.diff(edge_covered)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.diff(edge_integral) / seconds
+
+    coverage = seconds / width
+    gap = coverage < min_coverage
+    means = np.where(gap, np.nan, means)
+    means, interpolated = fill_short_gaps(means, gap)
+
+    return {"values": means, "coverage": coverage, "gap": gap, "interpolated": interpolated}
+
+
+def resample_night(times, values, grid_start, n_epochs, width=epoch_seconds):
+    """
+    Resamples every channel of a night
+
+    Parameters:
+    - times (array): epoch seconds, sorted
+    - values (array): (readings x channels)
+    - grid_start (float): epoch seconds of the first epoch edge
+    - n_epochs (int): number of epochs
+
+    Returns:
+    - dict: same keys as resample_channel, each an (epochs x channels) array
+    """
+    channels = [resample_channel(times, values[:, ch], grid_start, n_epochs, width) for ch in range(values.shape[1])]
+
+    return {key: np.stack([channel[key] for channel in channels], axis=1) for key in channels[0]}
+
+
+def time_weighted_mean(times, values):
+    """
+    Time-weighted mean of each channel over all its readings (gaps excluded), instead of a per-row average
+
+    Returns:
+    np.ndarray: mean per channel, NaN for empty channels
+    """
+    means = np.full(values.shape[1], np.nan)
+    for ch in range(values.shape[1]):
+        keep = ~np.isnan(values[:, ch])
+        if keep.sum() < 2:
+            means[ch] = np.nanmean(values[:, ch]) if keep.any() else np.nan
+            continue
+
+        integral, covered = cumulative_integral(times[keep], values[keep, ch])
+        means[ch] = integral[-1] / covered[-1] if covered[-1] > 0 else np.mean(values[keep, ch])
+
+    return means
+
+
+def stacked_means(stacked):
+    """
+    Time-weighted mean of each night and channel from stack_nights, the measured epochs weighted by their coverage
+    (interpolated epochs left out), so the averages come from the same read as the epoch values
+
+    Returns:
+    np.ndarray: (nights x channels), NaN where a night has no measured epoch
+    """
+    weights = np.where(stacked["gap"], 0.0, stacked["coverage"])
+    total = weights.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.nansum(np.where(weights > 0, stacked["values"], 0.0) * weights, axis=1) / total
+
+    return np.where(total > 0, means, np.nan)
+
+
+def stack_nights(dates, n_epochs=night_epochs, width=epoch_seconds):
+    """
+    Resamples several nights onto grids starting at each night's sleep onset
+
+    Parameters:
+    - dates (list): YYYY-MM-DD
+    - n_epochs (int): epochs per night, epochs past the sleep offset are NaN and flagged as gaps
+
+    Returns:
+    - dict: {"dates": [], "grid_start": epoch seconds per night, "values": (nights x epochs x channels),
+             "coverage": ..., "gap": ..., "interpolated": ..., "channels": []}
+    """
+    windows = sleep_windows(dates)
+    n_channels = len(sensor_fields)
+
+    stacked = {
+        "values": np.full((len(dates), n_epochs, n_channels), np.nan),
+        "coverage": np.zeros((len(dates), n_epochs, n_channels)),
+        "gap": np.ones((len(dates), n_epochs, n_channels), dtype=bool),
+        "interpolated": np.zeros((len(dates), n_epochs, n_channels), dtype=bool)
+    }
+    grid_start = windows["onset_epoch"] * 60
+
+    for i, date in enumerate(dates):
+        if not windows["valid"][i]:
+            continue
+        try:
+            times, values = load_night_sensor(date)
+        except FileNotFoundError:
+            continue
+
+        # only the epochs inside the sleep window
+        in_window = int(np.ceil((windows["offset_epoch"][i] - windows["onset_epoch"][i]) * 60 / width))
+        n = max(0, min(n_epochs, in_window))
+        night = resample_night(times, values, grid_start[i], n, width)
+        for key in stacked:
+            stacked[key][i, :n] = night[key]
+
+    return {"dates": list(dates), "grid_start": grid_start, "channels": list(sensor_fields.values()), **stacked}
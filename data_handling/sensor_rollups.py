@@ -0,0 +1,330 @@
+"""
+Rollup tiers of the bedroom sensor history, like the days/weeks/months tables of garmin_summary.db
+- raw night files are compacted into 1 minute, 15 minute and per-night tiers
+- every bucket keeps count / sum / sum of squares / min / max per channel, so buckets (and tiers) can be
+  merged exactly, and mean and std are derived when queried
+- raw files older than raw_retention_days are deleted once compacted (kept forever when None)
+- query_sensor_history answers from the coarsest tier that covers the requested resolution
+
+Run with: python -m data_handling.sensor_rollups  (compacts every new or changed night file)
+"""
+
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from data_handling.data_recall import night_sensor_path, sensor_fields, night_sensor_file, load_night_sensor
+from data_handling.snapshots import pin, SnapshotWriter
+
+rollup_dir = "data_handling/sensor_rollups"
+manifest_path = rollup_dir + "/manifest.json"
+
+# bucket width in seconds of each tier, finest first. The night tier is keyed by the night's date instead.
+tier_widths = {"minute": 60, "quarter": 15 * 60}
+night_tier = "night"
+
+# days of raw night files kept after compaction, None keeps them all
+raw_retention_days = None
+
+stat_names = ("count", "sum", "sumsq", "min", "max")
+
+
+def tier_path(tier):
+    return rollup_dir + "/" + tier + ".npz"
+
+
+def empty_tier(n_channels=len(sensor_fields)):
+    return {
+        "start": np.array([], dtype=np.int64),
+        "count": np.zeros((0, n_channels), dtype=np.int64),
+        "sum": np.zeros((0, n_channels)),
+        "sumsq": np.zeros((0, n_channels)),
+        "min": np.zeros((0, n_channels)),
+        "max": np.zeros((0, n_channels))
+    }
+
+
+def load_tier(tier):
+    """
+    Returns:
+    dict: {"start": int64 bucket keys, "count"/"sum"/"sumsq"/"min"/"max": (buckets x channels) arrays}
+    """
+    try:
+        with np.load(tier_path(tier)) as data:
+            return {key: data[key] for key in ("start",) + stat_names}
+    except FileNotFoundError:
+        return empty_tier()
+
+
+def save_tier(tier, rollup):
+    # temp file + rename so a query never opens half a tier
+    os.makedirs(rollup_dir, exist_ok=True)
+    tmp_path = tier_path(tier) + ".tmp"
+    with open(tmp_path, "wb") as file:
+        np.savez(file, **rollup)
+    os.replace(tmp_path, tier_path(tier))
+
+
+def bucket_stats(keys, values):
+    """
+    Aggregates samples (or existing buckets) sharing a key in one pass with bincount / ufunc.at
+
+    Parameters:
+    - keys (array): int64 bucket key per row
+    - values (dict or array): an (n x channels) sample array, or a rollup dict of buckets to re-merge
+
+    Returns:
+    - dict: rollup with one bucket per distinct key, sorted by key
+    """
+    starts, inverse = np.unique(keys, return_inverse=True)
+    n_buckets = len(starts)
+
+    if isinstance(values, dict):
+        count, total, total_sq = values["count"], values["sum"], values["sumsq"]
+        low, high = values["min"], values["max"]
+    else:
+        valid = ~np.isnan(values)
+        count = valid.astype(np.int64)
+        total = np.where(valid, values, 0.0)
+        total_sq = total ** 2
+        low = np.where(valid, values, np.inf)
+        high = np.where(valid, values, -np.inf)
+
+    n_channels = count.shape[1]
+    rollup = {"start": starts.astype(np.int64)}
+    rollup["count"] = np.stack([np.bincount(inverse, count[:, ch], n_buckets) for ch in range(n_channels)], axis=1).astype(np.int64)
+    rollup["sum"] = np.stack([np.bincount(inverse, total[:, ch], n_buckets) for ch in range(n_channels)], axis=1)
+    rollup["sumsq"] = np.stack([np.bincount(inverse, total_sq[:, ch], n_buckets) for ch in range(n_channels)], axis=1)
+
+    rollup["min"] = np.full((n_buckets, n_channels), np.inf)
+    rollup["max"] = np.full((n_buckets, n_channels), -np.inf)
+    np.minimum.at(rollup["min"], inverse, low)
+    np.maximum.at(rollup["max"], inverse, high)
+
+    return rollup
+
+
+def replace_buckets(rollup, new):
+    """
+    Puts the buckets of new into rollup, replacing any with the same key (re-compacting a night is idempotent)
+    """
+    keep = ~np.isin(rollup["start"], new["start"])
+    merged = {key: np.concatenate([rollup[key][keep], new[key]]) for key in rollup}
+    order = np.argsort(merged["start"], kind="stable")
+
+    return {key: merged[key][order] for key in merged}
+
+
+def night_key(date):
+    """
+    Night tier key: days since 1970-01-01 of the night's date
+    """
+    return int(np.datetime64(date, "D").astype(np.int64))
+
+
+def compact_night(date):
+    """
+    Compacts one raw night file into every tier. Finer tiers are built from the samples, coarser tiers
+    from the tier below, so all tiers agree exactly.
+
+    Returns:
+    bool: True if the night had samples
+    """
+    times, values = load_night_sensor(date)
+    if not len(times):
+        return False
+
+    seconds = times.astype(np.int64)
+    buckets = None
+    for tier, width in tier_widths.items():
+        keys = seconds - seconds % width
+        buckets = bucket_stats(keys, values if buckets is None else buckets)
+        seconds = buckets["start"]
+        save_tier(tier, replace_buckets(load_tier(tier), buckets))
+
+    nightly = bucket_stats(np.full(len(buckets["start"]), night_key(date)), buckets)
+    save_tier(night_tier, replace_buckets(load_tier(night_tier), nightly))
+
+    return True
+
+
+def read_manifest():
+    try:
+        with open(manifest_path, "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_manifest(manifest):
+    os.makedirs(rollup_dir, exist_ok=True)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def night_file_dates():
+    try:
+        names = pin().listdir(night_sensor_path)
+    except FileNotFoundError:
+        return []
+
+    return sorted(name[len("nightdata_"):-len(".csv")] for name in names
+                  if name.startswith("nightdata_") and name.endswith(".csv"))
+
+
+def compact_sensor_history(retention_days=raw_retention_days, today=None):
+    """
+    Compaction job: rolls up every night file that is new or changed since its last compaction,
+    then applies the raw retention
+
+    Parameters:
+    - retention_days (int): raw files for nights older than this are deleted once compacted, None keeps them
+    - today (str): YYYY-MM-DD the retention is counted from, today by default
+
+    Returns:
+    - list: dates that were compacted
+    """
+    manifest = read_manifest()
+    compacted = []
+
+    snapshot = pin()
+    for date in night_file_dates():
+        # the object path changes with every new version of the night, so the signature does too
+        stat = os.stat(snapshot.path(night_sensor_file(date)))
+        signature = [stat.st_size, stat.st_mtime_ns]
+        if manifest.get(date) == signature:
+            continue
+
+        if compact_night(date):
+            compacted.append(date)
+        manifest[date] = signature
+        write_manifest(manifest)
+
+    if retention_days is not None:
+        today = today or datetime.now().strftime("%Y-%m-%d")
+        cutoff = (datetime.strptime(today, "%Y-%m-%d") - timedelta(days=retention_days)).strftime("%Y-%m-%d")
+        writer = None
+        for date in night_file_dates():
+            # only delete raw data that is safely in the tiers, readers of earlier generations may still read
+            # the file so it is removed from the next generation and deleted from disk by the garbage collection
+            if date < cutoff and date in manifest:
+                writer = writer or SnapshotWriter()
+                writer.remove(night_sensor_file(date))
+
+    return compacted
+
+
+def choose_tier(resolution):
+    """
+    Coarsest tier whose buckets tile resolution (seconds) exactly, "raw" if no tier does. A tier bucket is
+    only ever merged whole, so a tier whose width doesn't divide the resolution would give wrong stats
+    (e.g. 15 minute buckets for a 20 minute resolution).
+    """
+    if resolution >= 24 * 60 * 60:
+        return night_tier
+
+    chosen = "raw"
+    for tier, width in tier_widths.items():
+        if resolution % width == 0:
+            chosen = tier
+
+    return chosen
+
+
+def raw_rollup(start, end, width):
+    """
+    Buckets the raw samples between start and end straight from the night files
+    """
+    first = datetime.fromtimestamp(start, timezone.utc).date() - timedelta(days=1)
+    last = datetime.fromtimestamp(end, timezone.utc).date() + timedelta(days=1)
+    dates = [(first + timedelta(days=i)).strftime("%Y-%m-%d") for i in range((last - first).days + 1)]
+
+    times, values = [], []
+    for date in dates:
+        try:
+            night_times, night_values = load_night_sensor(date)
+        except FileNotFoundError:
+            continue
+        times.append(night_times)
+        values.append(night_values)
+
+    if not times:
+        return None
+
+    times, values = np.concatenate(times), np.concatenate(values)
+    seconds = times.astype(np.int64)
+    inside = (seconds >= start) & (seconds < end)
+
+    return bucket_stats(seconds[inside] - seconds[inside] % width, values[inside])
+
+
+def query_sensor_history(start, end, resolution):
+    """
+    Sensor history between two times at (at least) the requested resolution
+
+    Parameters:
+    - start (int): epoch seconds UTC
+    - end (int): epoch seconds UTC, exclusive
+    - resolution (int): bucket width wanted in seconds. >= one day gives one bucket per night. Once the raw
+                        files are past retention a resolution that isn't a whole number of minutes is
+                        rounded up to one.
+
+    Buckets start at multiples of the resolution (days for the night tier), so with a start or end that isn't
+    a multiple the first and last bucket cover only part of their width. They only ever hold data from inside
+    [start, end): raw samples outside are left out, and so are tier buckets that reach outside the range (with
+    a quarter tier query up to 15 minutes at each end, align start and end to the resolution to keep them).
+
+    Returns:
+    - dict: {"tier": str, "resolution": bucket width used in seconds,
+             "start": int64 bucket keys (epoch seconds, or days since 1970 for the night tier),
+             "count", "mean", "std", "min", "max": (buckets x channels) arrays, NaN where a channel is empty}
+    """
+    resolution = max(int(resolution), 1)
+    tier = choose_tier(resolution)
+
+    rollup = raw_rollup(start, end, resolution) if tier == "raw" else None
+    if rollup is None:
+        if tier == "raw":
+            # raw files past retention, the minute tier is the finest left and only tiles whole minutes
+            tier = "minute"
+            width = tier_widths[tier]
+            resolution = -(-resolution // width) * width
+
+        rollup = load_tier(tier)
+        if tier == night_tier:
+            keys = rollup["start"]
+            inside = (keys >= start // 86400) & (keys < -(-end // 86400))
+        else:
+            keys = rollup["start"]
+            inside = (keys >= start) & (keys + tier_widths[tier] <= end)  # buckets wholly inside the range
+            # merge tier buckets up to the requested resolution
+            rollup = bucket_stats(keys[inside] - keys[inside] % resolution, {k: v[inside] for k, v in rollup.items()})
+            inside = slice(None)
+
+        rollup = {key: value[inside] for key, value in rollup.items()}
+
+    count = rollup["count"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = rollup["sum"] / count
+        std = np.sqrt(np.maximum(rollup["sumsq"] / count - mean ** 2, 0))
+
+    empty = count == 0
+    return {
+        "tier": tier,
+        "resolution": 24 * 60 * 60 if tier == night_tier else resolution,
+        "start": rollup["start"],
+        "count": count,
+        "mean": np.where(empty, np.nan, mean),
+        "std": np.where(empty, np.nan, std),
+        "min": np.where(empty, np.nan, rollup["min"]),
+        "max": np.where(empty, np.nan, rollup["max"])
+    }
+
+
+if __name__ == "__main__":
+    nights = compact_sensor_history()
+    print(f"Compacted {len(nights)} night(s): {', '.join(nights)}" if nights else "Sensor rollups are up to date")
@@ -0,0 +1,180 @@
+"""
+Sidecar index for the Garmin sleep JSON files
+- each sleep_<date>.json is parsed once and its sleepMovement bounds and minute-level arrays are saved
+  next to it as a small .npz file
+- later reads only open the members they ask for, so getting the onset/offset of a night no longer parses
+  the whole document (sleepMovement, sleepLevels, HRV, SpO2, ...)
+- the index is rebuilt automatically when the JSON file changes (size or mtime) or was written by an older
+  version of this module (index_format)
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+file_path = "HealthData/Sleep"
+index_dir = file_path + "/.index"
+
+# bumped whenever the members of the index change, older indexes are rebuilt
+index_format = 2
+
+# sleepMovement starts an hour before Garmin's sleep start and ends an hour after its sleep end, used to
+# derive the sleep window from it when dailySleepDTO has no timestamps
+movement_padding = 60 * 60
+
+# minute level arrays kept in the index: name -> (JSON key, time field, value field)
+indexed_series = {
+    "movement": ("sleepMovement", "startGMT", "activityLevel"),
+    "levels": ("sleepLevels", "startGMT", "activityLevel"),
+    "heart_rate": ("sleepHeartRate", "startGMT", "value"),
+    "hrv": ("hrvData", "startGMT", "value"),
+    "spo2": ("wellnessEpochSPO2DataDTOList", "epochTimestamp", "spo2Reading"),
+    "respiration": ("wellnessEpochRespirationDataDTOList", "startTimeGMT", "respirationValue"),
+    "stress": ("sleepStress", "startGMT", "value"),
+}
+
+
+def json_path(date):
+    return file_path + "/sleep_" + str(date) + ".json"
+
+
+def index_path(date):
+    return index_dir + "/sleep_" + str(date) + ".npz"
+
+
+def epoch_seconds(times):
+    """
+    Converts Garmin timestamps to int64 epoch seconds. Garmin mixes GMT strings ("2024-12-03T00:15:00.0")
+    and epoch milliseconds depending on the array.
+    """
+    if len(times) and isinstance(times[0], str):
+        return np.asarray(times, dtype="datetime64[s]").astype(np.int64)
+
+    return np.asarray(times, dtype=np.int64) // 1000
+
+
+def source_stat(date):
+    stat = os.stat(json_path(date))
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def build_sleep_index(date):
+    """
+    Parses sleep_<date>.json once and writes its sidecar index
+
+    Returns:
+    str: path of the index file
+    """
+    stat = source_stat(date)
+    with open(json_path(date), 'r') as file:
+        data = json.load(file)
+
+    arrays = {"source_stat": stat, "index_format": np.array(index_format)}
+
+    for name, (key, time_field, value_field) in indexed_series.items():
+        entries = data.get(key) or []
+        arrays[name + "_time"] = epoch_seconds([entry.get(time_field) for entry in entries])
+        arrays[name + "_value"] = np.array([entry.get(value_field) for entry in entries], dtype=float)
+
+    # onset / offset of the sleepMovement array, -1 when it is empty
+    movement = data.get('sleepMovement') or []
+    if movement:
+        arrays["bounds"] = epoch_seconds([movement[0].get('startGMT'), movement[-1].get('endGMT')])
+    else:
+        arrays["bounds"] = np.array([-1, -1], dtype=np.int64)
+
+    # Garmin's own sleep window, -1 when the summary doesn't have it
+    summary = data.get('dailySleepDTO') or {}
+    start, end = summary.get('sleepStartTimestampGMT'), summary.get('sleepEndTimestampGMT')
+    if start and end:
+        arrays["sleep_bounds"] = epoch_seconds([start, end])
+    else:
+        arrays["sleep_bounds"] = np.array([-1, -1], dtype=np.int64)
+
+    # write to a temp file and rename so readers never see half an index. The temp file is per process and
+    # thread, two workers building the same index must not write into each other's file.
+    os.makedirs(index_dir, exist_ok=True)
+    tmp_path = f"{index_path(date)}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as file:
+        np.savez(file, **arrays)
+    os.replace(tmp_path, index_path(date))
+
+    return index_path(date)
+
+
+def sleep_index(date):
+    """
+    Opens the index for a night, building or rebuilding it if needed. Members are only read from disk
+    when accessed, e.g. sleep_index(date)["bounds"].
+
+    Returns:
+    np.lib.npyio.NpzFile: the lazily loaded index
+    """
+    stat = source_stat(date)  # raises FileNotFoundError if there is no sleep JSON, as json.load did
+
+    try:
+        index = np.load(index_path(date))
+        if np.array_equal(index["source_stat"], stat) and "index_format" in index.files \
+                and int(index["index_format"]) == index_format:
+            return index
+        index.close()
+    except (FileNotFoundError, ValueError, KeyError, OSError):
+        pass
+
+    build_sleep_index(date)
+    return np.load(index_path(date))
+
+
+def movement_bounds(date):
+    """
+    Returns the first startGMT and last endGMT of a night's sleepMovement array
+
+    Returns:
+    tuple: (start, end) in int64 epoch seconds, None if the array is empty
+    """
+    with sleep_index(date) as index:
+        start, end = index["bounds"]
+
+    if start < 0:
+        return None
+
+    return start, end
+
+
+def sleep_bounds(date):
+    """
+    Returns the sleep window of a night: dailySleepDTO's sleepStart/EndTimestampGMT, or the sleepMovement
+    bounds with their padding removed for files without them
+
+    Returns:
+    tuple: (start, end) in int64 epoch seconds, None if the night has neither
+    """
+    with sleep_index(date) as index:
+        start, end = index["sleep_bounds"]
+        if start < 0:
+            start, end = index["bounds"]
+            if start < 0:
+                return None
+            start, end = start + movement_padding, end - movement_padding
+
+    if end <= start:
+        return None
+
+    return start, end
+
+
+def night_series(date, name):
+    """
+    Returns one of the indexed_series for a night as numpy arrays
+
+    Parameters:
+    - date (str): YYYY-MM-DD
+    - name (str): key of indexed_series, e.g. "heart_rate"
+
+    Returns:
+    - tuple: (times, values), int64 epoch seconds and float64 values
+    """
+    with sleep_index(date) as index:
+        return index[name + "_time"], index[name + "_value"]
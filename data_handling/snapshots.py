@@ -0,0 +1,335 @@
+"""
+Generation based storage for the files the morning sync rewrites (the bedroom night CSVs and sleep_metrics.csv),
+so dashboard workers never read a half written file and never wait on a lock
+- a writer never touches a file readers may have open: every new version of a file is written to its own
+  object path (temp file, fsync, rename), the new generation's manifest maps the file's usual path (its logical
+  path) onto that object and removed files onto None
+- the sync stages generation N + 1 while readers keep using N, the scheduler then publishes it by bumping the
+  data version (data_handling.data_version), so the data version and the generation are the same number and
+  every cache keyed on the data version is invalidated exactly when the files it was built from change
+- readers pin a generation (the current data version by default) and resolve logical paths through its manifest,
+  files without a manifest entry are read from their logical path as before, which keeps older data working
+- old generations are garbage collected after the publish, the last keep_generations stay readable for requests
+  that pinned them a moment earlier. Reading a generation that has been collected raises SnapshotExpired, the
+  caller pins the current generation and starts over.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from data_handling.data_version import current_data_version, read_data_version
+
+snapshot_root = "data_handling/snapshots"
+generations_path = snapshot_root + "/generations"
+objects_path = snapshot_root + "/objects"
+collected_path = snapshot_root + "/collected"  # newest generation garbage collected so far
+
+# published generations whose files are kept for readers that pinned them
+keep_generations = 3
+
+# temp files older than this were left by a writer that crashed before its rename, younger ones may still be written
+stale_temp_seconds = 60 * 60
+
+# generation -> manifest {logical path: object path or None}, manifests never change once published
+_manifest_cache = {}
+_pinned = threading.local()
+
+
+class SnapshotExpired(Exception):
+    """
+    The pinned generation has been garbage collected, its files can't be read any more
+    """
+
+    def __init__(self, generation):
+        super().__init__(f"snapshot generation {generation} has been garbage collected, pin the current one")
+        self.generation = generation
+
+
+#################################### MANIFESTS ####################################
+def manifest_file(generation):
+    return f"{generations_path}/{generation}.json"
+
+
+def manifest_generations():
+    """
+    Returns:
+    list: sorted generations that have a manifest
+    """
+    try:
+        names = os.listdir(generations_path)
+    except FileNotFoundError:
+        return []
+
+    return sorted(int(name[:-len(".json")]) for name in names if name.endswith(".json") and name[:-len(".json")].isdigit())
+
+
+def collected_generation():
+    """
+    Returns:
+    int: newest generation collect_garbage has deleted, None if none
+    """
+    try:
+        with open(collected_path, "r") as file:
+            return int(json.load(file))
+    except (FileNotFoundError, ValueError, TypeError):
+        return None
+
+
+def generation_expired(generation):
+    collected = collected_generation()
+    return collected is not None and generation <= collected
+
+
+def read_manifest(generation):
+    """
+    Manifest a generation reads through: its own, or that of the last generation before it that wrote files
+    (a sync that only changed GarminDB data publishes a version without a manifest)
+
+    Returns:
+    dict: {logical path: object path, None if removed}, empty before the first snapshot. Raises SnapshotExpired
+          if the generation has been garbage collected (also when this process still has its manifest cached,
+          the objects it names are gone).
+    """
+    if generation_expired(generation):
+        raise SnapshotExpired(generation)
+
+    cached = _manifest_cache.get(generation)
+    if cached is not None:
+        return cached
+
+    earlier = [g for g in manifest_generations() if g <= generation]
+    files = {}
+    if earlier:
+        try:
+            with open(manifest_file(earlier[-1]), "r") as file:
+                files = json.load(file)
+        except FileNotFoundError:
+            # collected in the meantime
+            raise SnapshotExpired(generation)
+
+    # only published generations are cached, a staged one can still change
+    if generation <= read_data_version():
+        _manifest_cache[generation] = files
+    return files
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(data, file, indent=2, sort_keys=True)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+#################################### READING ####################################
+class Snapshot:
+    """
+    Read-only view of one generation
+    """
+
+    def __init__(self, generation, files):
+        self.generation = generation
+        self.files = files
+
+    def path(self, logical_path):
+        """
+        Where to read a file of this generation from
+
+        Returns:
+        str: the object path, the logical path itself if the file isn't managed. A removed file gives a
+             path that doesn't exist, so readers see the same FileNotFoundError as for a missing file.
+        """
+        if logical_path not in self.files:
+            return logical_path
+
+        return self.files[logical_path] or f"{objects_path}/removed/{logical_path}"
+
+    def listdir(self, logical_dir):
+        """
+        File names in a logical directory in this generation
+
+        Returns:
+        list: sorted names, raises FileNotFoundError if the directory has no files at all
+        """
+        prefix = logical_dir.rstrip("/") + "/"
+        try:
+            names = set(os.listdir(logical_dir))
+        except FileNotFoundError:
+            names = None
+
+        managed = {path[len(prefix):]: target for path, target in self.files.items()
+                   if path.startswith(prefix) and "/" not in path[len(prefix):]}
+        if names is None and not managed:
+            raise FileNotFoundError(logical_dir)
+
+        names = (names or set()) | {name for name, target in managed.items() if target}
+        return sorted(name for name in names if managed.get(name, True))
+
+
+def pin(generation=None):
+    """
+    Pins a generation for reading
+
+    Parameters:
+    - generation (int): defaults to the generation pinned by pinned() on this thread, else the current data version
+
+    Returns:
+    - Snapshot
+    """
+    if generation is None:
+        generation = getattr(_pinned, "generation", None)
+    if generation is None:
+        generation = current_data_version()
+
+    return Snapshot(generation, read_manifest(generation))
+
+
+@contextmanager
+def pinned(generation):
+    """
+    Makes pin() on this thread return generation, so everything loaded for one page or one sync step
+    reads the same generation, e.g. with pinned(version): today_data(date)
+    """
+    previous = getattr(_pinned, "generation", None)
+    _pinned.generation = generation
+    try:
+        yield
+    finally:
+        _pinned.generation = previous
+
+
+def in_generation(generation, function, *args):
+    """
+    Calls function with generation pinned, for run_in_executor and thread pools
+    """
+    with pinned(generation):
+        return function(*args)
+
+
+def staged_generation():
+    """
+    Generation the running sync writes, published by the next publish_data_version()
+    """
+    return read_data_version() + 1
+
+
+def resolve(logical_path):
+    return pin().path(logical_path)
+
+
+#################################### WRITING ####################################
+class SnapshotWriter:
+    """
+    Stages file versions into the next generation. Only the sync writes (one at a time, under its lock),
+    so a writer is simply: read the staged manifest, add objects, write the manifest back.
+    """
+
+    def __init__(self, generation=None):
+        self.generation = generation if generation is not None else staged_generation()
+        self.files = dict(read_manifest(self.generation))
+
+    def read_bytes(self, logical_path):
+        """
+        Current content of a file as this generation sees it, None if it doesn't exist
+        """
+        try:
+            with open(Snapshot(self.generation, self.files).path(logical_path), "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def write_bytes(self, logical_path, data):
+        """
+        Writes a new version of a file as an immutable object (temp file, fsync, rename) and stages it
+        """
+        object_path = f"{objects_path}/{self.generation}/{logical_path}"
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+
+        tmp_path = f"{object_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, object_path)
+
+        self.files[logical_path] = object_path
+        self.save()
+        return object_path
+
+    def remove(self, logical_path):
+        """
+        Stages the removal of a file, it is deleted from disk once no kept generation can read it
+        """
+        self.files[logical_path] = None
+        self.save()
+
+    def save(self):
+        write_json(manifest_file(self.generation), self.files)
+
+
+def collect_garbage(keep=keep_generations, now=None):
+    """
+    Deletes the manifests and objects no reader can reach any more: generations older than the last keep
+    published ones, plain files removed in all of the kept generations and temp files of crashed writers.
+    Run after publishing.
+
+    Returns:
+    int: files deleted
+    """
+    published = read_data_version()
+    generations = manifest_generations()
+    visible = [g for g in generations if g <= published]
+    kept = visible[-keep:] + [g for g in generations if g > published]
+
+    manifests = {}
+    for generation in kept:
+        try:
+            with open(manifest_file(generation), "r") as file:
+                manifests[generation] = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    referenced = {target for files in manifests.values() for target in files.values() if target}
+    deleted = 0
+
+    # recorded first, so readers of the collected generations get SnapshotExpired rather than missing files
+    if visible[:-keep]:
+        write_json(collected_path, max(visible[-keep - 1], collected_generation() or 0))
+
+    for generation in visible[:-keep]:
+        os.remove(manifest_file(generation))
+        deleted += 1
+
+    now = time.time() if now is None else now
+    for root, _, names in os.walk(snapshot_root):
+        for name in names:
+            path = os.path.join(root, name).replace(os.sep, "/")
+            if path.endswith(".tmp"):
+                stale = now - os.stat(path).st_mtime > stale_temp_seconds
+            else:
+                stale = path.startswith(objects_path + "/") and path not in referenced
+            if stale:
+                os.remove(path)
+                deleted += 1
+
+    # plain files removed in every kept generation (e.g. raw nights past their retention)
+    if manifests:
+        removed = set.intersection(*({path for path, target in files.items() if target is None}
+                                     for files in manifests.values()))
+        for path in removed:
+            if os.path.exists(path):
+                os.remove(path)
+                deleted += 1
+
+    # folders left empty (objects of unchanged files stay where the generation that wrote them put them)
+    for root, dirs, names in os.walk(objects_path, topdown=False):
+        if root != objects_path and not os.listdir(root):
+            os.rmdir(root)
+
+    _manifest_cache.clear()
+    return deleted
@@ -0,0 +1,16 @@
+import pytest
+
+from data_handling import data_version, snapshots
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """
+    Runs a test in an empty working directory (all data paths are relative to it) with the version and
+    manifest caches cleared
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(data_version._last_check, "version", None)
+    snapshots._manifest_cache.clear()
+    yield tmp_path
+    snapshots._manifest_cache.clear()
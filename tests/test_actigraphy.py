@@ -0,0 +1,96 @@
+"""
+Cole-Kripke scoring and the main sleep of a night from a small monitoring database
+"""
+
+import sqlite3
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from data_analysis.actigraphy import actigraphy_sleep_bounds, classify_sleep_wake, cole_kripke, cole_kripke_weights
+
+
+def write_night(db_path, date, onset="23:30", offset="07:00", wake=("03:00", 20)):
+    """
+    Monitoring rows every minute of the searched window: resting and a lower heart rate between onset and
+    offset (onset on the evening before date), apart from a short awakening
+    """
+    midnight = datetime.strptime(date, "%Y-%m-%d")
+    start = midnight - timedelta(hours=6)
+    sleep_start = datetime.strptime(f"{date} {onset}", "%Y-%m-%d %H:%M") - timedelta(days=1)
+    sleep_end = datetime.strptime(f"{date} {offset}", "%Y-%m-%d %H:%M")
+    wake_start = datetime.strptime(f"{date} {wake[0]}", "%Y-%m-%d %H:%M")
+
+    rows, hr_rows = [], []
+    for minute in range(20 * 60):
+        t = start + timedelta(minutes=minute)
+        asleep = sleep_start <= t < sleep_end and not wake_start <= t < wake_start + timedelta(minutes=wake[1])
+        stamp = t.strftime("%Y-%m-%d %H:%M:%S")
+        rows.append((stamp, 0 if asleep else 5))
+        hr_rows.append((stamp, 55 if asleep else 70))
+
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS monitoring (timestamp TEXT PRIMARY KEY, intensity INTEGER)")
+        conn.execute("CREATE TABLE IF NOT EXISTS monitoring_hr (timestamp TEXT PRIMARY KEY, heart_rate INTEGER)")
+        conn.executemany("INSERT OR REPLACE INTO monitoring VALUES (?, ?)", rows)
+        conn.executemany("INSERT OR REPLACE INTO monitoring_hr VALUES (?, ?)", hr_rows)
+
+
+def epoch(text):
+    return int(np.datetime64(text, "s").astype(np.int64))
+
+
+def test_cole_kripke_scales_up_the_known_neighbours():
+    activity = np.array([0, 1, 2, 3, 4, 5, 6, 7, 0, 0], dtype=float)
+    score = cole_kripke(activity)
+
+    # minute 5 sees minutes 1 .. 7
+    assert np.isclose(score[5], 0.0005 * np.dot(cole_kripke_weights, activity[1:8]))
+
+    activity[3] = np.nan
+    score = cole_kripke(activity)
+    known = np.r_[0:2, 3:7]
+    expected = 0.0005 * np.dot(cole_kripke_weights[known], activity[1:8][known]) * cole_kripke_weights.sum() \
+        / cole_kripke_weights[known].sum()
+    assert np.isnan(score[3]) and np.isclose(score[5], expected)
+
+
+def test_short_sleep_bouts_and_unknown_minutes():
+    activity = np.r_[np.full(60, 5.0), np.zeros(20), np.full(60, 5.0), np.zeros(60), np.full(10, np.nan)]
+    heart_rate = np.where(activity == 0, 55.0, 70.0)
+    minutes = classify_sleep_wake(activity, heart_rate)
+
+    # the 20 minute rest is too short to be sleep, the hour is sleep, missing minutes stay unknown
+    assert (minutes[60:80] == 1).all()
+    assert (minutes[145:195] == 0).all()
+    assert np.isnan(minutes[-10:]).all()
+
+
+def test_main_sleep_joins_brief_awakenings(tmp_path):
+    db_path = str(tmp_path / "garmin_monitoring.db")
+    write_night(db_path, "2024-12-10")
+
+    start, end = actigraphy_sleep_bounds("2024-12-10", "Europe/London", db_path)
+    assert abs(start - epoch("2024-12-09T23:30")) <= 3 * 60
+    assert abs(end - epoch("2024-12-10T07:00")) <= 3 * 60
+
+
+def test_bounds_are_converted_from_local_time(tmp_path):
+    db_path = str(tmp_path / "garmin_monitoring.db")
+    write_night(db_path, "2024-06-10")
+
+    # local 23:30 BST is 22:30 UTC
+    start, end = actigraphy_sleep_bounds("2024-06-10", "Europe/London", db_path)
+    assert abs(start - epoch("2024-06-09T22:30")) <= 3 * 60
+    assert abs(end - epoch("2024-06-10T06:00")) <= 3 * 60
+
+
+def test_nights_without_data_or_sleep_give_none(tmp_path):
+    db_path = str(tmp_path / "garmin_monitoring.db")
+    write_night(db_path, "2024-12-10")
+    assert actigraphy_sleep_bounds("2024-12-20", "Europe/London", db_path) is None
+
+    # an hour's sleep is a nap, not the night's main sleep
+    nap_db = str(tmp_path / "nap.db")
+    write_night(nap_db, "2024-12-12", onset="23:00", offset="00:00", wake=("00:00", 0))
+    assert actigraphy_sleep_bounds("2024-12-12", "Europe/London", nap_db) is None
@@ -0,0 +1,72 @@
+"""
+Read API paging and ETags
+"""
+
+import os
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+from flask import Flask
+
+from data_handling import data_version
+from data_handling.data_version import publish_data_version
+from data_analysis.sleep_correlations import metrics_csv_path
+from web_app.api import api
+
+
+@pytest.fixture
+def client(data_dir):
+    os.makedirs(os.path.dirname(metrics_csv_path), exist_ok=True)
+    with open(metrics_csv_path, "w") as file:
+        file.write("Date, StDev_onset, StDev_offset, StDev_duration, IS, SJL, CPD, SRI, optimal_bedtime, optimal_waketime\n")
+        for day in range(1, 6):
+            file.write(f"2024-12-0{day},{day}.5,2,3,0.5,nan,0,0,22:48,07:26\n")
+
+    app = Flask(__name__)
+    app.register_blueprint(api)
+    return app.test_client()
+
+
+def test_pages_link_to_the_next_start(client):
+    response = client.get("/api/v1/metrics?start=2024-12-01&end=2024-12-05&limit=2")
+    body = response.get_json()
+
+    assert response.status_code == 200
+    assert [row["Date"] for row in body["data"]] == ["2024-12-01", "2024-12-02"]
+    assert body["data"][0]["StDev_onset"] == 1.5 and body["data"][0]["SJL"] is None
+    assert body["next"] == "2024-12-03"
+    assert "start=2024-12-03" in response.headers["Link"]
+
+    last = client.get("/api/v1/metrics?start=2024-12-05&end=2024-12-05&limit=2")
+    assert last.get_json()["next"] is None and "Link" not in last.headers
+
+
+def test_next_link_escapes_the_query(client):
+    response = client.get("/api/v1/metrics", query_string={"start": "2024-12-01", "end": "2024-12-05", "limit": 2,
+                                                           "note": "a&b c"})
+    link = response.headers["Link"]
+    query = parse_qs(urlsplit(link[1:link.index(">")]).query)
+
+    assert query["note"] == ["a&b c"] and query["start"] == ["2024-12-03"]
+
+
+def test_etag_answers_304_until_new_data_is_published(client):
+    url = "/api/v1/metrics?start=2024-12-01&end=2024-12-05"
+    tag = client.get(url).headers["ETag"]
+
+    cached = client.get(url, headers={"If-None-Match": tag})
+    assert cached.status_code == 304 and cached.data == b""
+
+    # another query has another tag
+    assert client.get(url + "&limit=2").headers["ETag"] != tag
+
+    publish_data_version()
+    data_version._last_check["version"] = None
+    fresh = client.get(url, headers={"If-None-Match": tag})
+    assert fresh.status_code == 200 and fresh.headers["ETag"] != tag
+
+
+def test_bad_queries_are_rejected(client):
+    assert client.get("/api/v1/metrics?start=2024-12-05&end=2024-12-01").status_code == 400
+    assert client.get("/api/v1/metrics?start=yesterday&end=2024-12-01").status_code == 400
+    assert client.get("/api/v1/sleep-wake?start=2024-12-01&end=2024-12-02&resolution=7").status_code == 400
@@ -0,0 +1,47 @@
+"""
+Running EWMA sums against a direct loop, and carried over between updates
+"""
+
+import numpy as np
+
+from data_analysis.baselines import ewma_sums, ewma_baseline
+
+
+def ewma_loop(values, halflife):
+    decay = 0.5 ** (1 / halflife)
+    state = np.zeros(3)
+    sums = []
+    for value in values:
+        state = decay * state + (0.0 if np.isnan(value) else np.array([value, value ** 2, 1.0]))
+        sums.append(state)
+    return np.array(sums).T
+
+
+def history(days=120, seed=3):
+    values = np.random.default_rng(seed).normal(60, 5, days)
+    values[[4, 5, 6, 40, 90]] = np.nan
+    return values
+
+
+def test_sums_match_a_direct_loop():
+    values = history()
+    # a short halflife makes the cumulative sums run over several blocks
+    for halflife in (7, 0.05):
+        np.testing.assert_allclose(ewma_sums(values, halflife), ewma_loop(values, halflife), rtol=1e-9)
+
+
+def test_incremental_update_matches_full_recompute():
+    values = history()
+    full = ewma_sums(values, 7)
+
+    first = ewma_sums(values[:50], 7)
+    second = ewma_sums(values[50:], 7, state=first[:, -1])
+    np.testing.assert_allclose(np.concatenate([first, second], axis=1), full, rtol=1e-12)
+
+
+def test_baseline_of_a_constant_series():
+    mean, std = ewma_baseline(ewma_sums(np.r_[np.nan, np.full(20, 58.0)], 7))
+
+    assert np.isnan(mean[0])
+    np.testing.assert_allclose(mean[1:], 58.0)
+    np.testing.assert_allclose(std[1:], 0.0, atol=1e-4)  # sumsq / weight - mean^2 cancels to ~1e-6
@@ -0,0 +1,59 @@
+"""
+ThingSpeak window of a night, in UTC on the right calendar days
+"""
+
+import numpy as np
+import requests
+
+from data_collection import data_aggregator
+from data_handling import data_recall
+from data_handling.snapshots import SnapshotWriter
+
+
+def epoch_seconds(utc):
+    return int(np.datetime64(utc, "s").astype(np.int64))
+
+
+def night(monkeypatch, onset_utc, offset_utc):
+    monkeypatch.setattr(data_recall, "night_bounds", lambda date, tz=None: (epoch_seconds(onset_utc), epoch_seconds(offset_utc)))
+
+
+def test_bedtime_before_midnight_starts_on_the_previous_day(monkeypatch):
+    # 23:30 - 07:00 GMT
+    night(monkeypatch, "2024-12-09T23:30", "2024-12-10T07:00")
+
+    assert data_aggregator.night_window("2024-12-10") == ("2024-12-09%2023:30:00", "2024-12-10%2007:00:00")
+
+
+def test_summer_time_night_is_sent_in_utc(monkeypatch):
+    # 23:30 - 07:00 BST
+    night(monkeypatch, "2024-06-09T22:30", "2024-06-10T06:00")
+
+    windows = data_recall.sleep_windows(["2024-06-10"], tz="Europe/London")
+    assert (windows["onset_minute"][0], windows["offset_minute"][0]) == (23 * 60 + 30, 7 * 60)
+    assert data_aggregator.night_window("2024-06-10") == ("2024-06-09%2022:30:00", "2024-06-10%2006:00:00")
+
+
+def test_fetch_requests_the_window_and_stages_the_csv(monkeypatch, data_dir):
+    night(monkeypatch, "2024-06-09T22:30", "2024-06-10T06:00")
+    urls = []
+
+    class Response:
+        content = b"created_at,entry_id,field1,field2\n"
+
+    def get(url, **kwargs):
+        urls.append(url)
+        return Response()
+
+    monkeypatch.setattr(requests, "get", get)
+    assert data_aggregator.fetch_night_data("2024-06-10") is not None
+
+    assert "start=2024-06-09%2022:30:00&end=2024-06-10%2006:00:00&timezone=Etc%2FUTC" in urls[0]
+    assert SnapshotWriter().read_bytes(data_recall.night_sensor_file("2024-06-10")) == Response.content
+
+
+def test_night_without_sleep_is_not_fetched(monkeypatch):
+    monkeypatch.setattr(data_recall, "night_bounds", lambda date, tz=None: None)
+    monkeypatch.setattr(requests, "get", lambda url, **kwargs: 1 / 0)
+
+    assert data_aggregator.fetch_night_data("2024-06-10") is None
@@ -0,0 +1,75 @@
+"""
+Alert state machine: enter after the sustain time, exit through the hysteresis band, and side flips
+"""
+
+import numpy as np
+
+from data_analysis.environment_alerts import EnvironmentAlerts
+
+
+def feed(alerts, room, start, temperatures, step=60):
+    """
+    One temperature reading per step seconds (humidity at its ideal), the events of all of them
+    """
+    events = []
+    for i, temperature in enumerate(temperatures):
+        events += alerts.push(room, start + i * step, [temperature, 60])
+    return events
+
+
+def test_alert_starts_only_once_the_deviation_is_sustained():
+    alerts = EnvironmentAlerts()
+
+    # 23 degrees is 4 over the ideal, the smoothed mean is past the band from the first reading on
+    assert feed(alerts, "bedroom", 0, [23] * 10) == []
+    events = feed(alerts, "bedroom", 600, [23] * 2)
+
+    assert [(e["type"], e["time"]) for e in events] == [("start", 600.0)]
+    assert events[0]["channel"] == "temperature" and events[0]["level"] == 2
+    assert events[0]["recommendation"] is not None
+    assert alerts.stats("bedroom")["temperature"]["active"]
+
+
+def test_short_excursions_and_the_hysteresis_band_keep_the_state():
+    alerts = EnvironmentAlerts()
+
+    # five minutes out and back to ideal never alerts
+    assert feed(alerts, "bedroom", 0, [23] * 5 + [19] * 20) == []
+
+    feed(alerts, "bedroom", 10000, [23] * 12)
+    # 19.7 is inside the enter band but not below exit, the alert stays on
+    assert feed(alerts, "bedroom", 20000, [19.7] * 20) == []
+    assert alerts.stats("bedroom")["temperature"]["active"]
+
+    events = feed(alerts, "bedroom", 30000, [19] * 5)
+    assert [e["type"] for e in events] == ["end"] and events[0]["recommendation"] is None
+    assert not alerts.stats("bedroom")["temperature"]["active"]
+
+
+def test_crossing_to_the_other_side_ends_and_restarts_the_alert():
+    alerts = EnvironmentAlerts()
+    feed(alerts, "bedroom", 0, [23] * 12)
+
+    # the window is opened overnight: an hour later the smoothed mean has crossed the whole band
+    events = alerts.push("bedroom", 3600 + 660, [15, 60])
+
+    assert [e["type"] for e in events] == ["end", "start"]
+    assert events[1]["difference"] < -3 and events[1]["level"] == 2
+    assert alerts.stats("bedroom")["temperature"]["active"]
+
+    # staying cold raises nothing new, warming back up ends it
+    assert feed(alerts, "bedroom", 5000, [15] * 5) == []
+    assert [e["type"] for e in feed(alerts, "bedroom", 9000, [19] * 5)] == ["end"]
+
+
+def test_batches_match_single_readings():
+    rooms = ["a", "b"] * 15
+    times = np.repeat(np.arange(15) * 60.0, 2)
+    values = np.column_stack([np.where(np.array(rooms) == "a", 23.0, 19.0), np.full(30, 60.0)])
+
+    batch = EnvironmentAlerts().push_batch(rooms, times, values)
+    single = EnvironmentAlerts()
+    one_by_one = [e for room, t, v in zip(rooms, times, values) for e in single.push(room, t, v)]
+
+    assert batch == one_by_one
+    assert [(e["room"], e["type"], e["time"]) for e in batch] == [("a", "start", 600.0)]
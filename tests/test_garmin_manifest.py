@@ -0,0 +1,48 @@
+"""
+Change detection over the GarminDB download folders
+"""
+
+import os
+
+from data_collection import garmin_manifest
+from data_collection.garmin_manifest import import_flags, read_manifest, scan_health_data, write_manifest
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write(text)
+
+
+def test_only_categories_with_new_content_are_imported(data_dir, monkeypatch):
+    write("HealthData/Sleep/sleep_2024-12-10.json", "{}")
+    write("HealthData/Sleep/.index/nights.json", "{}")
+    write("HealthData/RHR/rhr_2024-12-10.json", "{}")
+    os.makedirs(os.path.dirname(garmin_manifest.manifest_path))
+
+    manifest, changed = scan_health_data(read_manifest())
+    assert changed == ["rhr", "sleep"]
+    assert import_flags(changed) == ["--rhr", "--sleep"]
+    # hidden folders are not GarminDB downloads
+    assert list(manifest["sleep"]) == ["HealthData/Sleep/sleep_2024-12-10.json"]
+    write_manifest(manifest)
+
+    # unchanged size and mtime: nothing is read again
+    hashed = []
+    with monkeypatch.context() as patch:
+        patch.setattr(garmin_manifest, "file_hash", lambda path: hashed.append(path) or "")
+        assert scan_health_data(read_manifest()) == (manifest, [])
+    assert hashed == []
+
+    # re-downloaded with the same content is hashed but not imported, new content is
+    os.utime("HealthData/RHR/rhr_2024-12-10.json", ns=(0, 10 ** 18))
+    write("HealthData/Sleep/sleep_2024-12-10.json", '{"sleep": 1}')
+    manifest, changed = scan_health_data(read_manifest())
+    assert changed == ["sleep"]
+    assert manifest["rhr"]["HealthData/RHR/rhr_2024-12-10.json"][1] == 10 ** 18
+
+
+def test_a_missing_or_broken_manifest_reads_as_empty(data_dir):
+    assert read_manifest() == {}
+    write(garmin_manifest.manifest_path, "{not json")
+    assert read_manifest() == {}
@@ -0,0 +1,56 @@
+"""
+Rolling HRV against a direct computation, and the bounded night cache
+"""
+
+import numpy as np
+
+from data_analysis import hrv
+from data_analysis.hrv import rolling_hrv, ectopic_mask
+
+
+def beats(n=600, seed=11):
+    rr = 1000 + np.random.default_rng(seed).normal(0, 30, n)
+    return np.cumsum(rr) / 1000, rr
+
+
+def test_windows_match_a_direct_computation():
+    times, rr = beats()
+    windows = rolling_hrv(times, rr)
+
+    end = windows["times"][3]
+    inside = (times >= end - hrv.window_seconds) & (times <= end)
+    window = rr[inside]
+    diffs = np.diff(window)
+
+    assert np.isclose(windows["rmssd"][3], np.sqrt(np.mean(diffs ** 2)))
+    assert np.isclose(windows["sdnn"][3], np.std(window, ddof=1))
+    assert np.isclose(windows["pnn50"][3], 100 * np.mean(np.abs(diffs) > hrv.nn50_threshold))
+
+
+def test_ectopic_beats_are_dropped():
+    _, rr = beats(50)
+    rr[[10, 30]] = [1600, 250]
+
+    clean = ectopic_mask(rr)
+    assert not clean[10] and not clean[30]
+    assert clean.sum() == 48
+
+
+def test_night_cache_is_bounded(monkeypatch):
+    computed = []
+    monkeypatch.setattr(hrv, "compute_night_hrv", lambda date: computed.append(date) or {"date": date})
+    monkeypatch.setattr(hrv, "current_data_version", lambda: 1)
+    monkeypatch.setattr(hrv, "max_cached_nights", 3)
+    monkeypatch.setattr(hrv, "_night_cache", type(hrv._night_cache)())
+
+    dates = [f"2024-12-{day:02d}" for day in range(1, 8)]
+    for date in dates + dates[-3:]:
+        hrv.night_hrv(date)
+
+    assert computed == dates
+    assert list(hrv._night_cache) == dates[-3:]
+
+    # a new data version recomputes
+    monkeypatch.setattr(hrv, "current_data_version", lambda: 2)
+    hrv.night_hrv(dates[-1])
+    assert computed[-1] == dates[-1] and len(computed) == len(dates) + 1
@@ -0,0 +1,90 @@
+"""
+Live stream replay: mock feed, ring buffer and rolling aggregates against the recorded readings
+"""
+
+import numpy as np
+
+from data_collection.night_stream import (MockThingSpeakFeed, NightStream, RollingAggregates, SensorRingBuffer,
+                                          read_snapshot, write_snapshot)
+
+
+def recording(path, n=40, step=15):
+    times = 1733788800 + step * np.arange(n)
+    temperature = 18 + 0.1 * np.arange(n)
+    with open(path, "w") as file:
+        file.write("created_at,entry_id,field1,field2\n")
+        for i, t in enumerate(times):
+            stamp = str(np.datetime64(int(t), "s")).replace("T", " ")
+            humidity = "" if i == 5 else "50"
+            file.write(f"{stamp} UTC,{i + 1},{temperature[i]:.1f},{humidity}\n")
+    return times, temperature
+
+
+def test_mock_feed_replays_one_poll_interval_at_a_time(tmp_path):
+    times, _ = recording(tmp_path / "night.csv")
+    feed = MockThingSpeakFeed(tmp_path / "night.csv", poll_seconds=60)
+
+    first = feed.poll()
+    # the first reading and the four in the following minute
+    assert [entry for entry, _, _ in first] == [1, 2, 3, 4, 5]
+    assert first[0][1] == times[0]
+
+    polled = len(first)
+    while not feed.finished():
+        polled += len(feed.poll())
+    assert polled == len(times)
+    assert feed.poll() == []
+
+
+def test_stream_aggregates_match_the_window(tmp_path):
+    times, temperature = recording(tmp_path / "night.csv")
+    stream = NightStream(MockThingSpeakFeed(tmp_path / "night.csv"), window_seconds=5 * 60, capacity=16)
+    while not stream.source.finished():
+        stream.step()
+
+    snapshot = stream.snapshot()
+    # readings within five minutes of the last one, the oldest on the boundary is evicted
+    window = temperature[times > times[-1] - 5 * 60]
+    assert snapshot["last_reading"] == times[-1]
+    assert snapshot["temperature"]["latest"] == round(temperature[-1], 1)
+    assert snapshot["temperature"]["count"] == len(window) == 20
+    assert np.isclose(snapshot["temperature"]["mean"], np.round(window, 1).mean())
+    assert np.isclose(snapshot["temperature"]["std"], np.round(window, 1).std(), atol=1e-6)
+    assert snapshot["temperature"]["min"] == round(window.min(), 1)
+    assert snapshot["humidity"]["max"] == 50.0
+
+    # the ring buffer keeps the last 16 readings in order
+    held, values = stream.buffer.latest()
+    np.testing.assert_array_equal(held, times[-16:])
+
+
+def test_missing_values_are_left_out_of_the_aggregates():
+    aggregates = RollingAggregates(window_seconds=60, n_channels=2)
+    aggregates.update(0, [1.0, np.nan])
+    aggregates.update(10, [3.0, 5.0])
+
+    snapshot = aggregates.snapshot()
+    assert snapshot["count"] == [2, 1]
+    assert snapshot["mean"] == [2.0, 5.0]
+    assert snapshot["min"] == [1.0, 5.0]
+
+    aggregates.update(65, [np.nan, np.nan])
+    assert aggregates.snapshot()["count"] == [1, 1]
+
+
+def test_ring_buffer_wraps():
+    buffer = SensorRingBuffer(capacity=3, n_channels=1)
+    for t in range(5):
+        buffer.append(t, [t * 10.0])
+
+    times, values = buffer.latest()
+    assert len(buffer) == 3
+    np.testing.assert_array_equal(times, [2, 3, 4])
+    np.testing.assert_array_equal(buffer.latest(2)[1][:, 0], [30, 40])
+
+
+def test_stale_snapshots_are_not_read(tmp_path):
+    path = str(tmp_path / "live" / "snapshot.json")
+    write_snapshot({"updated": 0}, path)
+    assert read_snapshot(path) is None
+    assert read_snapshot(str(tmp_path / "missing.json")) is None
@@ -0,0 +1,52 @@
+"""
+Report planning: only weeks whose inputs changed are rendered again
+"""
+
+import os
+
+from data_handling.data_recall import night_sensor_file
+from data_handling.data_version import publish_data_version
+from data_handling.sleep_index import json_path
+from data_handling.snapshots import SnapshotWriter
+from web_app.reports import plan_reports, report_path, week_ends
+
+
+def write(path, text="{}"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write(text)
+
+
+def render(tasks, out_dir, manifest):
+    """
+    What generate_reports does with a plan, without rendering anything
+    """
+    for user, _, _, due in tasks:
+        for date, signature in due.items():
+            write(report_path(out_dir, user, date), "")
+            manifest[f"{user}/{date}"] = signature
+
+
+def test_unchanged_weeks_are_skipped_after_a_sync(data_dir):
+    users, out_dir, manifest = {"me": str(data_dir)}, str(data_dir / "reports"), {}
+    dates = week_ends("2024-12-21", 3)
+    for day in range(1, 22):
+        write(json_path(f"2024-12-{day:02d}"))
+
+    tasks, skipped = plan_reports(users, dates, out_dir, manifest)
+    assert skipped == 0 and sorted(tasks[0][3]) == sorted(dates)
+    render(tasks, out_dir, manifest)
+
+    # a sync that only brought tonight's night file: the data version moves, the past weeks' inputs don't
+    SnapshotWriter().write_bytes(night_sensor_file("2024-12-21"), b"created_at,entry_id,field1,field2\n")
+    publish_data_version()
+    tasks, skipped = plan_reports(users, dates, out_dir, manifest)
+    assert skipped == 2 and list(tasks[0][3]) == ["2024-12-21"]
+    render(tasks, out_dir, manifest)
+
+    # a rewritten sleep JSON of 2024-12-08 only touches the week ending 2024-12-14
+    os.utime(json_path("2024-12-08"), ns=(0, 10 ** 18))
+    tasks, skipped = plan_reports(users, dates, out_dir, manifest)
+    assert skipped == 2 and list(tasks[0][3]) == ["2024-12-14"]
+
+    assert plan_reports(users, dates, out_dir, manifest, force=True)[1] == 0
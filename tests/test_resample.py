@@ -0,0 +1,59 @@
+"""
+Epoch resampling on series with known means
+"""
+
+import numpy as np
+
+from data_handling.resample import resample_channel, resample_night, stacked_means, time_weighted_mean, fill_short_gaps
+
+
+def test_ramp_epochs_average_to_their_midpoint():
+    times = np.arange(0, 1801, 10, dtype=float)
+    out = resample_channel(times, times.copy(), 0.0, 6, 300)
+
+    np.testing.assert_allclose(out["values"], 150 + 300 * np.arange(6))
+    np.testing.assert_allclose(out["coverage"], 1.0)
+    assert not out["gap"].any()
+
+
+def test_long_gaps_are_not_bridged():
+    # readings every 10 s except between 300 and 900 s
+    times = np.r_[np.arange(0, 301, 10), np.arange(900, 1801, 10)].astype(float)
+    out = resample_channel(times, np.full(len(times), 21.0), 0.0, 6, 300)
+
+    np.testing.assert_allclose(out["coverage"], [1, 0, 0, 1, 1, 1])
+    # the two gap epochs have data on both sides and are interpolated
+    np.testing.assert_array_equal(out["gap"], [False, True, True, False, False, False])
+    np.testing.assert_array_equal(out["interpolated"], out["gap"])
+    np.testing.assert_allclose(out["values"], 21.0)
+
+
+def test_only_short_bounded_gaps_are_filled():
+    values = np.array([1.0, np.nan, np.nan, 4.0, np.nan, np.nan, np.nan, np.nan, 9.0, np.nan])
+    filled, interpolated = fill_short_gaps(values, np.isnan(values), max_run=3)
+
+    np.testing.assert_allclose(filled[:4], [1, 2, 3, 4])
+    assert np.isnan(filled[4:8]).all() and np.isnan(filled[9])
+    np.testing.assert_array_equal(np.flatnonzero(interpolated), [1, 2])
+
+
+def test_time_weighted_mean_skips_gaps():
+    times = np.array([0.0, 10.0, 100.0, 110.0])
+    values = np.array([[0.0, 5.0], [10.0, np.nan], [100.0, np.nan], [100.0, np.nan]])
+
+    # [0, 10] averages 5, the 90 s gap is left out, [100, 110] averages 100; one reading is its own mean
+    np.testing.assert_allclose(time_weighted_mean(times, values), [52.5, 5.0])
+
+
+def test_stacked_means_weight_measured_epochs_by_coverage():
+    # channel 0 has the 300 - 900 s gap (interpolated, not counted), channel 1 has no readings at all
+    times = np.r_[np.arange(0, 301, 10), np.arange(900, 1801, 10)].astype(float)
+    values = np.column_stack([np.where(times < 600, 10.0, 30.0), np.full(len(times), np.nan)])
+    night = resample_night(times, values, 0.0, 6, 300)
+    stacked = {key: value[None] for key, value in night.items()}
+
+    means = stacked_means(stacked)
+    assert means.shape == (1, 2)
+    # one epoch at 10, three at 30
+    assert np.isclose(means[0, 0], 25.0) and np.isnan(means[0, 1])
+    assert np.isclose(means[0, 0], time_weighted_mean(times, values)[0])
@@ -0,0 +1,99 @@
+"""
+Rollup buckets merged across tiers against stats of the raw samples
+"""
+
+import numpy as np
+
+from data_handling import sensor_rollups
+from data_handling.sensor_rollups import bucket_stats, replace_buckets, choose_tier, query_sensor_history
+
+
+def samples(hours=2, step=10, seed=7):
+    rng = np.random.default_rng(seed)
+    seconds = 1733788800 + np.arange(0, hours * 3600, step, dtype=np.int64)
+    values = np.column_stack([rng.normal(20, 1, len(seconds)), rng.normal(45, 3, len(seconds))])
+    values[100:130, 1] = np.nan
+    return seconds, values
+
+
+def floor(seconds, width):
+    return seconds - seconds % width
+
+
+def test_merged_buckets_match_the_samples():
+    seconds, values = samples()
+    minute = bucket_stats(floor(seconds, 60), values)
+    quarter = bucket_stats(floor(minute["start"], 900), minute)
+    direct = bucket_stats(floor(seconds, 900), values)
+
+    for key in direct:
+        np.testing.assert_allclose(quarter[key], direct[key])
+
+    first = (seconds < seconds[0] + 900)
+    assert quarter["count"][0, 0] == first.sum()
+    assert np.isclose(quarter["sum"][0, 0] / quarter["count"][0, 0], values[first, 0].mean())
+    assert quarter["min"][0, 1] == np.nanmin(values[first, 1])
+
+
+def test_replacing_buckets_is_idempotent():
+    seconds, values = samples()
+    tier = bucket_stats(floor(seconds, 900), values)
+    again = bucket_stats(floor(seconds[:90], 900), values[:90])
+
+    merged = replace_buckets(tier, again)
+    merged = replace_buckets(merged, again)
+
+    assert len(merged["start"]) == len(tier["start"])
+    assert np.all(np.diff(merged["start"]) > 0)
+    np.testing.assert_allclose(merged["sum"][0], tier["sum"][0])
+
+
+def test_tier_must_tile_the_resolution():
+    assert choose_tier(60) == "minute"
+    assert choose_tier(30 * 60) == "quarter"
+    assert choose_tier(20 * 60) == "minute"
+    assert choose_tier(90) == "raw"
+    assert choose_tier(86400) == sensor_rollups.night_tier
+
+
+def test_query_merges_tier_buckets(data_dir):
+    seconds, values = samples()
+    minute = bucket_stats(floor(seconds, 60), values)
+    sensor_rollups.save_tier("minute", minute)
+
+    # 20 minutes isn't a whole number of quarters, and without raw files it comes from the minute tier
+    result = query_sensor_history(int(seconds[0]), int(seconds[-1]) + 1, 20 * 60)
+    assert (result["tier"], result["resolution"]) == ("minute", 20 * 60)
+
+    first = seconds < seconds[0] + 20 * 60
+    np.testing.assert_allclose(result["mean"][0], np.nanmean(values[first], axis=0))
+    np.testing.assert_allclose(result["std"][0], np.nanstd(values[first], axis=0))
+    assert len(result["start"]) == 6
+
+
+def test_unaligned_range_only_holds_data_from_inside(data_dir, monkeypatch):
+    seconds, values = samples()
+    sensor_rollups.save_tier("quarter", bucket_stats(floor(seconds, 900), values))
+    start, end = int(seconds[0]) + 600, int(seconds[0]) + 3600 + 300
+
+    # quarter tier: the buckets reaching outside [start, end) are left out, the 30 minute bucket at the
+    # start only holds its second quarter
+    result = query_sensor_history(start, end, 30 * 60)
+    assert result["tier"] == "quarter"
+    assert result["start"].tolist() == [int(seconds[0]), int(seconds[0]) + 1800]
+    assert result["count"][:, 0].tolist() == [90, 180]
+
+    # raw: samples outside the range are left out, partial buckets keep what is inside
+    def load_night_sensor(date):
+        if date != "2024-12-10":
+            raise FileNotFoundError(date)
+        return seconds.astype(float), values
+
+    monkeypatch.setattr(sensor_rollups, "load_night_sensor", load_night_sensor)
+    result = query_sensor_history(start, end, 90)
+    assert result["tier"] == "raw"
+    inside = (seconds >= start) & (seconds < end)
+    keys, counts = np.unique(floor(seconds[inside], 90), return_counts=True)
+    np.testing.assert_array_equal(result["start"], keys)
+    np.testing.assert_array_equal(result["count"][:, 0], counts)
+    assert counts[0] == 3 and counts[-1] == 3  # 600 - 630 s and 3900 - 3930 s of their 90 s buckets
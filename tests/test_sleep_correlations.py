@@ -0,0 +1,119 @@
+"""
+Co-moment accumulators against np.corrcoef
+"""
+
+import numpy as np
+import pandas as pd
+
+from data_analysis import sleep_correlations
+from data_analysis.sleep_correlations import (accumulate, correlation_matrix, empty_store, feature_names,
+                                              night_feature_names, update_correlation_store, what_affects_sleep)
+
+
+def rows(nights=40, seed=5):
+    rng = np.random.default_rng(seed)
+    data = rng.normal(size=(nights, len(feature_names)))
+    data[:, 1] += 2 * data[:, 0]  # one strongly correlated pair
+    return data
+
+
+def test_complete_rows_match_corrcoef():
+    data = rows()
+    corr = correlation_matrix(accumulate(empty_store(), data))
+
+    np.testing.assert_allclose(corr, np.corrcoef(data, rowvar=False), atol=1e-10)
+    assert corr[0, 1] > 0.8
+
+
+def test_missing_values_use_pairwise_complete_nights():
+    data = rows()
+    data[:10, 0] = np.nan
+    data[30:, 2] = np.nan
+    corr = correlation_matrix(accumulate(empty_store(), data))
+
+    both = ~np.isnan(data[:, 0]) & ~np.isnan(data[:, 2])
+    assert np.isclose(corr[0, 2], np.corrcoef(data[both, 0], data[both, 2])[0, 1])
+    assert np.isclose(corr[0, 1], np.corrcoef(data[10:, 0], data[10:, 1])[0, 1])
+
+
+def test_too_few_nights_give_nan():
+    data = rows(nights=4)
+    assert np.isnan(correlation_matrix(accumulate(empty_store(), data))).all()
+
+
+def test_removing_rows_matches_a_rebuild():
+    data = rows()
+    changed = data[30:] + 1.5
+
+    store = accumulate(empty_store(), data)
+    store = accumulate(store, data[30:], sign=-1)
+    store = accumulate(store, changed)
+    rebuilt = accumulate(empty_store(), np.concatenate([data[:30], changed]))
+
+    for key in ("n", "sum", "sumsq", "cross"):
+        np.testing.assert_allclose(store[key], rebuilt[key], atol=1e-9)
+
+
+def fake_inputs(monkeypatch, features):
+    """
+    Night features from a {date: row} dict, every night's inputs unchanged between updates
+    """
+    computed = []
+
+    def night_features(dates):
+        computed.extend(dates)
+        return np.array([features[date] for date in dates]).reshape(-1, len(night_feature_names))
+
+    monkeypatch.setattr(sleep_correlations, "night_features", night_features)
+    monkeypatch.setattr(sleep_correlations, "regularity_metrics", lambda dates: pd.DataFrame(np.zeros((len(dates), 3))))
+    monkeypatch.setattr(sleep_correlations, "night_signature", lambda date, regularity: "unchanged")
+    return computed
+
+
+def test_empty_nights_are_stored_and_not_recomputed(monkeypatch, tmp_path):
+    dates = [f"2024-12-{day:02d}" for day in range(1, 11)]
+    rng = np.random.default_rng(1)
+    features = {date: rng.normal(size=len(night_feature_names)) for date in dates}
+    for date in dates[:4]:
+        features[date] = np.full(len(night_feature_names), np.nan)
+    computed = fake_inputs(monkeypatch, features)
+
+    path = str(tmp_path / "store.npz")
+    store = update_correlation_store(dates, path)
+    assert store["dates"].tolist() == dates
+    assert np.isnan(store["features"][:4]).all()
+
+    computed.clear()
+    store = update_correlation_store(dates, path)
+    # only the refresh_days most recent nights are recomputed
+    assert computed == dates[-sleep_correlations.refresh_days:]
+
+    rows = sleep_correlations.lagged_rows(dates, np.array([features[d] for d in dates]), dates,
+                                          np.array([features[d] for d in dates]))
+    np.testing.assert_allclose(store["n"], accumulate(empty_store(), rows)["n"])
+
+
+def test_partial_correlation_needs_more_nights_than_controls():
+    index = {name: i for i, name in enumerate(feature_names)}
+    outcome, controls = index["sleep_score"], sleep_correlations.environment_features
+
+    def drivers(nights):
+        data = rows(nights=nights)
+        data[:, outcome] += 2 * data[:, index["heart_rate_mean"]] + data[:, index["temperature_mean"]]
+        return {d["feature"]: d for d in what_affects_sleep(accumulate(empty_store(), data), top=len(feature_names))}
+
+    # five controls (four for a driver that is a control itself) need at least nine nights
+    few = drivers(8)["heart_rate_mean"]
+    assert few["partial"] is None and few["nights"] == 8
+    assert drivers(8)["temperature_mean"]["partial"] is not None
+
+    # against the correlation of the residuals after regressing out the controls
+    data = rows(nights=40)
+    data[:, outcome] += 2 * data[:, index["heart_rate_mean"]] + data[:, index["temperature_mean"]]
+    design = np.column_stack([np.ones(40), data[:, [index[name] for name in controls]]])
+
+    def residual(column):
+        return data[:, column] - design @ np.linalg.lstsq(design, data[:, column], rcond=None)[0]
+
+    expected = np.corrcoef(residual(index["heart_rate_mean"]), residual(outcome))[0, 1]
+    assert np.isclose(drivers(40)["heart_rate_mean"]["partial"], expected)
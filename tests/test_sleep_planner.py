@@ -0,0 +1,68 @@
+"""
+Planner checks on synthetic sleep histories
+"""
+
+import numpy as np
+
+from data_analysis import sleep_planner
+from data_handling.data_recall import date_list
+
+
+def plan_for(monkeypatch, onset_minute, offset_minute, date="2024-12-10"):
+    """
+    plan_sleep for a history of identical nights, onset / offset as local minute of the day
+    """
+    def windows(dates, tz=None):
+        n = len(dates)
+        return {"dates": list(dates), "valid": np.ones(n, dtype=bool),
+                "onset_minute": np.full(n, onset_minute), "offset_minute": np.full(n, offset_minute)}
+
+    monkeypatch.setattr(sleep_planner, "sleep_windows", windows)
+    return sleep_planner.plan_sleep(date)
+
+
+def test_late_schedule_is_planned_earlier(monkeypatch):
+    # 02:30 - 10:30 every night, weekends included
+    plan = plan_for(monkeypatch, 150, 630)
+
+    assert plan["target"] == (0.0, 480.0)  # chronotype midpoint 06:30 clipped to 04:00
+    assert plan["bedtime"] < 150 and plan["wake_time"] < 630
+    first_bedtime, first_wake = plan["glide_path"][0]
+    assert first_bedtime < 150 and first_wake <= 630
+    assert 150 - first_bedtime <= sleep_planner.max_shift_per_night
+
+
+def test_early_schedule_is_planned_later(monkeypatch):
+    # 21:00 - 05:00
+    plan = plan_for(monkeypatch, 21 * 60, 5 * 60)
+
+    assert plan["target"] == (-120.0, 360.0)  # chronotype midpoint 01:00 clipped to 02:00
+    assert plan["bedtime"] > -180 and plan["wake_time"] > 300
+
+
+def test_plan_stays_in_target_window_for_regular_sleeper(monkeypatch):
+    # 23:00 - 07:00, already the default target and 8 hours
+    plan = plan_for(monkeypatch, 23 * 60, 7 * 60)
+
+    assert plan["target"] == (-60.0, 420.0)
+    assert (plan["bedtime"], plan["wake_time"]) == (-60.0, 420.0)
+    assert plan["glide_path"] == [(-60.0, 420.0)]
+
+
+def test_chronotype_corrects_free_day_oversleep():
+    history = {
+        "onset": np.array([0.0, 0.0, 60.0]),
+        "offset": np.array([420.0, 420.0, 600.0]),
+        "weight": np.ones(3),
+        "free": np.array([False, False, True])
+    }
+    # free midpoint 05:30, free duration 9 h against a 7.67 h average: 330 - 40 = 290, clipped to 240
+    assert sleep_planner.chronotype_midpoint(history) == 240.0
+
+    history["offset"][2] = 480.0
+    # free midpoint 04:30, duration 7 h is below average so no correction: 270 clipped to 240
+    assert sleep_planner.chronotype_midpoint(history) == 240.0
+
+    history["onset"][2], history["offset"][2] = 0.0, 420.0
+    # 03:30, inside the range
+    assert sleep_planner.chronotype_midpoint(history) == 210.0
@@ -0,0 +1,59 @@
+"""
+Packed sleep/wake rows and their rasterisation
+"""
+
+import numpy as np
+
+from data_handling import snapshots
+from web_app import sleep_raster
+from web_app.sleep_raster import render_rows, packed_sleep_rows, choose_zoom, minutes_per_day
+
+
+def test_rows_render_the_awake_share(monkeypatch):
+    def windows(dates, tz=None):
+        return {"dates": list(dates), "valid": np.array([True, False]),
+                "onset_minute": np.array([23 * 60 + 30, 0]), "offset_minute": np.array([7 * 60, 0])}
+
+    monkeypatch.setattr(sleep_raster, "sleep_windows", windows)
+    packed, valid = packed_sleep_rows(["2024-12-09", "2024-12-10"])
+    assert packed.shape == (2, minutes_per_day // 8)
+
+    minutes = np.unpackbits(packed, axis=1, count=minutes_per_day)
+    assert minutes[0].sum() == minutes_per_day - 450  # 23:30 - 07:00 asleep
+
+    image = render_rows(packed, valid, 60)
+    assert image.shape == (2, 24, 3)
+    np.testing.assert_array_equal(image[0, :7], np.tile(sleep_raster.sleep_colour, (7, 1)))
+    np.testing.assert_array_equal(image[0, 8:23], np.tile(sleep_raster.awake_colour, (15, 1)))
+    # 23:00 - 24:00 is half asleep
+    half = (sleep_raster.sleep_colour + sleep_raster.awake_colour) / 2
+    np.testing.assert_array_equal(image[0, 23], half.astype(np.uint8))
+    np.testing.assert_array_equal(image[1], np.tile(sleep_raster.missing_colour, (24, 1)))
+
+
+def test_zoom_fits_the_span():
+    assert choose_zoom(600) == 1
+    assert choose_zoom(minutes_per_day) == 5
+    assert choose_zoom(10 ** 6) == sleep_raster.zoom_levels[-1]
+
+
+def test_tiles_are_read_from_the_generation_they_are_cached_under(monkeypatch):
+    read_from = []
+
+    def windows(dates, tz=None):
+        read_from.append(getattr(snapshots._pinned, "generation", None))
+        n = len(dates)
+        return {"dates": list(dates), "valid": np.ones(n, dtype=bool),
+                "onset_minute": np.zeros(n, dtype=int), "offset_minute": np.full(n, 420)}
+
+    monkeypatch.setattr(sleep_raster, "sleep_windows", windows)
+    monkeypatch.setattr(sleep_raster, "_tile_cache", {})
+
+    sleep_raster.raster_tile(600, 60, 3)
+    sleep_raster.raster_tile(600, 60, 3)
+    sleep_raster.raster_tile(601, 60, 4)
+    assert read_from == [3, 4]
+    # tiles of the older version are swept, a late insert of an old version doesn't drop newer ones
+    assert list(sleep_raster._tile_cache) == [(4, 601, 60)]
+    sleep_raster.raster_tile(600, 60, 3)
+    assert (4, 601, 60) in sleep_raster._tile_cache
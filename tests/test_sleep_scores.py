@@ -0,0 +1,59 @@
+"""
+Regularity metrics and their bootstrap intervals on a synthetic week
+"""
+
+import numpy as np
+import pytest
+
+from data_analysis import sleep_scores
+from data_analysis.sleep_scores import st_devs, interdaily_stability, social_jet_lag
+
+
+@pytest.fixture
+def week(monkeypatch):
+    """
+    Nights ending 2024-12-04 .. 2024-12-10 (the 7th and 8th are the weekend) going to bed later on free days
+    """
+    def windows(dates, tz=None):
+        days = np.array(dates, dtype="datetime64[D]")
+        free = (days.astype(np.int64) + 3) % 7 >= 5
+        rng = np.random.default_rng(2)
+        onset = np.where(free, 60, 23 * 60) + rng.integers(-20, 20, len(dates))
+        offset = np.where(free, 9 * 60, 7 * 60) + rng.integers(-20, 20, len(dates))
+        return {"dates": list(dates), "valid": np.ones(len(dates), dtype=bool),
+                "onset_minute": onset % 1440, "offset_minute": offset}
+
+    monkeypatch.setattr(sleep_scores, "sleep_windows", windows)
+    return "2024-12-10"
+
+
+def test_intervals_leave_the_return_value_alone(week):
+    for metric, name in ((interdaily_stability, "IS"), (social_jet_lag, "SJL")):
+        intervals = {}
+        value = metric(week, bootstrap=500, intervals=intervals)
+
+        assert value == metric(week)
+        low, high = intervals[name]
+        assert low <= value <= high
+
+    intervals = {}
+    assert st_devs(week, bootstrap=500, intervals=intervals) == st_devs(week)
+    assert sorted(intervals) == ["StDev_duration", "StDev_offset", "StDev_onset"]
+
+
+def test_social_jet_lag_of_the_week(week):
+    # free day midpoint 05:00 against 03:00 on workdays, give or take the jitter
+    assert 1.5 < social_jet_lag(week) < 2.5
+
+    # Monday and Tuesday only, a week part without nights has no interval
+    intervals = {}
+    social_jet_lag(week, callback_period=2, bootstrap=500, intervals=intervals)
+    assert intervals["SJL"] == (None, None)
+
+
+def test_bootstrap_resamples_keep_group_sizes():
+    groups = np.array([True, False, False, True, False])
+    index = sleep_scores.stratified_indices(groups, resamples=200)
+
+    assert index.shape == (200, 5)
+    assert (groups[index] == groups).all()
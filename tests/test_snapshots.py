@@ -0,0 +1,110 @@
+"""
+Stage, publish and garbage collect snapshot generations
+"""
+
+import os
+
+import pytest
+
+from data_handling import snapshots
+from data_handling.data_version import publish_data_version, read_data_version
+from data_handling.snapshots import SnapshotWriter, collect_garbage, pin
+
+
+def read(generation, logical_path):
+    with open(pin(generation).path(logical_path), "rb") as file:
+        return file.read()
+
+
+def stage_and_publish(logical_path, data):
+    writer = SnapshotWriter()
+    object_path = writer.write_bytes(logical_path, data)
+    assert publish_data_version() == writer.generation
+    return object_path
+
+
+def test_staged_file_is_only_visible_once_published(data_dir):
+    writer = SnapshotWriter()
+    assert writer.generation == 1
+    writer.write_bytes("data/night.csv", b"v1")
+
+    # readers of the published generation don't see the staged file yet
+    assert not os.path.exists(pin(0).path("data/night.csv"))
+    assert writer.read_bytes("data/night.csv") == b"v1"
+
+    publish_data_version()
+    assert read_data_version() == 1
+    assert read(1, "data/night.csv") == b"v1"
+
+
+def test_unmanaged_files_are_read_from_their_logical_path(data_dir):
+    os.makedirs("data")
+    with open("data/plain.csv", "wb") as file:
+        file.write(b"plain")
+
+    stage_and_publish("data/night.csv", b"v1")
+    assert pin(1).path("data/plain.csv") == "data/plain.csv"
+    assert pin(1).listdir("data") == ["night.csv", "plain.csv"]
+
+
+def test_garbage_collection_keeps_the_last_generations(data_dir):
+    objects = [stage_and_publish("data/night.csv", f"v{g}".encode()) for g in range(1, 5)]
+
+    deleted = collect_garbage(keep=3)
+
+    # manifest and object of generation 1 go, 2 - 4 stay readable
+    assert deleted == 2
+    assert not os.path.exists(objects[0])
+    assert not os.path.exists(snapshots.manifest_file(1))
+    assert snapshots.manifest_generations() == [2, 3, 4]
+    assert [read(g, "data/night.csv") for g in (2, 3, 4)] == [b"v2", b"v3", b"v4"]
+
+
+def test_removed_files_are_deleted_once_no_kept_generation_reads_them(data_dir):
+    os.makedirs("data")
+    with open("data/old.csv", "wb") as file:
+        file.write(b"old")
+
+    writer = SnapshotWriter()
+    writer.remove("data/old.csv")
+    publish_data_version()
+
+    assert not os.path.exists(pin(1).path("data/old.csv"))
+    assert pin(1).listdir("data") == []
+    assert os.path.exists(pin(0).path("data/old.csv"))
+
+    # generation 0 has no manifest, so the file is still in use until a kept generation reads it
+    collect_garbage(keep=1)
+    assert not os.path.exists("data/old.csv")
+
+
+def test_stale_temp_files_are_collected(data_dir):
+    object_path = stage_and_publish("data/night.csv", b"v1")
+    stale, fresh = object_path + ".1.1.tmp", object_path + ".2.2.tmp"
+    for path in (stale, fresh):
+        with open(path, "wb") as file:
+            file.write(b"partial")
+
+    now = os.stat(fresh).st_mtime
+    old = now - snapshots.stale_temp_seconds - 1
+    os.utime(stale, (old, old))
+
+    assert collect_garbage(now=now) == 1
+    assert not os.path.exists(stale)
+    assert os.path.exists(fresh)
+    assert read(1, "data/night.csv") == b"v1"
+
+
+def test_reading_a_collected_generation_raises(data_dir):
+    for g in range(1, 5):
+        stage_and_publish("data/night.csv", f"v{g}".encode())
+
+    old = pin(1)  # a reader that pinned generation 1 before the collection
+    collect_garbage(keep=3)
+
+    assert snapshots.generation_expired(1) and not snapshots.generation_expired(2)
+    with pytest.raises(snapshots.SnapshotExpired):
+        pin(1)
+    # the manifest it already had names an object that is gone
+    assert not os.path.exists(old.path("data/night.csv"))
+    assert read(2, "data/night.csv") == b"v2"
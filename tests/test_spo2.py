@@ -0,0 +1,69 @@
+"""
+Desaturation runs on a synthetic SpO2 series
+"""
+
+import numpy as np
+
+from data_analysis import spo2
+from data_analysis.spo2 import desaturation_runs, rolling_baseline, summarise
+
+
+def series():
+    times = np.arange(40, dtype=float) * 60
+    spo2 = np.full(40, 96.0)
+    spo2[10:13] = [92, 90, 93]
+    spo2[20] = 92
+    spo2[30:33] = 91
+    # readings 31 and 32 are 10 minutes apart, which ends the run
+    times[32:] += 600
+    return times, spo2
+
+
+def test_runs_are_split_by_gaps():
+    times, spo2 = series()
+    runs = desaturation_runs(times, spo2, np.full(len(spo2), 96.0))
+
+    np.testing.assert_array_equal(runs["start"], [10, 20, 30, 32])
+    np.testing.assert_array_equal(runs["end"], [13, 21, 32, 33])
+    np.testing.assert_array_equal(runs["nadir"], [90, 92, 91, 91])
+
+
+def test_small_dips_and_missing_baselines_are_not_runs():
+    times, spo2 = series()
+    baseline = np.full(len(spo2), 96.0)
+    baseline[:15] = np.nan
+
+    runs = desaturation_runs(times, np.where(spo2 == 92, 94.0, spo2), baseline)
+    np.testing.assert_array_equal(runs["start"], [30, 32])
+
+
+def test_baseline_and_summary():
+    times, spo2 = series()
+    baseline = rolling_baseline(times, spo2)
+
+    # too little history for the first three readings and the ones right after the gap
+    assert np.isnan(baseline[:3]).all() and np.isnan(baseline[32:35]).all()
+    # 13 - 15 have the 92, 90, 93 dip in their five minutes, a single low reading doesn't move the median
+    np.testing.assert_array_equal(baseline[3:32], np.where(np.isin(np.arange(3, 32), [13, 14, 15]), 93.0, 96.0))
+
+    summary = summarise(times, spo2, desaturation_runs(times, spo2, np.full(len(spo2), 96.0)))
+    assert summary["events"] == 4
+    assert summary["hours"] == 40 / 60  # the 10 minute gap counts as one typical interval
+    assert summary["odi"] == 6.0
+    assert summary["nadir"] == 90
+    assert summary["below_94"] == 7.0  # seven readings of a minute each
+
+
+def test_night_cache_keeps_the_most_recent_nights(monkeypatch):
+    computed = []
+    monkeypatch.setattr(spo2, "compute_night_spo2", lambda date: computed.append(date) or {"date": date})
+    monkeypatch.setattr(spo2, "current_data_version", lambda: 1)
+    monkeypatch.setattr(spo2, "max_cached_nights", 2)
+    monkeypatch.setattr(spo2, "_night_cache", type(spo2._night_cache)())
+
+    for date in ("2024-12-01", "2024-12-02", "2024-12-01", "2024-12-03", "2024-12-01", "2024-12-02"):
+        assert spo2.night_spo2(date) == {"date": date}
+
+    # 12-02 was the least recently used when 12-03 came in
+    assert computed == ["2024-12-01", "2024-12-02", "2024-12-03", "2024-12-02"]
+    assert list(spo2._night_cache) == ["2024-12-01", "2024-12-02"]
@@ -0,0 +1,353 @@
+"""
+Read API on the dashboard's Flask server, so other tools don't have to scrape the page or read the CSVs
+    GET /api/v1/metrics?start=&end=&limit=                  nightly metrics from sleep_metrics.csv
+    GET /api/v1/nights/<date>/environment?epoch=            a night's sensor series resampled onto epochs
+    GET /api/v1/sleep-wake?start=&end=&resolution=&limit=   the sleep/wake epoch matrix, one row per night
+- ranges are paginated by date: a page holds at most limit nights, the start date of the next page is returned
+  in the body ("next") and in a Link header
+- responses are streamed in chunks of nights as they are computed, as JSON or, with format=arrow (or
+  Accept: application/vnd.apache.arrow.stream), as an Arrow IPC stream when pyarrow is installed
+- payloads are compressed with brotli (if the brotli package is installed) or gzip, following Accept-Encoding
+- ETags are derived from the data version and the query, a matching If-None-Match returns 304 before anything
+  is loaded (endpoints that need data before they can build their rows call not_modified first)
+"""
+
+import csv
+import hashlib
+import io
+import json
+import math
+import zlib
+from urllib.parse import urlencode
+
+import numpy as np
+from flask import Blueprint, Response, jsonify, request
+
+from data_handling.data_version import current_data_version
+from data_handling.snapshots import pin, pinned
+from data_handling.resample import stack_nights, epoch_seconds, night_epochs
+from data_analysis.sleep_correlations import metrics_csv_path
+from web_app.sleep_raster import packed_sleep_rows, minutes_per_day
+
+api = Blueprint("api", __name__, url_prefix="/api/v1")
+
+default_limit = 31
+max_limit = 366
+chunk_nights = 31           # nights computed and sent per streamed chunk
+resolutions = (1, 5, 15, 30, 60)
+epoch_widths = (60, 300, 900, 1800, 3600)
+arrow_mimetype = "application/vnd.apache.arrow.stream"
+
+# column name -> type, for the Arrow schema (JSON sends the same columns per row)
+metric_columns = {"Date": "string", "StDev_onset": "float", "StDev_offset": "float", "StDev_duration": "float",
+                  "IS": "float", "SJL": "float", "CPD": "float", "SRI": "float",
+                  "optimal_bedtime": "string", "optimal_waketime": "string"}
+sleep_wake_columns = {"date": "string", "valid": "bool", "awake": "float_list"}
+
+
+class ApiError(Exception):
+    pass
+
+
+@api.errorhandler(ApiError)
+def bad_request(error):
+    return jsonify(error=str(error)), 400
+
+
+#################################### QUERY PARSING ####################################
+def parse_date(name, default=None):
+    value = request.args.get(name, default)
+    if value is None:
+        raise ApiError(f"{name} is required (YYYY-MM-DD)")
+    try:
+        return np.datetime64(value, "D")
+    except ValueError:
+        raise ApiError(f"{name} must be a date (YYYY-MM-DD), got {value!r}")
+
+
+def parse_choice(name, choices, default):
+    try:
+        value = int(request.args.get(name, default))
+    except ValueError:
+        raise ApiError(f"{name} must be one of {list(choices)}")
+    if value not in choices:
+        raise ApiError(f"{name} must be one of {list(choices)}")
+    return value
+
+
+def date_page():
+    """
+    The page of dates asked for by start, end and limit
+
+    Returns:
+    tuple: (list of YYYY-MM-DD, start date of the next page or None)
+    """
+    start, end = parse_date("start"), parse_date("end")
+    if end < start:
+        raise ApiError("end is before start")
+
+    try:
+        limit = min(max(int(request.args.get("limit", default_limit)), 1), max_limit)
+    except ValueError:
+        raise ApiError("limit must be a number")
+
+    last = min(end, start + np.timedelta64(limit - 1, "D"))
+    dates = [str(day) for day in np.arange(start, last + np.timedelta64(1, "D"))]
+    return dates, (str(last + np.timedelta64(1, "D")) if last < end else None)
+
+
+#################################### RESPONSES ####################################
+def response_format():
+    requested = request.args.get("format")
+    if requested is None:
+        requested = "arrow" if request.accept_mimetypes.best_match(["application/json", arrow_mimetype]) == arrow_mimetype \
+            else "json"
+    if requested not in ("json", "arrow"):
+        raise ApiError("format must be json or arrow")
+    return requested
+
+
+def etag_for(output_format, version=None):
+    """
+    Weak ETag of the current query, it changes whenever the scheduler publishes a new data version
+    """
+    version = current_data_version() if version is None else version
+    query = "&".join(f"{key}={value}" for key, value in sorted(request.args.items(multi=True)) if key != "format")
+    key = f"{version}|{request.path}|{query}|{output_format}"
+    return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+
+def not_modified(version=None):
+    """
+    The 304 response if the client's If-None-Match already holds the current query's ETag, else None
+
+    Parameters:
+    - version (int): data version the response is built from, the current one by default
+    """
+    tag = etag_for(response_format(), version)
+    if not request.if_none_match.contains_weak(tag):
+        return None
+
+    response = Response(status=304)
+    response.set_etag(tag, weak=True)
+    return response
+
+
+def content_encoding():
+    offered = ["gzip", "identity"]
+    try:
+        import brotli  # optional, gzip is used without it
+        offered.insert(0, "br")
+    except ImportError:
+        pass
+
+    return request.accept_encodings.best_match(offered, default="identity")
+
+
+def compress_stream(chunks, encoding):
+    if encoding == "br":
+        import brotli
+
+        compressor = brotli.Compressor(quality=5)
+        for chunk in chunks:
+            data = compressor.process(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+    elif encoding == "gzip":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 writes the gzip header
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    else:
+        yield from chunks
+
+
+def json_value(value):
+    if isinstance(value, (float, np.floating)):
+        return None if math.isnan(value) else float(value)
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    return value
+
+
+def json_stream(row_chunks, next_start):
+    yield b'{"data":['
+    first = True
+    for rows in row_chunks:
+        for row in rows:
+            text = json.dumps({name: json_value(value) for name, value in row.items()}, separators=(",", ":"))
+            yield (text if first else "," + text).encode()
+            first = False
+    yield f'],"next":{json.dumps(next_start)}}}'.encode()
+
+
+def arrow_stream(row_chunks, columns):
+    import pyarrow as pa
+
+    types = {"string": pa.string(), "float": pa.float64(), "bool": pa.bool_(), "int": pa.int64(),
+             "float_list": pa.list_(pa.float32())}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns.items()])
+
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for rows in row_chunks:
+            if rows:
+                writer.write_batch(pa.RecordBatch.from_pylist(
+                    [{name: json_value(row.get(name)) for name in columns} for row in rows], schema=schema))
+                yield sink.getvalue()
+                sink.seek(0)
+                sink.truncate()
+    yield sink.getvalue()
+
+
+def table_response(row_chunks, columns, next_start=None, version=None):
+    """
+    Streams chunks of rows as JSON or Arrow, compressed, with the ETag and the next page link
+
+    Parameters:
+    - row_chunks (callable): returns an iterable of lists of row dicts, only called when the body is needed
+    - columns (dict): column name -> type, the Arrow schema
+    - next_start (str): start date of the next page, None on the last page
+    - version (int): data version the rows are read from, the current one by default
+    """
+    cached = not_modified(version)
+    if cached is not None:
+        return cached
+
+    output_format = response_format()
+    tag = etag_for(output_format, version)
+
+    if output_format == "arrow":
+        try:
+            import pyarrow  # optional dependency, only needed for format=arrow
+        except ImportError:
+            return jsonify(error="format=arrow needs pyarrow installed on the server"), 406
+        body, mimetype = arrow_stream(row_chunks(), columns), arrow_mimetype
+    else:
+        body, mimetype = json_stream(row_chunks(), next_start), "application/json"
+
+    encoding = content_encoding()
+    response = Response(compress_stream(body, encoding), mimetype=mimetype)
+    if encoding != "identity":
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Vary"] = "Accept-Encoding, Accept"
+    response.headers["Cache-Control"] = "no-cache"
+    response.set_etag(tag, weak=True)
+
+    if next_start is not None:
+        args = request.args.to_dict()
+        args["start"] = next_start
+        response.headers["Link"] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+
+    return response
+
+
+def chunked(dates, size=chunk_nights):
+    for i in range(0, len(dates), size):
+        yield dates[i:i + size]
+
+
+#################################### ENDPOINTS ####################################
+def read_metrics(snapshot):
+    """
+    sleep_metrics.csv of a pinned generation as {date: row}, the last row wins for repeated dates
+    """
+    try:
+        with open(snapshot.path(metrics_csv_path), newline="") as file:
+            reader = csv.reader(file, skipinitialspace=True)
+            header = next(reader, [])
+            rows = [dict(zip(header, row)) for row in reader if row]
+    except FileNotFoundError:
+        return {}
+
+    metrics = {}
+    for row in rows:
+        parsed = {}
+        for name, kind in metric_columns.items():
+            value = row.get(name)
+            if kind == "float":
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    value = None
+            parsed[name] = value
+        metrics[parsed["Date"]] = parsed
+
+    return metrics
+
+
+@api.route("/metrics")
+def metrics():
+    dates, next_start = date_page()
+    # pinned now, the rows are read while the body streams
+    snapshot = pin()
+
+    def rows():
+        metrics_by_date = read_metrics(snapshot)
+        yield [metrics_by_date[date] for date in dates if date in metrics_by_date]
+
+    return table_response(rows, metric_columns, next_start, snapshot.generation)
+
+
+@api.route("/nights/<date>/environment")
+def night_environment(date):
+    try:
+        date = str(np.datetime64(date, "D"))
+    except ValueError:
+        raise ApiError(f"date must be YYYY-MM-DD, got {date!r}")
+    width = parse_choice("epoch", epoch_widths, epoch_seconds)
+    n_epochs = night_epochs * epoch_seconds // width
+
+    # the night is only read and resampled if the client doesn't have this version of it yet
+    version = current_data_version()
+    cached = not_modified(version)
+    if cached is not None:
+        return cached
+
+    with pinned(version):
+        night = stack_nights([date], n_epochs, width)
+    has_data = ~night["gap"][0].all(axis=1) | night["interpolated"][0].any(axis=1)
+    if not has_data.any():
+        return jsonify(error=f"no sensor data for {date}"), 404
+
+    last = np.flatnonzero(has_data).max() + 1
+    times = (night["grid_start"][0] + width * np.arange(last)).astype("datetime64[s]")
+    columns = {"time": "string"}
+    for channel in night["channels"]:
+        columns.update({channel: "float", channel + "_coverage": "float", channel + "_gap": "bool",
+                        channel + "_interpolated": "bool"})
+
+    def rows():
+        records = []
+        for k in range(last):
+            record = {"time": str(times[k]) + "Z"}
+            for ch, channel in enumerate(night["channels"]):
+                record[channel] = night["values"][0, k, ch]
+                record[channel + "_coverage"] = night["coverage"][0, k, ch]
+                record[channel + "_gap"] = night["gap"][0, k, ch]
+                record[channel + "_interpolated"] = night["interpolated"][0, k, ch]
+            records.append(record)
+        yield records
+
+    return table_response(rows, columns, version=version)
+
+
+@api.route("/sleep-wake")
+def sleep_wake():
+    dates, next_start = date_page()
+    resolution = parse_choice("resolution", resolutions, 60)
+
+    def rows():
+        for chunk in chunked(dates):
+            packed, valid = packed_sleep_rows(chunk)
+            minutes = np.unpackbits(packed, axis=1, count=minutes_per_day)
+            awake = minutes.reshape(len(chunk), minutes_per_day // resolution, resolution).mean(axis=2)
+            yield [{"date": date, "valid": bool(valid[i]), "awake": awake[i].tolist() if valid[i] else None}
+                   for i, date in enumerate(chunk)]
+
+    return table_response(rows, sleep_wake_columns, next_start)
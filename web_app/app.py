@@ -1,142 +1,57 @@
+import os
+import threading
+from collections import OrderedDict
 import dash
 import dash_bootstrap_components as dbc
-from dash import dcc, html, Input, Output
+from dash import dcc, html, Input, Output, State, Patch, no_update
+# imported up front in the web app (the data modules only import it on first use): plotly looks pandas up in
+# sys.modules while serialising figures, a lazy import on another thread would show it half initialised
 import pandas as pd
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-from datetime import datetime
+from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
-from apscheduler.schedulers.background import BackgroundScheduler
-from data_collection.data_aggregator import update_data
-from data_analysis.sleep_scores import optimal_bedtime, sleep_regularity_index, interdaily_stability, binary_sleep_wake_list
-from data_analysis.environment_score import diff_to_ideal
-
-# Schedule update daily at 09:00
-# scheduler = BackgroundScheduler()
-# scheduler.add_job(update_data, 'cron', hour=9)  # Schedule daily at 9 am
-# scheduler.start()
-
-# Set timezone to London and get the current date and time
+from data_handling.data_version import current_data_version, read_data_version
+from data_handling.snapshots import pinned, generation_expired
+from data_collection.night_stream import read_snapshot
+from web_app.page_loaders import today_data, week_data
+from web_app.figures import temperature_humidity_figure, heatmap_figure, drivers_figure, drivers_trace, \
+    difference_colours, format_value
+from web_app.sleep_raster import sleep_history_figure, raster_trace_update, interactive_max_nights
+from web_app.profiler import install_profiler
+from web_app.api import api
+
+# Data is synced by the standalone scheduler (python -m data_collection.scheduler), never inside the web workers.
+# The scheduler bumps the data version after each sync and the page data below is reloaded when it changes.
+#
+# The layout is static (same for every visit, so the browser can cache it). Both pages are in it and the tabs
+# only toggle their visibility. Figures and values are filled in by callbacks that send dash.Patch updates,
+# so an interaction only transfers the numbers that changed, never the page tree or the figure layouts.
+
+# Set timezone to London
 london_timezone = ZoneInfo("Europe/London")
-current_time_in_london = datetime.now(london_timezone)
-current_date_in_london = current_time_in_london.date()
-
-# Overwrite current_date_in_london for testing purposes
-current_date_in_london = '2024-12-10'
-
-#################################### SLEEP DATA ####################################
-# Load last 7 days of binary sleep data to display (1 = awake, 0 = asleep)
-binary_sleep_data = binary_sleep_wake_list(f'{current_date_in_london}', 24, 7)
-
-# Load Sleep Regularity Index (SRI) and Interdaily Stability (IS)
-sri = sleep_regularity_index(current_date_in_london)
-is_metric = interdaily_stability(current_date_in_london)
-
-# Obtain recommended optimal bedtime and wake time
-opt_bedtime = optimal_bedtime(f'{current_date_in_london}')['bedtime']
-opt_alarm = optimal_bedtime(f'{current_date_in_london}')['wake_time']
-
-
-# interdaily stability metric for last 7 days 
-interdaily_stab = interdaily_stability(current_date_in_london)
-
-
-
 
-#################################### TEMP AND HUMIDITY ####################################
-# Read night sensor data for temperature and humidity
-nightdata_file_path = 'data_handling/night_sensor_data/nightdata_' + f'{current_date_in_london}' + '.csv'
-try:
-    df_nightdata = pd.read_csv(nightdata_file_path)
-    df_environment = pd.DataFrame({
-        "Time": pd.to_datetime(df_nightdata["created_at"]).dt.strftime('%H:%M'),
-        "Temperature (°C)": df_nightdata["field1"],
-        "Humidity (%)": df_nightdata["field2"]
-    })
-    avg_temperature = df_environment["Temperature (°C)"].mean()
-    avg_humidity = df_environment["Humidity (%)"].mean()
-except FileNotFoundError:
-    df_environment = pd.DataFrame(columns=["Time", "Temperature (°C)", "Humidity (%)"])
-    avg_temperature, avg_humidity = None, None
-except Exception as e:
-    raise RuntimeError(f"Error processing night sensor data: {e}")
+# ranges offered for the sleep/wake history on the week page, in nights
+history_ranges = [7, 30, 90, 365]
 
+# how often (ms) browsers check for a new data version
+version_check_interval = 60 * 1000
 
+# Overwrite current_date_in_london for testing purposes (set to None to use today's date), the
+# SOMNA_DASHBOARD_DATE environment variable takes precedence (empty for today's date)
+date_override = os.environ.get("SOMNA_DASHBOARD_DATE", '2024-12-10') or None
 
-# optimal temp and humidity data
-environment_delta = diff_to_ideal(avg_temperature, avg_humidity)
 
+def dashboard_date():
+    """
+    Returns the date the dashboard shows, YYYY-MM-DD
+    """
+    if date_override is not None:
+        return date_override
 
-
-#################################### TEMP AND HUMIDITY PLOT ####################################
-temperature_humidity_plot = make_subplots(specs=[[{"secondary_y": True}]])
-temperature_humidity_plot.add_trace(
-    go.Scatter(
-        x=df_environment["Time"],
-        y=df_environment["Temperature (°C)"],
-        mode="lines+markers",
-        name="Temperature (°C)",
-        line=dict(color="red")
-    ),
-    secondary_y=False
-)
-temperature_humidity_plot.add_trace(
-    go.Scatter(
-        x=df_environment["Time"],
-        y=df_environment["Humidity (%)"],
-        mode="lines+markers",
-        name="Humidity (%)",
-        line=dict(color="blue")
-    ),
-    secondary_y=True
-)
-temperature_humidity_plot.update_layout(
-    title={
-        'text': "Temperature and Humidity Trend Last Night",
-        'x': 0.5,  # Center the title horizontally
-        'xanchor': 'center',  # Align the anchor to the center
-        'yanchor': 'top'  # Optional: Align the title vertically
-    },
-    xaxis_title="Time",
-    yaxis=dict(title="Temperature (°C)"),
-    yaxis2=dict(title="Humidity (%)"),
-    legend_title="Metrics",
-    hovermode="x unified",
-    template="plotly_white",
-    height=400,
-    width=700
-)
-
-#################################### HEATMAP ####################################
-heatmap = go.Figure(
-    data=go.Heatmap(
-        z=binary_sleep_data,
-        colorscale=[[0, "green"], [1, "lightblue"]],  # Two discrete colors
-        x=[f"{hour}:00" for hour in range(24)],
-        y=[f"Day {7 - i}" for i in range(7)],
-        showscale=True  # Disable the color scale bar
-    )
-)
-
-heatmap.update_layout(
-    title={
-        'text': "Sleep/Wake Data (Last 7 Days)",
-        'x': 0.5,  # Center the title horizontally
-        'xanchor': 'center',  # Align the anchor to the center
-        'yanchor': 'top'  # Optional: Align the title vertically
-    },
-    xaxis_title="Hour of the Day",
-    yaxis_title="Day",
-    xaxis=dict(tickangle=-45, ticks="outside", showgrid=True, gridcolor="lightgray", griddash="dash"),
-    yaxis=dict(autorange="reversed", ticks="outside", showgrid=True, gridcolor="lightgray", griddash="dash"),
-    template="plotly_white",
-    height=300,
-    width=600
-)
+    return datetime.now(london_timezone).strftime("%Y-%m-%d")
 
 
 #################################### TEXT DISPLAY ####################################
-def create_text_display(time, label):
+def create_text_display(time, label, value_id=None):
     return html.Div(
         style={
             "font-family": "Courier, monospace",
@@ -151,13 +66,17 @@ def create_text_display(time, label):
             "box-shadow": "5px 5px 15px rgba(0,0,0,0.3)"
         },
         children=[
-            html.Div(time, style={"font-weight": "bold"}),
+            html.Div(time, id=value_id, style={"font-weight": "bold"}) if value_id else html.Div(time, style={"font-weight": "bold"}),
             html.Div(label, style={"font-size": "16px"})
         ]
     )
 
-def create_info_box(value, label):
-    return html.Div(
+def create_info_box(value, label, value_id=None, box_id=None, background="#eaf7ff"):
+    value_div = html.Div(format_value(value), style={"font-weight": "bold"})
+    if value_id:
+        value_div.id = value_id
+
+    box = html.Div(
         style={
             "font-family": "Arial, sans-serif",
             "font-size": "18px",
@@ -165,25 +84,178 @@ def create_info_box(value, label):
             "border": "2px solid black",
             "padding": "15px",
             "margin": "10px",
-            "background-color": "#eaf7ff",
+            "background-color": background,
             "width": "200px",
             "display": "inline-block",
             "box-shadow": "3px 3px 10px rgba(0,0,0,0.2)"
         },
         children=[
-            html.Div(f"{value:.2f}" if value is not None else "N/A", style={"font-weight": "bold"}),
+            value_div,
             html.Div(label, style={"font-size": "16px"})
         ]
     )
+    if box_id:
+        box.id = box_id
+
+    return box
+
+def create_advice_box(title, text_id):
+    return html.Div(
+        children=[
+            html.Div(title, style={"font-weight": "bold", "margin-bottom": "10px"}),
+            html.Div(id=text_id, style={"font-size": "16px"})
+        ],
+        style={
+            "font-family": "Arial, sans-serif",
+            "font-size": "18px",
+            "text-align": "center",
+            "border": "2px solid black",
+            "padding": "15px",
+            "margin": "10px",
+            "background-color": "#fffbea",
+            "width": "300px",
+            "display": "inline-block",
+            "box-shadow": "3px 3px 10px rgba(0,0,0,0.2)"
+        }
+    )
+
+# style of the bordered sections on both pages
+section_style = {
+    "width": "70%",
+    "margin": "auto",
+    "display": "flex",
+    "justify-content": "center",
+    "align-items": "center",
+    "vertical-align": "top",
+    "border": "2px solid black",
+    "padding": "30px 20px",
+    "background-color": "#f8f9fa",
+    "box-shadow": "5px 5px 15px rgba(0,0,0,0.3)",
+    "margin-bottom": "40px"
+}
+
+box_row_style = {
+    "margin": "auto",
+    "text-align": "center",
+    "border": "2px solid black",
+    "padding": "30px 20px",
+    "background-color": "#f8f9fa",
+    "box-shadow": "5px 5px 15px rgba(0,0,0,0.3)",
+    "width": "70%",
+    "margin-bottom": "40px"
+}
+
+#################################### PAGE DATA CACHE ####################################
+# page data for the data version currently on disk: the today page per date, the week page once (it only reads
+# the correlation store). When the version changes an entry is reloaded in a background thread and the old data
+# keeps being served until the new data is ready. The dates visitors pick are kept least recently used first and
+# the oldest are dropped beyond max_cached_pages, so a worker's memory doesn't grow with every date picked.
+max_cached_pages = 32
+page_cache = OrderedDict()
+cache_lock = threading.Lock()
+
+# a cold entry is loaded by one thread while the others wait for it, and only one reload per entry runs at a time.
+# Entries share a small fixed set of locks, so the lock table stays bounded too.
+load_locks = [threading.Lock() for _ in range(8)]
+
+page_loaders = {"today": today_data, "week": week_data}
+
+
+def load_lock(key):
+    return load_locks[hash(key) % len(load_locks)]
+
+
+def cached_entry(key):
+    with cache_lock:
+        cached = page_cache.get(key)
+        if cached is not None:
+            page_cache.move_to_end(key)
+        return cached
+
+
+def store_entry(key, entry):
+    with cache_lock:
+        page_cache[key] = entry
+        page_cache.move_to_end(key)
+        while len(page_cache) > max_cached_pages:
+            page_cache.popitem(last=False)
+
+
+def load_page_data(key, version):
+    # every file is read from the generation the data version names, even if the next sync publishes meanwhile
+    page, *args = key
+    try:
+        with pinned(version):
+            return {"version": version, "data": page_loaders[page](*args)}
+    except Exception:
+        # loaders wrap their errors, so whether the generation was collected under the load is asked directly
+        if not generation_expired(version):
+            raise
+
+    # collected while the page loaded (a load that outlived keep_generations syncs), start over on the current one
+    version = read_data_version()
+    with pinned(version):
+        return {"version": version, "data": page_loaders[page](*args)}
+
+
+def rebuild_page_data(key, version, lock):
+    try:
+        cached = cached_entry(key)
+        if cached is None or cached["version"] != version:
+            store_entry(key, load_page_data(key, version))
+    except Exception as e:
+        print(f"Error rebuilding dashboard for data version {version}: {e}")
+    finally:
+        lock.release()
+
+
+def page_data(key):
+    """
+    Returns the cached data of a page, ("today", date) or ("week",), kicking off a reload if the scheduler has
+    published new data
+    """
+    version = current_data_version()
+    cached = cached_entry(key)
+    if cached is None:
+        with load_lock(key):
+            # another request (or the warm-up) may have loaded it while this one waited
+            cached = cached_entry(key)
+            if cached is None:
+                cached = load_page_data(key, version)
+                store_entry(key, cached)
+    elif cached["version"] != version:
+        lock = load_lock(key)
+        if lock.acquire(blocking=False):
+            threading.Thread(target=rebuild_page_data, args=(key, version, lock), daemon=True).start()
+
+    return cached["data"]
+
+
+def warm_page_cache():
+    """
+    Loads the default date in the background so a worker starts serving straight away and the first visitor
+    usually doesn't wait. A request arriving before it finishes waits for it instead of loading the data again.
+    """
+    def warm():
+        for key in [("today", dashboard_date()), ("week",)]:
+            try:
+                page_data(key)
+            except Exception as e:
+                print(f"Error loading dashboard data for {key[0]} page: {e}")
+
+    threading.Thread(target=warm, daemon=True).start()
 
-bedtime_display = create_text_display(opt_bedtime, "Bedtime")
-wake_time_display = create_text_display(opt_alarm, "Wake Time")
-avg_temp_box = create_info_box(avg_temperature, "Avg Temp (°C)")
-avg_hum_box = create_info_box(avg_humidity, "Avg Humidity (%)")
 
 #################################### DASH APP SETUP ####################################
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.LUX])
 server = app.server
+
+# sampling profiler, off unless SOMNA_PROFILE_RATE is set (see web_app/profiler.py)
+profiler = install_profiler(server)
+
+# read API for other tools (see web_app/api.py)
+server.register_blueprint(api)
+
 app.title = "Sleep Metrics Dashboard"
 
 #################################### LAYOUT ####################################
@@ -195,204 +267,89 @@ navbar = dbc.NavbarSimple(
 )
 
 today_page = html.Div(
+    id="today-page",
     style={"text-align": "center", "padding": "20px"},
     children=[
         html.Div(
             children=[
                 html.H1("TONIGHT'S SLEEP AND WAKE TIMES", style={"margin-bottom": "20px", "font-family": "Arial, sans-serif", "font-weight": "bold"}),
-                bedtime_display,
-                wake_time_display
+                create_text_display("--:--", "Bedtime", value_id="bedtime-value"),
+                create_text_display("--:--", "Wake Time", value_id="wake-time-value")
+            ],
+            style=section_style
+        ),
+        html.Div(
+            children=[
+                # empty date = the dashboard date
+                dcc.DatePickerSingle(id="night-date", placeholder="Last night", clearable=True, display_format="YYYY-MM-DD")
             ],
-            style={
-                "width": "70%",
-                "margin": "auto",
-                "display": "flex",
-                "justify-content": "center",
-                "align-items": "center",
-                "vertical-align": "top",
-                "border": "2px solid black",
-                "padding": "30px 20px",
-                "background-color": "#f8f9fa",
-                "box-shadow": "5px 5px 15px rgba(0,0,0,0.3)",
-                "margin-bottom": "40px"
-            }
+            style={"margin-bottom": "20px"}
         ),
         html.Div(
-            children=[dcc.Graph(figure=heatmap, style={"margin": "auto"})],
-            style={
-                "width": "70%",
-                "margin": "auto",
-                "display": "flex",
-                "justify-content": "center",
-                "align-items": "center",
-                "vertical-align": "top",
-                "border": "2px solid black",
-                "padding": "30px 20px",
-                "background-color": "#f8f9fa",
-                "box-shadow": "5px 5px 15px rgba(0,0,0,0.3)",
-                "margin-bottom": "40px"
-            }
+            children=[dcc.Graph(id="sleep-heatmap", figure=heatmap_figure(), style={"margin": "auto"})],
+            style=section_style
+        ),
+        html.Div(
+            children=[dcc.Graph(id="environment-plot", figure=temperature_humidity_figure(), style={"margin": "auto"})],
+            style=section_style
         ),
         html.Div(
             children=[
-                dcc.Graph(figure=temperature_humidity_plot, style={"margin": "auto"})
+                create_info_box(None, "Avg Temp (°C)", value_id="avg-temperature-value"),
+                create_info_box(None, "Temp Difference (°C)", value_id="temperature-difference-value", box_id="temperature-difference-box"),
+                create_info_box(None, "Avg Humidity (%)", value_id="avg-humidity-value"),
+                create_info_box(None, "Humidity Difference (%)", value_id="humidity-difference-value", box_id="humidity-difference-box")
             ],
-            style={
-                "width": "70%",
-                "margin": "auto",
-                "display": "flex",
-                "justify-content": "center",
-                "align-items": "center",
-                "vertical-align": "top",
-                "border": "2px solid black",
-                "padding": "30px 20px",
-                "background-color": "#f8f9fa",
-                "box-shadow": "5px 5px 15px rgba(0,0,0,0.3)",
-                "margin-bottom": "40px"
-            }
+            style=box_row_style
         ),
         html.Div(
             children=[
-                html.Div(
-                    children=[
-                        html.Div(f"Avg Temp (°C): {avg_temperature:.2f}" if avg_temperature is not None else "Avg Temp (°C): N/A",
-                                 style={"font-weight": "bold", "margin-bottom": "10px"}),
-                    ],
-                    style={
-                        "font-family": "Arial, sans-serif",
-                        "font-size": "18px",
-                        "text-align": "center",
-                        "border": "2px solid black",
-                        "padding": "15px",
-                        "margin": "10px",
-                        "background-color": "#eaf7ff",
-                        "width": "200px",
-                        "display": "inline-block",
-                        "box-shadow": "3px 3px 10px rgba(0,0,0,0.2)"
-                    }
-                ),
-                html.Div(
-                    children=[
-                        html.Div(f"Temp Difference (°C): {environment_delta['temperature_difference']:.2f}",
-                                 style={"font-weight": "bold", "margin-bottom": "10px"}),
-                    ],
-                    style={
-                        "font-family": "Arial, sans-serif",
-                        "font-size": "18px",
-                        "text-align": "center",
-                        "border": "2px solid black",
-                        "padding": "15px",
-                        "margin": "10px",
-                        "background-color": "#ffcc99" if environment_delta['temperature_difference'] > 0 else "#99ccff",
-                        "width": "200px",
-                        "display": "inline-block",
-                        "box-shadow": "3px 3px 10px rgba(0,0,0,0.2)"
-                    }
-                ),
-                html.Div(
-                    children=[
-                        html.Div(f"Avg Humidity (%): {avg_humidity:.2f}" if avg_humidity is not None else "Avg Humidity (%): N/A",
-                                 style={"font-weight": "bold", "margin-bottom": "10px"}),
-                    ],
-                    style={
-                        "font-family": "Arial, sans-serif",
-                        "font-size": "18px",
-                        "text-align": "center",
-                        "border": "2px solid black",
-                        "padding": "15px",
-                        "margin": "10px",
-                        "background-color": "#eaf7ff",
-                        "width": "200px",
-                        "display": "inline-block",
-                        "box-shadow": "3px 3px 10px rgba(0,0,0,0.2)"
-                    }
-                ),
-                html.Div(
-                    children=[
-                        html.Div(f"Humidity Difference (%): {environment_delta['humidity_difference']:.2f}",
-                                 style={"font-weight": "bold", "margin-bottom": "10px"}),
-                    ],
-                    style={
-                        "font-family": "Arial, sans-serif",
-                        "font-size": "18px",
-                        "text-align": "center",
-                        "border": "2px solid black",
-                        "padding": "15px",
-                        "margin": "10px",
-                        "background-color": "#d3d3d3" if environment_delta['humidity_difference'] > 0 else "#f8f8f8",
-                        "width": "200px",
-                        "display": "inline-block",
-                        "box-shadow": "3px 3px 10px rgba(0,0,0,0.2)"
-                    }
-                )
+                create_advice_box("Temperature Advice", "temperature-advice"),
+                create_advice_box("Humidity Advice", "humidity-advice"),
+                create_advice_box("Breathing Advice", "oxygen-advice")
             ],
-            style={
-                "margin": "auto",
-                "text-align": "center",
-                "padding": "30px 20px",
-                "background-color": "#f8f9fa",
-                "box-shadow": "5px 5px 15px rgba(0,0,0,0.3)",
-                "width": "70%"
-            }
+            style=box_row_style
         ),
         html.Div(
             children=[
-                html.Div(
-                    children=[
-                        html.Div("Temperature Advice", style={"font-weight": "bold", "margin-bottom": "10px"}),
-                        html.Div(environment_delta['temperature_intervention'], style={"font-size": "16px"})
-                    ],
-                    style={
-                        "font-family": "Arial, sans-serif",
-                        "font-size": "18px",
-                        "text-align": "center",
-                        "border": "2px solid black",
-                        "padding": "15px",
-                        "margin": "10px",
-                        "background-color": "#fffbea",
-                        "width": "300px",
-                        "display": "inline-block",
-                        "box-shadow": "3px 3px 10px rgba(0,0,0,0.2)"
-                    }
-                ),
-                html.Div(
-                    children=[
-                        html.Div("Humidity Advice", style={"font-weight": "bold", "margin-bottom": "10px"}),
-                        html.Div(environment_delta['humidity_intervention'], style={"font-size": "16px"})
-                    ],
-                    style={
-                        "font-family": "Arial, sans-serif",
-                        "font-size": "18px",
-                        "text-align": "center",
-                        "border": "2px solid black",
-                        "padding": "15px",
-                        "margin": "10px",
-                        "background-color": "#fffbea",
-                        "width": "300px",
-                        "display": "inline-block",
-                        "box-shadow": "3px 3px 10px rgba(0,0,0,0.2)"
-                    }
-                )
+                html.H2("OVERNIGHT RECOVERY", style={"font-family": "Arial, sans-serif", "font-weight": "bold"}),
+                create_info_box(None, "Overnight RMSSD (ms)", value_id="rmssd-value"),
+                create_info_box(None, "Overnight SDNN (ms)", value_id="sdnn-value"),
+                create_info_box(None, "Overnight pNN50 (%)", value_id="pnn50-value"),
+                create_info_box(None, "Oxygen Dips per Hour", value_id="odi-value"),
+                create_info_box(None, "Lowest SpO2 (%)", value_id="spo2-nadir-value"),
+                create_info_box(None, "Time Below 90% SpO2 (min)", value_id="spo2-below-90-value")
             ],
-            style={
-                "margin": "auto",
-                "border": "2px solid black",
-                "padding": "30px 20px",
-                "background-color": "#f8f9fa",
-                "box-shadow": "5px 5px 15px rgba(0,0,0,0.3)",
-                "width": "70%",
-                "margin-top": "40px"
-            }
+            style=box_row_style
         )
     ]
 )
 
-
 week_page = html.Div(
-    style={"text-align": "center", "padding": "20px"},
+    id="week-page",
+    style={"text-align": "center", "padding": "20px", "display": "none"},
     children=[
         html.H1("My Week", style={"margin-bottom": "20px", "font-family": "Arial, sans-serif", "font-weight": "bold"}),
-        html.P("This page is under construction. More features coming soon!", style={"font-size": "18px"})
+        html.Div(
+            children=[
+                dcc.Graph(id="drivers-plot", figure=drivers_figure(), style={"margin": "auto"}),
+                html.P(id="drivers-message", style={"font-size": "18px"})
+            ],
+            style={**section_style, "flex-direction": "column"}
+        ),
+        html.Div(
+            children=[
+                dcc.RadioItems(
+                    id="history-nights",
+                    options=[{"label": f" {nights} nights ", "value": nights} for nights in history_ranges],
+                    value=history_ranges[-1],
+                    inline=True
+                ),
+                # long ranges are a raster image, re-rendered at a finer zoom level when zoomed in
+                dcc.Graph(id="sleep-history", style={"margin": "auto"})
+            ],
+            style={**section_style, "flex-direction": "column"}
+        )
     ]
 )
 
@@ -402,19 +359,213 @@ app.layout = html.Div([
         dcc.Tab(label="Today", value="today"),
         dcc.Tab(label="My Week", value="week")
     ]),
-    html.Div(id="content")
+    html.Div(id="live-panel", style={"text-align": "center", "padding-top": "20px"}),
+    dcc.Interval(id="live-interval", interval=30 * 1000),
+    dcc.Store(id="live-cursor"),
+    dcc.Interval(id="version-interval", interval=version_check_interval),
+    dcc.Store(id="data-version", data=None),
+    today_page,
+    week_page
 ])
 
+#################################### TABS ####################################
 @app.callback(
-    Output("content", "children"),
+    Output("today-page", "style"),
+    Output("week-page", "style"),
     Input("tabs", "value")
 )
 def render_page(tab):
-    if tab == "today":
-        return today_page
-    elif tab == "week":
-        return week_page
+    # only the display property changes, both pages stay in the browser
+    today_style, week_style = Patch(), Patch()
+    today_style["display"] = "block" if tab == "today" else "none"
+    week_style["display"] = "block" if tab == "week" else "none"
+    return today_style, week_style
+
+#################################### DATA VERSION ####################################
+@app.callback(
+    Output("data-version", "data"),
+    Input("version-interval", "n_intervals"),
+    State("data-version", "data")
+)
+def check_data_version(n_intervals, known_version):
+    version = current_data_version()
+    return version if version != known_version else no_update
+
+#################################### TODAY PAGE ####################################
+@app.callback(
+    Output("sleep-heatmap", "figure"),
+    Output("environment-plot", "figure"),
+    Output("bedtime-value", "children"),
+    Output("wake-time-value", "children"),
+    Output("avg-temperature-value", "children"),
+    Output("avg-humidity-value", "children"),
+    Output("temperature-difference-value", "children"),
+    Output("humidity-difference-value", "children"),
+    Output("temperature-difference-box", "style"),
+    Output("humidity-difference-box", "style"),
+    Output("temperature-advice", "children"),
+    Output("humidity-advice", "children"),
+    Output("rmssd-value", "children"),
+    Output("sdnn-value", "children"),
+    Output("pnn50-value", "children"),
+    Output("oxygen-advice", "children"),
+    Output("odi-value", "children"),
+    Output("spo2-nadir-value", "children"),
+    Output("spo2-below-90-value", "children"),
+    Input("data-version", "data"),
+    Input("night-date", "date")
+)
+def update_today_page(version, night_date):
+    data = page_data(("today", night_date or dashboard_date()))
+
+    # swap the heatmap z-matrix and the environment series, the figure layouts stay in the browser
+    heatmap = Patch()
+    heatmap["data"][0]["z"] = data["heatmap"]
+
+    environment = Patch()
+    environment["data"][0]["x"] = data["environment"]["time"]
+    environment["data"][0]["y"] = data["environment"]["temperature"]
+    environment["data"][1]["x"] = data["environment"]["time"]
+    environment["data"][1]["y"] = data["environment"]["humidity"]
+
+    temperature_difference = data["temperature_difference"]
+    humidity_difference = data["humidity_difference"]
+
+    temperature_box = Patch()
+    humidity_box = Patch()
+    temperature_box["background-color"], humidity_box["background-color"] = \
+        difference_colours(temperature_difference, humidity_difference)
+
+    return (
+        heatmap,
+        environment,
+        data["bedtime"],
+        data["wake_time"],
+        format_value(data["avg_temperature"]),
+        format_value(data["avg_humidity"]),
+        format_value(temperature_difference),
+        format_value(humidity_difference),
+        temperature_box,
+        humidity_box,
+        data["temperature_intervention"],
+        data["humidity_intervention"],
+        format_value(data["hrv"]["rmssd"]),
+        format_value(data["hrv"]["sdnn"]),
+        format_value(data["hrv"]["pnn50"]),
+        data["oxygen_intervention"],
+        format_value(data["spo2"]["odi"]),
+        format_value(data["spo2"]["nadir"]),
+        format_value(data["spo2"]["below_90"])
+    )
+
+#################################### WEEK PAGE ####################################
+@app.callback(
+    Output("drivers-plot", "figure"),
+    Output("drivers-plot", "style"),
+    Output("drivers-message", "children"),
+    Input("data-version", "data")
+)
+def update_week_page(version):
+    drivers = page_data(("week",))["drivers"]
+
+    drivers_plot = Patch()
+    for key, value in drivers_trace(drivers).items():
+        drivers_plot["data"][0][key] = value
+
+    graph_style = Patch()
+    graph_style["display"] = "block" if drivers else "none"
+    message = "" if drivers else "Not enough nights yet to see what affects your sleep."
+
+    return drivers_plot, graph_style, message
+
+@app.callback(
+    Output("sleep-history", "figure"),
+    Input("history-nights", "value"),
+    Input("data-version", "data")
+)
+def update_sleep_history(nights, version):
+    return sleep_history_figure(dashboard_date(), nights)
+
+@app.callback(
+    Output("sleep-history", "figure", allow_duplicate=True),
+    Input("sleep-history", "relayoutData"),
+    State("history-nights", "value"),
+    prevent_initial_call=True
+)
+def zoom_sleep_history(relayout, nights):
+    """
+    Swaps the raster for one rendered at the zoom level of the visible hours (the image only, via Patch)
+    """
+    if nights <= interactive_max_nights or not relayout:
+        return no_update
+
+    if "xaxis.range[0]" in relayout:
+        minute_range = (relayout["xaxis.range[0]"] * 60, relayout["xaxis.range[1]"] * 60)
+    elif relayout.get("xaxis.autorange"):
+        minute_range = None
+    else:
+        return no_update
+
+    history = Patch()
+    for key, value in raster_trace_update(dashboard_date(), nights, minute_range).items():
+        history["data"][0][key] = value
+
+    return history
+
+#################################### LIVE PANEL ####################################
+# Shows the bedroom readings from the night stream (python -m data_collection.night_stream) while it is running
+@app.callback(
+    Output("live-panel", "children"),
+    Input("live-interval", "n_intervals")
+)
+def render_live_panel(n_intervals):
+    snapshot = read_snapshot()
+    if snapshot is None:
+        return []
+
+    temperature = snapshot["temperature"]
+    humidity = snapshot["humidity"]
+    return [
+        create_info_box(temperature["latest"], "Live Temp (°C)"),
+        create_info_box(temperature["mean"], "15 min Avg Temp (°C)"),
+        create_info_box(humidity["latest"], "Live Humidity (%)"),
+        create_info_box(humidity["mean"], "15 min Avg Humidity (%)")
+    ] + [
+        # alerts raised by the online detector while conditions are out of band
+        html.Div(alert["recommendation"], style={"font-size": "18px", "font-weight": "bold", "margin": "10px"})
+        for alert in snapshot.get("alerts", [])
+    ]
+
+@app.callback(
+    Output("environment-plot", "figure", allow_duplicate=True),
+    Output("live-cursor", "data"),
+    Input("live-interval", "n_intervals"),
+    State("live-cursor", "data"),
+    State("night-date", "date"),
+    prevent_initial_call=True
+)
+def append_live_reading(n_intervals, cursor, night_date):
+    """
+    While the night stream runs, appends its newest reading to the environment plot of the dashboard date
+    """
+    snapshot = read_snapshot()
+    if snapshot is None or snapshot["last_reading"] is None or (night_date and night_date != dashboard_date()):
+        return no_update, no_update
+    if cursor is not None and snapshot["last_reading"] <= cursor:
+        return no_update, no_update
+
+    reading_time = datetime.fromtimestamp(snapshot["last_reading"], timezone.utc).strftime('%H:%M')
+    environment = Patch()
+    environment["data"][0]["x"].append(reading_time)
+    environment["data"][0]["y"].append(snapshot["temperature"]["latest"])
+    environment["data"][1]["x"].append(reading_time)
+    environment["data"][1]["y"].append(snapshot["humidity"]["latest"])
+
+    return environment, snapshot["last_reading"]
 
 #################################### RUN APP ####################################
+# started last, so loading the data doesn't slow down building the layout
+warm_page_cache()
+
 if __name__ == "__main__":
     app.run_server()
@@ -0,0 +1,138 @@
+"""
+Figures of the dashboard as pure functions of the page data (see web_app.page_loaders)
+- called without data they give the empty skeletons the dashboard layout starts with, the callbacks then send
+  the data as Patch updates onto the same trace structure
+- called with data they give complete figures, e.g. for the batch reports (web_app.reports)
+"""
+
+import plotly.graph_objects as go
+
+
+def temperature_humidity_figure(environment=None):
+    """
+    Parameters:
+    - environment (dict): {"time": [], "temperature": [], "humidity": []} from today_data, None for the skeleton
+    """
+    environment = environment or {"time": [], "temperature": [], "humidity": []}
+
+    # humidity on a secondary y axis, laid out by hand (what make_subplots would produce, without importing
+    # plotly.subplots at start-up)
+    temperature_humidity_plot = go.Figure()
+    temperature_humidity_plot.add_trace(
+        go.Scatter(x=environment["time"], y=environment["temperature"], mode="lines+markers",
+                   name="Temperature (°C)", line=dict(color="red"))
+    )
+    temperature_humidity_plot.add_trace(
+        go.Scatter(x=environment["time"], y=environment["humidity"], mode="lines+markers",
+                   name="Humidity (%)", line=dict(color="blue"), yaxis="y2")
+    )
+    temperature_humidity_plot.update_layout(
+        title={
+            'text': "Temperature and Humidity Trend Last Night",
+            'x': 0.5,  # Center the title horizontally
+            'xanchor': 'center',  # Align the anchor to the center
+            'yanchor': 'top'  # Optional: Align the title vertically
+        },
+        xaxis=dict(title="Time", domain=[0, 0.94]),
+        yaxis=dict(title="Temperature (°C)"),
+        yaxis2=dict(title="Humidity (%)", overlaying="y", side="right", anchor="x"),
+        legend_title="Metrics",
+        hovermode="x unified",
+        template="plotly_white",
+        height=400,
+        width=700
+    )
+    return temperature_humidity_plot
+
+
+def heatmap_figure(heatmap=None):
+    """
+    Parameters:
+    - heatmap (list): (nights x 24) sleep/wake rows from today_data, None for the skeleton
+    """
+    heatmap_plot = go.Figure(
+        data=go.Heatmap(
+            z=heatmap if heatmap is not None else [],
+            colorscale=[[0, "green"], [1, "lightblue"]],  # Two discrete colors
+            x=[f"{hour}:00" for hour in range(24)],
+            y=[f"Day {7 - i}" for i in range(7)],
+            zmin=0,
+            zmax=1,
+            showscale=True  # Disable the color scale bar
+        )
+    )
+    heatmap_plot.update_layout(
+        title={
+            'text': "Sleep/Wake Data (Last 7 Days)",
+            'x': 0.5,  # Center the title horizontally
+            'xanchor': 'center',  # Align the anchor to the center
+            'yanchor': 'top'  # Optional: Align the title vertically
+        },
+        xaxis_title="Hour of the Day",
+        yaxis_title="Day",
+        xaxis=dict(tickangle=-45, ticks="outside", showgrid=True, gridcolor="lightgray", griddash="dash"),
+        yaxis=dict(autorange="reversed", ticks="outside", showgrid=True, gridcolor="lightgray", griddash="dash"),
+        template="plotly_white",
+        height=300,
+        width=600
+    )
+    return heatmap_plot
+
+
+def drivers_trace(drivers):
+    """
+    Data of the drivers bar chart, the same keys the week page patches
+    """
+    return {
+        "x": [driver["correlation"] for driver in drivers],
+        "y": [driver["feature"].replace("_", " ") for driver in drivers],
+        "customdata": [["n/a" if driver["partial"] is None else f"{driver['partial']:.2f}", driver["nights"]]
+                       for driver in drivers],
+        "marker": {"color": ["#2ca02c" if driver["correlation"] > 0 else "#d62728" for driver in drivers]}
+    }
+
+
+def drivers_figure(drivers=None):
+    """
+    Parameters:
+    - drivers (list): what_affects_sleep result from week_data, None for the skeleton
+    """
+    drivers_plot = go.Figure(
+        data=go.Bar(
+            **drivers_trace(drivers or []), orientation="h",
+            hovertemplate="r = %{x:.2f}<br>partial r = %{customdata[0]}<br>%{customdata[1]} nights<extra></extra>"
+        )
+    )
+    drivers_plot.update_layout(
+        title={
+            'text': "What Affects Your Sleep Score",
+            'x': 0.5,
+            'xanchor': 'center',
+            'yanchor': 'top'
+        },
+        xaxis=dict(title="Correlation", range=[-1, 1]),
+        yaxis=dict(autorange="reversed"),
+        template="plotly_white",
+        height=400,
+        width=700
+    )
+    return drivers_plot
+
+
+def difference_colours(temperature_difference, humidity_difference):
+    """
+    Background colours of the temperature and humidity difference boxes
+
+    Returns:
+    tuple: (temperature colour, humidity colour)
+    """
+    temperature_colour = "#eaf7ff" if temperature_difference is None else \
+        "#ffcc99" if temperature_difference > 0 else "#99ccff"
+    humidity_colour = "#eaf7ff" if humidity_difference is None else \
+        "#d3d3d3" if humidity_difference > 0 else "#f8f8f8"
+
+    return temperature_colour, humidity_colour
+
+
+def format_value(value):
+    return f"{value:.2f}" if value is not None else "N/A"
@@ -0,0 +1,450 @@
+"""
+Load generator for the dashboard, measures how many concurrent viewers a gunicorn deployment sustains
+- writes a synthetic data set (sleep JSONs, bedroom sensor nights, sleep_metrics.csv and an empty monitoring
+  database) into a temporary directory, which becomes the server's working directory
+- starts gunicorn on the app for each worker x thread configuration in turn
+- simulated viewers replay sessions against it: page load, the initial callbacks, switching between the
+  "today" and "week" tabs, changing the history range, zooming the sleep history, picking another night and
+  the interval ticks. Callback requests are built from the app's own /_dash-dependencies, so they follow the
+  layout as it changes.
+- reports throughput and p50 / p95 / p99 latency per route and per callback for every configuration
+
+Run from the repository root:
+    python -m web_app.load_test --users 20 --duration 60 --configs 1x1 2x1 2x4 4x2
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+synthetic_nights = 90
+default_configs = ["1x1", "2x1", "2x4", "4x2"]   # workers x threads
+default_users = 10
+default_duration = 30        # seconds of load per configuration
+default_think_time = 1.0     # longest pause between a viewer's steps, seconds
+server_start_timeout = 90
+request_timeout = 60
+
+page_routes = ["/", "/_dash-layout", "/_dash-dependencies"]
+
+
+#################################### SYNTHETIC DATA ####################################
+def gmt_string(moment):
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.0")
+
+
+def epoch_ms(moment):
+    return int(moment.timestamp() * 1000)
+
+
+def synthetic_sleep_json(onset, offset, rng):
+    """
+    Sleep JSON with the arrays the dashboard reads, for a night from onset to offset (UTC datetimes)
+    """
+    def every(step_minutes, start=onset, end=offset):
+        steps = int((end - start).total_seconds() // (60 * step_minutes))
+        return [start + timedelta(minutes=step_minutes * i) for i in range(steps)]
+
+    # sleepMovement is padded by an hour either side of the sleep (data_handling.sleep_index.movement_padding)
+    movement_start = onset - timedelta(minutes=60)
+    movement = every(1, movement_start, offset + timedelta(minutes=60))
+    asleep = (offset - onset).total_seconds()
+
+    return {
+        "dailySleepDTO": {
+            "calendarDate": offset.strftime("%Y-%m-%d"),
+            "sleepTimeSeconds": int(asleep),
+            "sleepStartTimestampGMT": epoch_ms(onset),
+            "sleepEndTimestampGMT": epoch_ms(offset),
+            "deepSleepSeconds": int(asleep * rng.uniform(0.12, 0.25)),
+            "remSleepSeconds": int(asleep * rng.uniform(0.15, 0.25)),
+            "averageRespirationValue": round(rng.uniform(12, 16), 1),
+            "awakeCount": int(rng.integers(0, 5)),
+            "avgSleepStress": round(rng.uniform(10, 30), 1),
+            "sleepScores": {"overall": {"value": int(rng.integers(55, 95))}}
+        },
+        "sleepMovement": [{"startGMT": gmt_string(t), "endGMT": gmt_string(t + timedelta(minutes=1)),
+                           "activityLevel": float(rng.gamma(2.0, 1.5))} for t in movement],
+        "sleepLevels": [{"startGMT": gmt_string(t), "endGMT": gmt_string(t + timedelta(minutes=30)),
+                         "activityLevel": float(rng.integers(0, 3))} for t in every(30)],
+        "sleepHeartRate": [{"value": int(rng.normal(55, 4)), "startGMT": epoch_ms(t)} for t in every(2)],
+        "hrvData": [{"value": float(rng.normal(60, 10)), "startGMT": epoch_ms(t)} for t in every(5)],
+        "wellnessEpochSPO2DataDTOList": [{"epochTimestamp": gmt_string(t), "spo2Reading": int(rng.normal(95, 1.5))}
+                                         for t in every(1)],
+        "wellnessEpochRespirationDataDTOList": [{"startTimeGMT": epoch_ms(t), "respirationValue": float(rng.normal(14, 1))}
+                                                for t in every(2)],
+        "sleepStress": [{"value": int(rng.uniform(5, 40)), "startGMT": epoch_ms(t)} for t in every(3)],
+        "restingHeartRate": int(rng.normal(50, 3))
+    }
+
+
+def synthetic_night_csv(onset, offset, rng):
+    """
+    ThingSpeak feed export for a night, a reading every 15 seconds with occasional dropouts
+    """
+    lines = ["created_at,entry_id,field1,field2"]
+    readings = int((offset - onset).total_seconds() // 15)
+    temperature = 18 + np.cumsum(rng.normal(0, 0.02, readings))
+    humidity = 55 + np.cumsum(rng.normal(0, 0.05, readings))
+    dropped = rng.random(readings) < 0.02
+
+    for i in range(readings):
+        if not dropped[i]:
+            moment = onset + timedelta(seconds=15 * i)
+            lines.append(f"{moment.strftime('%Y-%m-%d %H:%M:%S')} UTC,{i},{temperature[i]:.3f},{humidity[i]:.3f}")
+
+    return "\n".join(lines) + "\n"
+
+
+def synthetic_monitoring_db(path):
+    """
+    Monitoring database with the tables the analysis reads and no rows, so the actigraphy / beat interval /
+    SpO2 reads find nothing instead of failing
+    """
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS monitoring (timestamp DATETIME NOT NULL, intensity INTEGER)")
+        conn.execute("CREATE TABLE IF NOT EXISTS monitoring_hr (timestamp DATETIME NOT NULL, heart_rate INTEGER NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS monitoring_rr (timestamp DATETIME NOT NULL, rr FLOAT NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS monitoring_pulse_ox (timestamp DATETIME NOT NULL, pulse_ox FLOAT NOT NULL)")
+
+
+def make_synthetic_data(root, end_date, nights=synthetic_nights, seed=0):
+    """
+    Writes nights of synthetic data ending on end_date (YYYY-MM-DD) into root, laid out like the repository
+
+    Returns:
+    list: the dates written
+    """
+    rng = np.random.default_rng(seed)
+    end = datetime.strptime(end_date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    dates = [(end - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(nights)][::-1]
+
+    for folder in ["HealthData/Sleep", "HealthData/DBs", "data_handling/night_sensor_data"]:
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+    synthetic_monitoring_db(os.path.join(root, "HealthData/DBs/garmin_monitoring.db"))
+
+    metrics = ["Date, StDev_onset, StDev_offset, StDev_duration, IS, SJL, CPD, SRI, optimal_bedtime, optimal_waketime"]
+    for date in dates:
+        wake_day = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+        onset = wake_day + timedelta(minutes=int(rng.normal(-60, 40)))
+        offset = onset + timedelta(minutes=int(rng.normal(7.5 * 60, 45)))
+
+        with open(os.path.join(root, f"HealthData/Sleep/sleep_{date}.json"), "w") as file:
+            json.dump(synthetic_sleep_json(onset, offset, rng), file)
+        with open(os.path.join(root, f"data_handling/night_sensor_data/nightdata_{date}.csv"), "w") as file:
+            file.write(synthetic_night_csv(onset, offset, rng))
+
+        metrics.append(f"{date},{rng.uniform(20, 70)},{rng.uniform(20, 70)},{rng.uniform(20, 60)},"
+                       f"{rng.uniform(0, 1)},{rng.uniform(0, 2)},0,0,23:00,07:00")
+
+    with open(os.path.join(root, "data_handling/sleep_metrics.csv"), "w") as file:
+        file.write("\n".join(metrics) + "\n")
+
+    return dates
+
+
+#################################### SERVER ####################################
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(data_root, workers, threads, port, dashboard_date):
+    """
+    Starts gunicorn on web_app.app:app with data_root as working directory
+
+    Returns:
+    subprocess.Popen: the server, None if it didn't come up within server_start_timeout
+    """
+    env = dict(os.environ, PYTHONPATH=repo_root, SOMNA_DASHBOARD_DATE=dashboard_date)
+    command = [sys.executable, "-m", "gunicorn", "web_app.app:app", "--bind", f"127.0.0.1:{port}",
+               "--workers", str(workers), "--threads", str(threads), "--timeout", str(request_timeout),
+               "--log-level", "warning"]
+    server = subprocess.Popen(command, cwd=data_root, env=env)
+
+    deadline = time.time() + server_start_timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            print(f"gunicorn exited with code {server.returncode}")
+            return None
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=5) as response:
+                if response.status == 200:
+                    return server
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+
+    print("gunicorn didn't start in time")
+    stop_server(server)
+    return None
+
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+#################################### SESSIONS ####################################
+def callback_name(output):
+    """
+    Readable name of a callback from its output id ("..a.b...c.d@hash.." -> "a.b,c.d")
+    """
+    return ",".join(part.split("@")[0] for part in output.strip(".").split("..."))
+
+
+def output_spec(output):
+    specs = [{"id": part.split(".")[0], "property": part.split(".")[1].split("@")[0]}
+             for part in output.strip(".").split("...")]
+    return specs if output.startswith("..") else specs[0]
+
+
+class Viewer:
+    """
+    One simulated browser: keeps the values of the inputs it has seen and replays a session
+    """
+
+    def __init__(self, base_url, dependencies, dashboard_date, record, think_time, rng):
+        self.base_url = base_url
+        self.dependencies = dependencies
+        self.record = record
+        self.think_time = think_time
+        self.rng = rng
+        self.values = {
+            "tabs.value": "today",
+            "night-date.date": dashboard_date,
+            "history-nights.value": 7,
+            "version-interval.n_intervals": 0,
+            "live-interval.n_intervals": 0,
+        }
+        self.dashboard_date = dashboard_date
+
+    def request(self, name, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data,
+                                         headers={"Content-Type": "application/json"} if data else {})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=request_timeout) as response:
+                payload = response.read()
+                ok = response.status in (200, 204)
+        except (urllib.error.URLError, OSError):
+            payload, ok = b"", False
+        self.record(name, time.perf_counter() - start, ok)
+
+        return payload if ok else None
+
+    def fire(self, changed, initial=False):
+        """
+        Sends every callback triggered by the changed "id.property" inputs, as the browser would
+        """
+        for dependency in self.dependencies:
+            inputs = [f"{i['id']}.{i['property']}" for i in dependency["inputs"]]
+            if initial:
+                if dependency.get("prevent_initial_call"):
+                    continue
+            elif not set(inputs) & set(changed):
+                continue
+
+            body = {
+                "output": dependency["output"],
+                "outputs": output_spec(dependency["output"]),
+                "inputs": [{**i, "value": self.values.get(f"{i['id']}.{i['property']}")} for i in dependency["inputs"]],
+                "state": [{**s, "value": self.values.get(f"{s['id']}.{s['property']}")} for s in dependency["state"]],
+                "changedPropIds": [name for name in inputs if name in changed] or inputs[:1]
+            }
+            payload = self.request("callback " + callback_name(dependency["output"]), "/_dash-update-component", body)
+            if payload:
+                self.remember(payload)
+
+    def remember(self, payload):
+        """
+        Keeps plain (non Patch) outputs that other callbacks read, e.g. the data version and the live cursor
+        """
+        try:
+            response = json.loads(payload).get("response", {})
+        except ValueError:
+            return
+        for component, props in response.items():
+            for prop, value in props.items():
+                if not (isinstance(value, dict) and "__dash_patch_update" in value):
+                    self.values[f"{component}.{prop}"] = value
+
+    def set(self, name, value):
+        self.values[name] = value
+        self.fire([name])
+
+    def pause(self):
+        if self.think_time > 0:
+            time.sleep(self.rng.uniform(0, self.think_time))
+
+    def session(self):
+        for route in page_routes:
+            self.request("GET " + route, route)
+        self.fire([], initial=True)
+        self.pause()
+
+        self.set("tabs.value", "week")
+        self.pause()
+        self.set("history-nights.value", int(self.rng.choice([30, 90, 365])))
+        self.pause()
+        first = float(self.rng.uniform(0, 12))
+        self.set("sleep-history.relayoutData", {"xaxis.range[0]": first, "xaxis.range[1]": first + 6})
+        self.pause()
+
+        self.set("tabs.value", "today")
+        self.pause()
+        earlier = datetime.strptime(self.dashboard_date, "%Y-%m-%d") - timedelta(days=int(self.rng.integers(1, 14)))
+        self.set("night-date.date", earlier.strftime("%Y-%m-%d"))
+        self.pause()
+
+        for interval in ["version-interval.n_intervals", "live-interval.n_intervals"]:
+            self.set(interval, self.values[interval] + 1)
+
+
+#################################### RUN ####################################
+def fetch_dependencies(base_url):
+    with urllib.request.urlopen(base_url + "/_dash-dependencies", timeout=request_timeout) as response:
+        return json.loads(response.read())
+
+
+def run_load(base_url, dashboard_date, users, duration, think_time, seed=0):
+    """
+    Runs users concurrent viewers for duration seconds
+
+    Returns:
+    dict: {"requests", "errors", "seconds", "sessions", "latency": {name: [seconds]}}
+    """
+    dependencies = fetch_dependencies(base_url)
+    latency = {}
+    results = {"requests": 0, "errors": 0, "sessions": 0}
+    lock = threading.Lock()
+
+    def record(name, seconds, ok):
+        with lock:
+            results["requests"] += 1
+            if ok:
+                latency.setdefault(name, []).append(seconds)
+            else:
+                results["errors"] += 1
+
+    deadline = time.time() + duration
+
+    def viewer_loop(index):
+        rng = np.random.default_rng(seed + index)
+        while time.time() < deadline:
+            Viewer(base_url, dependencies, dashboard_date, record, think_time, rng).session()
+            with lock:
+                results["sessions"] += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=viewer_loop, args=(i,), daemon=True) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return {**results, "seconds": time.perf_counter() - start, "latency": latency}
+
+
+def latency_summary(samples):
+    """
+    Returns:
+    dict: {"count", "p50", "p95", "p99"} in milliseconds
+    """
+    p50, p95, p99 = np.percentile(np.asarray(samples) * 1000, [50, 95, 99])
+    return {"count": len(samples), "p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+def print_report(config, result):
+    throughput = result["requests"] / result["seconds"] if result["seconds"] else 0.0
+    print(f"\n{config}: {result['requests']} requests in {result['seconds']:.1f}s, {throughput:.1f} req/s, "
+          f"{result['sessions']} sessions, {result['errors']} errors")
+    print(f"    {'route / callback':<70} {'count':>6} {'p50':>8} {'p95':>8} {'p99':>8}  (ms)")
+    for name in sorted(result["latency"]):
+        summary = latency_summary(result["latency"][name])
+        print(f"    {name[:70]:<70} {summary['count']:>6} {summary['p50']:>8.1f} {summary['p95']:>8.1f} {summary['p99']:>8.1f}")
+
+
+def compare_configs(configs, users=default_users, duration=default_duration, think_time=default_think_time,
+                    nights=synthetic_nights, end_date=None, keep_data=False):
+    """
+    Runs the load against every workers x threads configuration on one synthetic data set
+
+    Returns:
+    dict: config -> {"throughput", "errors", "sessions", "routes": {name: latency_summary}}
+    """
+    end_date = end_date or datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    data_root = tempfile.mkdtemp(prefix="somna-load-")
+    make_synthetic_data(data_root, end_date, nights)
+    print(f"Synthetic data: {nights} nights ending {end_date} in {data_root}")
+
+    summary = {}
+    try:
+        for config in configs:
+            workers, threads = (int(n) for n in config.split("x"))
+            port = free_port()
+            server = start_server(data_root, workers, threads, port, end_date)
+            if server is None:
+                continue
+            try:
+                result = run_load(f"http://127.0.0.1:{port}", end_date, users, duration, think_time)
+            finally:
+                stop_server(server)
+
+            print_report(config, result)
+            summary[config] = {
+                "throughput": result["requests"] / result["seconds"],
+                "errors": result["errors"],
+                "sessions": result["sessions"],
+                "routes": {name: latency_summary(samples) for name, samples in result["latency"].items()}
+            }
+    finally:
+        if not keep_data:
+            shutil.rmtree(data_root, ignore_errors=True)
+
+    if summary:
+        print(f"\n{'config':<10} {'req/s':>8} {'sessions':>9} {'errors':>7} {'worst p95 (ms)':>15}")
+        for config, result in summary.items():
+            worst = max((route["p95"] for route in result["routes"].values()), default=float("nan"))
+            print(f"{config:<10} {result['throughput']:>8.1f} {result['sessions']:>9} {result['errors']:>7} {worst:>15.1f}")
+
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the dashboard under gunicorn with synthetic data")
+    parser.add_argument("--configs", nargs="+", default=default_configs, help="workers x threads, e.g. 2x4")
+    parser.add_argument("--users", type=int, default=default_users, help="concurrent viewers")
+    parser.add_argument("--duration", type=float, default=default_duration, help="seconds per configuration")
+    parser.add_argument("--think-time", type=float, default=default_think_time, help="longest pause between steps")
+    parser.add_argument("--nights", type=int, default=synthetic_nights, help="nights of synthetic data")
+    parser.add_argument("--end-date", default=None, help="last synthetic night, today by default")
+    parser.add_argument("--keep-data", action="store_true", help="keep the synthetic data directory")
+    parser.add_argument("--json", default=None, help="also write the summary to this file")
+    args = parser.parse_args()
+
+    results = compare_configs(args.configs, args.users, args.duration, args.think_time, args.nights,
+                              args.end_date, args.keep_data)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,91 @@
+"""
+Data behind the dashboard pages, as plain values (lists, floats, strings) the dashboard callbacks patch into
+the layout and the batch reports render. Paths are relative to the working directory, like the rest of the data code.
+"""
+
+import numpy as np
+
+from data_analysis.sleep_scores import optimal_bedtime, sleep_regularity_index, interdaily_stability, binary_sleep_wake_list
+from data_analysis.environment_score import diff_to_ideal, oxygen_recommendation
+from data_analysis.hrv import night_hrv
+from data_analysis.spo2 import night_spo2
+from data_analysis.sleep_correlations import load_store, what_affects_sleep
+from data_handling.resample import stack_nights, stacked_means, epoch_seconds
+
+
+def today_data(current_date_in_london):
+    """
+    Loads everything the 'today' page shows for a date, as plain values the callbacks patch into the layout
+    """
+    #################################### SLEEP DATA ####################################
+    # Load last 7 days of binary sleep data to display (1 = awake, 0 = asleep)
+    binary_sleep_data = binary_sleep_wake_list(f'{current_date_in_london}', 24, 7)
+
+    # Load Sleep Regularity Index (SRI) and Interdaily Stability (IS)
+    sri = sleep_regularity_index(current_date_in_london)
+    is_metric = interdaily_stability(current_date_in_london)
+
+    # Obtain recommended optimal bedtime and wake time
+    optimal_times = optimal_bedtime(f'{current_date_in_london}')
+
+    #################################### TEMP AND HUMIDITY ####################################
+    # Read night sensor data for temperature and humidity, resampled onto 5 minute epochs from sleep onset
+    # (time-weighted, so dropouts and uneven spacing don't bias the averages), the file is read once for both
+    try:
+        night = stack_nights([current_date_in_london])
+        epochs = night["grid_start"][0] + epoch_seconds * np.arange(night["values"].shape[1])
+        has_data = ~night["gap"][0].all(axis=1) | night["interpolated"][0].any(axis=1)
+        last_epoch = np.flatnonzero(has_data).max() + 1 if has_data.any() else 0
+        environment = {
+            "time": [str(t)[11:16] for t in epochs[:last_epoch].astype("datetime64[s]")],
+            # NaN breaks the lines across gaps, sent to the browser as null
+            "temperature": [None if np.isnan(v) else float(v) for v in night["values"][0, :last_epoch, 0]],
+            "humidity": [None if np.isnan(v) else float(v) for v in night["values"][0, :last_epoch, 1]]
+        }
+        avg_temperature, avg_humidity = (None if np.isnan(v) else float(v) for v in stacked_means(night)[0])
+    except FileNotFoundError:
+        environment = {"time": [], "temperature": [], "humidity": []}
+        avg_temperature, avg_humidity = None, None
+    except Exception as e:
+        raise RuntimeError(f"Error processing night sensor data: {e}")
+
+    # optimal temp and humidity data
+    if avg_temperature is not None and avg_humidity is not None:
+        environment_delta = diff_to_ideal(avg_temperature, avg_humidity)
+    else:
+        environment_delta = {"temperature_difference": None, "humidity_difference": None,
+                             "temperature_intervention": "No bedroom data for this night.",
+                             "humidity_intervention": "No bedroom data for this night."}
+
+    #################################### OVERNIGHT HRV ####################################
+    hrv_summary = night_hrv(current_date_in_london)["summary"]
+
+    #################################### OVERNIGHT SPO2 ####################################
+    spo2_summary = night_spo2(current_date_in_london)["summary"]
+    oxygen_intervention = oxygen_recommendation(spo2_summary, environment_delta["temperature_difference"],
+                                                environment_delta["humidity_difference"])
+
+    return {
+        "bedtime": optimal_times['bedtime'],
+        "wake_time": optimal_times['wake_time'],
+        "sri": sri,
+        "is": is_metric,
+        "heatmap": binary_sleep_data,
+        "environment": environment,
+        "avg_temperature": avg_temperature,
+        "avg_humidity": avg_humidity,
+        **environment_delta,
+        "hrv": hrv_summary,
+        "spo2": spo2_summary,
+        "oxygen_intervention": oxygen_intervention
+    }
+
+
+def week_data():
+    """
+    Loads the 'week' page data from the correlation store the scheduler keeps up to date
+    (data_analysis.sleep_correlations), nothing is computed here
+    """
+    store = load_store()
+
+    return {"drivers": what_affects_sleep(store, outcome="sleep_score")}
@@ -0,0 +1,175 @@
+"""
+Opt-in sampling profiler for the dashboard server
+- a fraction of requests (SOMNA_PROFILE_RATE, 0 disables the profiler) is marked as sampled when it starts
+- one background thread wakes every SOMNA_PROFILE_INTERVAL milliseconds, reads the current frame of each
+  sampled request's thread (sys._current_frames) and counts the stack, nothing is traced or instrumented, so
+  unsampled requests run at full speed and sampled ones only pay for the occasional stack walk
+- stacks are labelled with the route, or for Dash callbacks with the callback's outputs, and aggregated in
+  collapsed-stack format ("label;module:function;... count" per line), which flamegraph.pl and speedscope read
+- GET /admin/profile returns the stacks collected so far (?reset=1 clears them), it needs the
+  SOMNA_PROFILE_TOKEN token in the X-Profile-Token header or the token parameter and is not registered without one
+"""
+
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import Response, abort, request
+
+profile_rate = float(os.environ.get("SOMNA_PROFILE_RATE", "0"))
+profile_interval = float(os.environ.get("SOMNA_PROFILE_INTERVAL", "10")) / 1000
+profile_token = os.environ.get("SOMNA_PROFILE_TOKEN")
+
+max_stack_depth = 64
+max_stacks = 20000  # distinct stacks kept, later new ones are counted under one overflow line
+overflow_stack = "[other stacks]"
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of the threads that are serving sampled requests
+    """
+
+    def __init__(self, rate=profile_rate, interval=profile_interval):
+        self.rate = rate
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = time.time()
+        self._active = {}  # thread ident -> label of the request it is serving
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def begin(self, label):
+        """
+        Called at the start of a request, marks the current thread as sampled for a fraction of requests
+
+        Parameters:
+        - label (callable): returns the request's label, only called for sampled requests
+        """
+        if random.random() < self.rate:
+            self._active[threading.get_ident()] = label()
+
+    def end(self):
+        self._active.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            if self._active:
+                self.sample()
+
+    def sample(self):
+        frames = sys._current_frames()
+        collapsed = []
+        for ident, label in list(self._active.items()):
+            frame = frames.get(ident)
+            if frame is not None:
+                collapsed.append(collapse_stack(label, frame))
+
+        with self._lock:
+            for stack in collapsed:
+                if stack not in self.stacks and len(self.stacks) >= max_stacks:
+                    stack = overflow_stack
+                self.stacks[stack] += 1
+            self.samples += len(collapsed)
+
+    def collapsed(self, reset=False):
+        """
+        Returns:
+        str: one "stack count" line per distinct stack, most frequent first
+        """
+        with self._lock:
+            lines = [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+            if reset:
+                self.stacks.clear()
+                self.samples = 0
+                self.started_at = time.time()
+
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+def frame_name(frame):
+    code = frame.f_code
+    module = frame.f_globals.get("__name__") or os.path.basename(code.co_filename)
+    return f"{module}:{code.co_name}"
+
+
+def collapse_stack(label, frame):
+    """
+    Collapsed stack of a frame, outermost call first, prefixed with the request label
+    """
+    names = []
+    while frame is not None and len(names) < max_stack_depth:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+
+    # ";" separates frames and the last space separates the count, neither may appear inside a name
+    return ";".join([label] + names[::-1]).replace(" ", "_")
+
+
+def request_label():
+    """
+    Route of the current request, Dash callbacks are told apart by their outputs
+    """
+    if request.path.endswith("/_dash-update-component"):
+        body = request.get_json(silent=True) or {}
+        return "callback:" + str(body.get("output", "unknown")).strip(".")
+
+    return request.method + ":" + request.path
+
+
+def install_profiler(server, rate=profile_rate, token=profile_token, interval=profile_interval):
+    """
+    Adds the profiler to a Flask server if profiling is enabled (rate > 0)
+
+    Parameters:
+    - server (flask.Flask): e.g. app.server of the Dash app
+    - rate (float): fraction of requests sampled
+    - token (str): secret for the admin route, the route isn't registered without one
+    - interval (float): seconds between samples
+
+    Returns:
+    - SamplingProfiler: None if profiling is disabled
+    """
+    if rate <= 0:
+        return None
+
+    profiler = SamplingProfiler(rate, interval)
+
+    @server.before_request
+    def begin_sample():
+        profiler.begin(request_label)
+
+    @server.teardown_request
+    def end_sample(exception=None):
+        profiler.end()
+
+    if token:
+        @server.route("/admin/profile")
+        def download_profile():
+            given = request.headers.get("X-Profile-Token") or request.args.get("token") or ""
+            if not hmac.compare_digest(given.encode(), token.encode()):
+                abort(403)
+
+            headers = {
+                "Content-Disposition": "attachment; filename=somna-profile.collapsed",
+                "X-Profile-Samples": str(profiler.samples),
+                "X-Profile-Seconds": f"{time.time() - profiler.started_at:.0f}"
+            }
+            body = profiler.collapsed(reset=request.args.get("reset") == "1")
+            return Response(body, mimetype="text/plain", headers=headers)
+    else:
+        print("Profiling enabled without SOMNA_PROFILE_TOKEN, the /admin/profile route is not available")
+
+    profiler.start()
+    return profiler
@@ -0,0 +1,339 @@
+"""
+Batch generator for the weekly HTML reports
+- a report holds the dashboard's sleep/wake heatmap, the bedroom environment trend, the metric cards and the
+  advice for the week ending on a date, built by the same page loaders and figure functions as the dashboard
+  (web_app.page_loaders, web_app.figures) and written as one self-contained HTML file
+- every user is a data directory laid out like the repository (HealthData/, data_handling/...), the data code
+  reads paths relative to the working directory, so each user is rendered in its own process that changes
+  into that directory
+- processes are forked from the parent with the heavy imports and the Plotly JS bundle already loaded, the
+  children share that one copy (copy on write) instead of each loading their own. A fresh process per user
+  also keeps one user's caches from leaking into the next user's reports.
+- a signature of every rendered report's inputs is kept in a manifest: the snapshot entries of the week's night
+  sensor files and the size / mtime of its sleep JSONs and their index files. Reports whose signature hasn't
+  changed since the last run (and whose file still exists) are skipped. The data version alone can't tell, the
+  scheduler bumps it on every sync whether or not a past week changed.
+
+Run from the repository root:
+    python -m web_app.reports --user me=. --user alex=/srv/somna/alex --weeks 4 --out reports
+"""
+
+import argparse
+import hashlib
+import html
+import json
+import multiprocessing
+import os
+import threading
+from datetime import datetime, timedelta
+
+from data_handling.data_recall import date_list, night_sensor_file
+from data_handling.data_version import read_data_version, version_path
+from data_handling.sleep_index import json_path, index_path
+from data_handling.snapshots import pinned, generations_path
+from web_app.page_loaders import today_data
+from web_app.figures import temperature_humidity_figure, heatmap_figure, difference_colours, format_value
+
+report_dir = "reports"
+manifest_name = "report_manifest.json"
+default_weeks = 1
+report_nights = 7  # nights a report reads, the heatmap and the regularity metrics cover the last week
+
+# the Plotly JS bundle, loaded once by the parent before the worker processes are forked
+_plotly_js = None
+
+card_style = ("font-family: Arial, sans-serif; font-size: 18px; text-align: center; border: 2px solid black; "
+              "padding: 15px; margin: 10px; width: 200px; display: inline-block; "
+              "box-shadow: 3px 3px 10px rgba(0,0,0,0.2); background-color: {background}")
+advice_style = ("font-family: Arial, sans-serif; font-size: 16px; text-align: center; border: 2px solid black; "
+                "padding: 15px; margin: 10px; width: 300px; display: inline-block; vertical-align: top; "
+                "background-color: #fffbea; box-shadow: 3px 3px 10px rgba(0,0,0,0.2)")
+
+
+#################################### PLANNING ####################################
+def week_ends(end_date, weeks=default_weeks):
+    """
+    Last day of each of the weeks up to end_date, most recent first
+
+    Returns:
+    list: dates, YYYY-MM-DD
+    """
+    end = datetime.strptime(end_date, "%Y-%m-%d")
+    return [(end - timedelta(days=7 * week)).strftime("%Y-%m-%d") for week in range(weeks)]
+
+
+def report_path(out_dir, user, week_end):
+    return os.path.join(out_dir, user, f"report_{week_end}.html")
+
+
+def read_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, manifest_name), "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_manifest(manifest, out_dir):
+    path = os.path.join(out_dir, manifest_name)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def published_manifest(root, version):
+    """
+    Snapshot manifest a user's published data version reads through (data_handling.snapshots.read_manifest
+    for a data directory other than the working directory)
+
+    Returns:
+    dict: {logical path: object path or None}, empty without snapshots
+    """
+    directory = os.path.join(root, generations_path)
+    try:
+        generations = [int(name[:-len(".json")]) for name in os.listdir(directory)
+                       if name.endswith(".json") and name[:-len(".json")].isdigit()]
+    except FileNotFoundError:
+        return {}
+
+    generations = [g for g in generations if g <= version]
+    if not generations:
+        return {}
+    try:
+        with open(os.path.join(directory, f"{max(generations)}.json"), "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def report_signature(root, week_end, files):
+    """
+    Signature of the inputs of a week's report: the snapshot object (or file stat) of each night sensor
+    file and the stat of each sleep JSON and its index
+
+    Parameters:
+    - root (str): user's data directory
+    - week_end (str): YYYY-MM-DD
+    - files (dict): published_manifest of the user
+
+    Returns:
+    - str: hex digest
+    """
+    def stat(path):
+        try:
+            info = os.stat(os.path.join(root, path))
+        except FileNotFoundError:
+            return None
+        return [info.st_size, info.st_mtime_ns]
+
+    inputs = []
+    for date in date_list(week_end, report_nights):
+        night = night_sensor_file(date)
+        inputs.append([files[night] if night in files else stat(night), stat(json_path(date)), stat(index_path(date))])
+
+    return hashlib.sha1(json.dumps(inputs).encode()).hexdigest()
+
+
+def plan_reports(users, dates, out_dir, manifest, force=False):
+    """
+    Works out which reports need rendering
+
+    Parameters:
+    - users (dict): user name -> data directory
+    - dates (list): week end dates
+    - out_dir (str): report directory
+    - manifest (dict): "user/date" -> report_signature of the inputs the report was rendered from
+    - force (bool): render everything
+
+    Returns:
+    - tuple: (list of (user, data directory, data version, {date: signature}) tasks, number of reports skipped)
+    """
+    tasks = []
+    skipped = 0
+    for user, root in users.items():
+        version = read_data_version(os.path.join(root, version_path))
+        files = published_manifest(root, version)
+        signatures = {date: report_signature(root, date, files) for date in dates}
+        due = {date: signature for date, signature in signatures.items()
+               if force or manifest.get(f"{user}/{date}") != signature
+               or not os.path.exists(report_path(out_dir, user, date))}
+        skipped += len(dates) - len(due)
+        if due:
+            tasks.append((user, root, version, due))
+
+    return tasks, skipped
+
+
+#################################### RENDERING ####################################
+def metric_cards(today):
+    """
+    The dashboard's value boxes for a week as (label, value, background) tuples
+    """
+    temperature_colour, humidity_colour = difference_colours(today["temperature_difference"],
+                                                             today["humidity_difference"])
+    return [
+        ("Bedtime", today["bedtime"], "#f0f0f0"),
+        ("Wake Time", today["wake_time"], "#f0f0f0"),
+        ("Avg Temp (°C)", format_value(today["avg_temperature"]), "#eaf7ff"),
+        ("Temp Difference (°C)", format_value(today["temperature_difference"]), temperature_colour),
+        ("Avg Humidity (%)", format_value(today["avg_humidity"]), "#eaf7ff"),
+        ("Humidity Difference (%)", format_value(today["humidity_difference"]), humidity_colour),
+        ("Overnight RMSSD (ms)", format_value(today["hrv"]["rmssd"]), "#eaf7ff"),
+        ("Overnight SDNN (ms)", format_value(today["hrv"]["sdnn"]), "#eaf7ff"),
+        ("Overnight pNN50 (%)", format_value(today["hrv"]["pnn50"]), "#eaf7ff"),
+        ("Oxygen Dips per Hour", format_value(today["spo2"]["odi"]), "#eaf7ff"),
+        ("Lowest SpO2 (%)", format_value(today["spo2"]["nadir"]), "#eaf7ff"),
+        ("Time Below 90% SpO2 (min)", format_value(today["spo2"]["below_90"]), "#eaf7ff")
+    ]
+
+
+def report_html(user, week_end, today, plotly_js):
+    """
+    Self-contained HTML report for the week ending on week_end, the Plotly JS bundle is inlined once
+
+    Parameters:
+    - user (str): shown in the title
+    - week_end (str): YYYY-MM-DD
+    - today (dict): today_data for week_end
+    - plotly_js (str): the Plotly JS bundle
+
+    Returns:
+    - str: HTML document
+    """
+    figures = [heatmap_figure(today["heatmap"]), temperature_humidity_figure(today["environment"])]
+    plots = "\n".join(f'<div style="display: flex; justify-content: center; margin: 20px">'
+                      f'{figure.to_html(full_html=False, include_plotlyjs=False)}</div>' for figure in figures)
+
+    cards = "\n".join(f'<div style="{card_style.format(background=background)}"><div style="font-weight: bold">'
+                      f'{html.escape(str(value))}</div><div style="font-size: 16px">{html.escape(label)}</div></div>'
+                      for label, value, background in metric_cards(today))
+
+    advice = "\n".join(f'<div style="{advice_style}"><div style="font-weight: bold; margin-bottom: 10px">'
+                       f'{html.escape(title)}</div><div>{html.escape(str(text))}</div></div>'
+                       for title, text in [("Temperature Advice", today["temperature_intervention"]),
+                                           ("Humidity Advice", today["humidity_intervention"]),
+                                           ("Breathing Advice", today["oxygen_intervention"])])
+
+    title = f"Sleep report for {user}, week ending {week_end}"
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{html.escape(title)}</title>
+<script type="text/javascript">{plotly_js}</script>
+</head>
+<body style="text-align: center; font-family: Arial, sans-serif">
+<h1>{html.escape(title)}</h1>
+{plots}
+<div>{cards}</div>
+<div>{advice}</div>
+</body>
+</html>
+"""
+
+
+def render_user_reports(task):
+    """
+    Renders one user's due reports, runs in a worker process
+
+    Parameters:
+    - task (tuple): (user, data directory, data version, {week end date: input signature}, report directory)
+
+    Returns:
+    - list: (manifest key, input signature or None if it failed, error message or None) per report
+    """
+    user, root, version, dates, out_dir = task
+    os.chdir(root)
+    os.makedirs(os.path.join(out_dir, user), exist_ok=True)
+
+    results = []
+    for date in dates:
+        key = f"{user}/{date}"
+        try:
+            with pinned(version):
+                document = report_html(user, date, today_data(date), _plotly_js)
+            path = report_path(out_dir, user, date)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                file.write(document)
+            os.replace(tmp_path, path)
+            results.append((key, dates[date], None))
+        except Exception as e:
+            results.append((key, None, str(e)))
+
+    return results
+
+
+def generate_reports(users, dates, out_dir=report_dir, workers=None, force=False):
+    """
+    Renders the due reports of every user across a pool of forked processes
+
+    Parameters:
+    - users (dict): user name -> data directory
+    - dates (list): week end dates, YYYY-MM-DD
+    - out_dir (str): report directory
+    - workers (int): processes, one per CPU by default
+    - force (bool): re-render reports whose data hasn't changed
+
+    Returns:
+    - dict: {"rendered": int, "skipped": int, "failed": int}
+    """
+    global _plotly_js
+
+    # absolute paths, the workers change directory
+    out_dir = os.path.abspath(out_dir)
+    users = {user: os.path.abspath(root) for user, root in users.items()}
+    os.makedirs(out_dir, exist_ok=True)
+
+    manifest = read_manifest(out_dir)
+    tasks, skipped = plan_reports(users, dates, out_dir, manifest, force)
+    summary = {"rendered": 0, "skipped": skipped, "failed": 0}
+    if not tasks:
+        return summary
+
+    # loaded here so the forked workers share the parent's copy instead of loading their own
+    import pandas  # the data code imports it on first use
+    from plotly.offline import get_plotlyjs
+    _plotly_js = get_plotlyjs()
+
+    # one fresh process per user (maxtasksperchild=1): the data caches are module level and keyed by date and
+    # data version, which different users share
+    context = multiprocessing.get_context("fork")
+    with context.Pool(workers or os.cpu_count(), maxtasksperchild=1) as pool:
+        for results in pool.imap_unordered(render_user_reports, [task + (out_dir,) for task in tasks]):
+            for key, signature, error in results:
+                if error is None:
+                    manifest[key] = signature
+                    summary["rendered"] += 1
+                else:
+                    print(f"Report {key} failed with error: {error}")
+                    summary["failed"] += 1
+            # written after every user, an interrupted run keeps what it finished
+            write_manifest(manifest, out_dir)
+
+    return summary
+
+
+def parse_user(value):
+    name, _, root = value.partition("=")
+    if not name or not root:
+        raise argparse.ArgumentTypeError(f"expected NAME=DATA_DIRECTORY, got {value!r}")
+    return name, root
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the weekly HTML sleep reports for many users")
+    parser.add_argument("--user", type=parse_user, action="append", default=None,
+                        help="NAME=DATA_DIRECTORY, repeat for more users (default: me=.)")
+    parser.add_argument("--end-date", default=None, help="last day of the latest week, yesterday by default")
+    parser.add_argument("--weeks", type=int, default=default_weeks, help="weeks per user, counting back from the end date")
+    parser.add_argument("--out", default=report_dir, help="report directory")
+    parser.add_argument("--workers", type=int, default=None, help="processes, one per CPU by default")
+    parser.add_argument("--force", action="store_true", help="re-render reports whose data hasn't changed")
+    args = parser.parse_args()
+
+    end_date = args.end_date or (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+    summary = generate_reports(dict(args.user or [("me", ".")]), week_ends(end_date, args.weeks), args.out,
+                               args.workers, args.force)
+    print(f"{summary['rendered']} report(s) rendered, {summary['skipped']} unchanged, {summary['failed']} failed")
@@ -0,0 +1,209 @@
+"""
+Long-range sleep/wake heatmap rendered as an image instead of a cell-per-epoch Plotly heatmap
+- the (nights x 1440 minutes) sleep/wake matrix is kept bit-packed (180 bytes per night)
+- it is rasterised server-side into RGB tiles of tile_nights nights per zoom level (minutes per pixel column),
+  tiles are cached per data version so scrolling / zooming only renders what is new
+- the image is sent as a small PNG (written with zlib, no imaging library needed) inside a go.Image trace
+- short ranges still get the interactive go.Heatmap with per-cell hover
+"""
+
+import base64
+import struct
+import threading
+import zlib
+
+import numpy as np
+import plotly.graph_objects as go
+
+from data_handling.data_recall import sleep_windows
+from data_handling.data_version import current_data_version
+from data_handling.snapshots import pinned
+from data_analysis.sleep_scores import sleep_wake_matrix
+
+minutes_per_day = 24 * 60
+
+# minutes per pixel column, finest first
+zoom_levels = (1, 5, 15, 60)
+max_columns = 720           # widest image sent to the browser
+tile_nights = 32
+interactive_max_nights = 14  # ranges up to this many nights use the interactive cell heatmap
+
+# RGB colours, matching the today page heatmap
+sleep_colour = np.array([0, 128, 0])        # green
+awake_colour = np.array([173, 216, 230])    # lightblue
+missing_colour = np.array([235, 235, 235])
+
+# (version, tile index, zoom) -> RGB tile
+_tile_cache = {}
+_tile_lock = threading.Lock()
+
+
+def packed_sleep_rows(dates):
+    """
+    Bit-packed minute-level sleep/wake rows for a list of nights
+
+    Returns:
+    tuple: (packed uint8 (nights x 180), valid bool per night). Bits are 1 for awake, 0 for asleep.
+    """
+    windows = sleep_windows(dates)
+    matrix = sleep_wake_matrix(windows["onset_minute"], windows["offset_minute"], minutes_per_day)
+
+    return np.packbits(matrix.astype(np.uint8), axis=1), windows["valid"]
+
+
+def tile_dates(tile):
+    """
+    Dates of a tile, tiles are fixed blocks of tile_nights days counted from 1970-01-01 so they can be reused
+    """
+    first = np.datetime64(0, "D") + np.timedelta64(tile * tile_nights, "D")
+    return [str(first + np.timedelta64(i, "D")) for i in range(tile_nights)]
+
+
+def render_rows(packed, valid, zoom):
+    """
+    Rasterises packed rows: each pixel column is the share of its zoom minutes spent awake
+
+    Returns:
+    np.ndarray: uint8 RGB image (nights x 1440 / zoom x 3)
+    """
+    minutes = np.unpackbits(packed, axis=1, count=minutes_per_day).astype(float)
+    awake_share = minutes.reshape(len(minutes), minutes_per_day // zoom, zoom).mean(axis=2)
+
+    rgb = sleep_colour + awake_share[..., None] * (awake_colour - sleep_colour)
+    rgb[~valid] = missing_colour
+
+    return rgb.astype(np.uint8)
+
+
+def raster_tile(tile, zoom, version):
+    """
+    RGB tile of a data version, rendered from that version's snapshot so the cache key matches what was read
+    """
+    key = (version, tile, zoom)
+    with _tile_lock:
+        if key in _tile_cache:
+            return _tile_cache[key]
+
+    # rendered outside the lock, two requests for the same new tile both render it and the second insert wins
+    with pinned(version):
+        packed, valid = packed_sleep_rows(tile_dates(tile))
+    rgb = render_rows(packed, valid, zoom)
+
+    with _tile_lock:
+        # tiles of older data versions are never asked for again
+        for stale in [k for k in _tile_cache if k[0] < version]:
+            del _tile_cache[stale]
+        _tile_cache[key] = rgb
+
+    return rgb
+
+
+def choose_zoom(minute_span):
+    """
+    Finest zoom level that fits minute_span minutes into max_columns pixel columns
+    """
+    for zoom in zoom_levels:
+        if minute_span / zoom <= max_columns:
+            return zoom
+
+    return zoom_levels[-1]
+
+
+def raster_image(end_date, nights, zoom, version=None):
+    """
+    Image of the nights ending on end_date (oldest first), assembled from cached tiles
+
+    Returns:
+    np.ndarray: uint8 RGB (nights x 1440 / zoom x 3)
+    """
+    version = current_data_version() if version is None else version
+    last_day = int(np.datetime64(end_date, "D").astype(np.int64))
+    first_day = last_day - nights + 1
+
+    tiles = range(first_day // tile_nights, last_day // tile_nights + 1)
+    image = np.concatenate([raster_tile(tile, zoom, version) for tile in tiles])
+
+    offset = first_day - tiles[0] * tile_nights
+    return image[offset:offset + nights]
+
+
+def png_bytes(rgb):
+    """
+    Encodes an RGB uint8 array as a PNG with zlib
+
+    Returns:
+    bytes: PNG file contents
+    """
+    height, width, _ = rgb.shape
+    # every scanline starts with filter type 0 (none)
+    raw = np.concatenate([np.zeros((height, 1), dtype=np.uint8), rgb.reshape(height, -1)], axis=1).tobytes()
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 9)) + chunk(b"IEND", b"")
+
+
+def png_data_uri(rgb):
+    return "data:image/png;base64," + base64.b64encode(png_bytes(rgb)).decode("ascii")
+
+
+def raster_trace_update(end_date, nights, minute_range=None):
+    """
+    Image trace properties for a range, at the zoom level that fits the visible minutes
+
+    Parameters:
+    - end_date (str): last night, YYYY-MM-DD
+    - nights (int): number of nights
+    - minute_range (tuple): visible (first, last) minute of the day, the whole day by default
+
+    Returns:
+    - dict: {"source", "x0", "dx", "y0", "dy"} for a go.Image trace
+    """
+    first, last = minute_range or (0, minutes_per_day)
+    first, last = max(0, int(first)), min(minutes_per_day, int(np.ceil(last)))
+    zoom = choose_zoom(max(last - first, 1))
+
+    image = raster_image(end_date, nights, zoom)
+    columns = slice(first // zoom, -(-last // zoom))
+
+    return {
+        "source": png_data_uri(np.ascontiguousarray(image[:, columns])),
+        "x0": (columns.start + 0.5) * zoom / 60,
+        "dx": zoom / 60,
+        "y0": 0,
+        "dy": 1
+    }
+
+
+def sleep_history_figure(end_date, nights):
+    """
+    Sleep/wake history figure: the interactive cell heatmap for short ranges, a raster image for long ones
+    """
+    dates = [str(np.datetime64(end_date, "D") - np.timedelta64(i, "D")) for i in range(nights)][::-1]
+
+    if nights <= interactive_max_nights:
+        packed, valid = packed_sleep_rows(dates)
+        hourly = np.unpackbits(packed, axis=1, count=minutes_per_day).reshape(nights, 24, 60).mean(axis=2)
+        hourly[~valid] = np.nan
+        trace = go.Heatmap(
+            z=hourly, x=np.arange(24) + 0.5, y=dates,
+            colorscale=[[0, "green"], [1, "lightblue"]], zmin=0, zmax=1,
+            hovertemplate="%{y} %{x:.0f}:00<br>awake %{z:.0%}<extra></extra>"
+        )
+    else:
+        trace = go.Image(**raster_trace_update(end_date, nights), hoverinfo="skip")
+
+    figure = go.Figure(data=trace)
+    figure.update_layout(
+        title={'text': f"Sleep/Wake History (Last {nights} Nights)", 'x': 0.5, 'xanchor': 'center', 'yanchor': 'top'},
+        xaxis=dict(title="Hour of the Day", range=[0, 24], tickmode="array", tickvals=list(range(0, 25, 3))),
+        yaxis=dict(title="Night", autorange="reversed",
+                   showticklabels=nights <= interactive_max_nights),
+        template="plotly_white",
+        height=300 if nights <= interactive_max_nights else 500,
+        width=700
+    )
+
+    return figure